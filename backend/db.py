@@ -1,94 +1,276 @@
 # db.py
 """
 MongoDB connection setup for the backend. Uses a singleton pattern to ensure only one client instance.
+
+Request handlers use an AgentRepository (see get_agent_repository): MongoAgentRepository runs
+on a pooled AsyncMongoClient with a unique index on agent_name, and InMemoryAgentRepository is
+a dict-backed stand-in for tests and benchmarks (AGENTWEAVE_DB_BACKEND=memory).
 """
-from pymongo import MongoClient
-from typing import Optional
+import os
+import copy
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional
 from pydantic import BaseModel, Field
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "agentweave")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+DB_BACKEND = os.getenv("AGENTWEAVE_DB_BACKEND", "mongodb")
+
+class AgentConfigModel(BaseModel):
+    agent_name: str = Field(...)
+    agent_description: str = Field(...)
+    agent_prompt: str = Field(...)
+    mcp_address: str = Field(...)
+    mcp_transport_type: str = Field(...)
+    host: str = Field(...)
+    port: int = Field(...)
+    # Messages kept per task (oldest dropped first); None uses TASK_HISTORY_MAX_LENGTH
+    history_max_length: Optional[int] = None
+    # Tasks run at once (others queue); None uses AGENT_MAX_CONCURRENT_TASKS, 0 is unlimited
+    max_concurrent_tasks: Optional[int] = None
+    # Optionally, add an id field for MongoDB's _id
+    id: Optional[str] = None
+
+
+class DuplicateAgentError(ValueError):
+    """Raised when inserting an agent whose agent_name already exists."""
+
+
+def _agent_from_doc(doc: dict) -> AgentConfigModel:
+    doc["id"] = str(doc.pop("_id"))
+    return AgentConfigModel(**doc)
+
+
+class AgentRepository(ABC):
+    """Async data access for agent configs and the LLM provider config."""
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def list_agents(self) -> List[AgentConfigModel]:
+        pass
+
+    @abstractmethod
+    async def list_agent_fields(self, fields: Iterable[str]) -> List[Dict[str, Any]]:
+        """Return only the given fields of every agent (a projection, no model validation)."""
+        pass
+
+    @abstractmethod
+    async def get_agent(self, agent_name: str) -> Optional[AgentConfigModel]:
+        pass
+
+    @abstractmethod
+    async def insert_agent(self, agent_config: AgentConfigModel) -> str:
+        pass
+
+    @abstractmethod
+    async def delete_agent(self, agent_name: str) -> int:
+        pass
+
+    @abstractmethod
+    async def update_agent_port(self, agent_name: str, port: int) -> int:
+        pass
+
+    @abstractmethod
+    async def upsert_agents(self, agent_configs: Iterable[AgentConfigModel]) -> int:
+        """Insert or update many agents (matched by agent_name) in one round trip.
+        Returns the number of agents inserted or changed."""
+        pass
+
+    @abstractmethod
+    async def get_llm_provider_config(self) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def save_llm_provider_config(self, config: dict) -> str:
+        pass
+
+
+class MongoAgentRepository(AgentRepository):
+    def __init__(self, uri: str = MONGODB_URI, db_name: str = MONGODB_DB_NAME, max_pool_size: int = MONGODB_MAX_POOL_SIZE):
+        from pymongo import AsyncMongoClient
+        self._client = AsyncMongoClient(uri, maxPoolSize=max_pool_size)
+        self._db = self._client[db_name]
+        self._agents = self._db["agents"]
+        self._llm_config = self._db["llm_provider_config"]
+
+    @property
+    def database(self):
+        return self._db
+
+    async def ensure_indexes(self):
+        # A database from before the unique index may hold several agents with the same name;
+        # creating the index would fail, so leave it out until they are cleaned up
+        cursor = await self._agents.aggregate([
+            {"$group": {"_id": "$agent_name", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ])
+        duplicates = await cursor.to_list(None)
+        if duplicates:
+            names = ", ".join(f"{doc['_id']} ({doc['count']})" for doc in duplicates)
+            logger.error(f"Not creating the unique agent_name index, duplicate agents found: {names}")
+            return
+        from pymongo.errors import OperationFailure
+        try:
+            await self._agents.create_index("agent_name", unique=True)
+        except OperationFailure as e:
+            logger.error(f"Could not create the unique agent_name index: {e}")
+
+    async def list_agents(self) -> List[AgentConfigModel]:
+        return [_agent_from_doc(doc) async for doc in self._agents.find()]
+
+    async def list_agent_fields(self, fields: Iterable[str]) -> List[Dict[str, Any]]:
+        projection = {field: 1 for field in fields}
+        projection["_id"] = 0
+        return await self._agents.find({}, projection).to_list(None)
 
-class MongoDBClient:
-    _instance: Optional[MongoClient] = None
-
-    @classmethod
-    def get_client(cls) -> MongoClient:
-        if cls._instance is None:
-            cls._instance = MongoClient("mongodb://localhost:27017")
-        return cls._instance
-
-    @classmethod
-    def get_database(cls, db_name: str):
-        client = cls.get_client()
-        return client[db_name]
-
-    @classmethod
-    def get_agent_collection(cls):
-        db = cls.get_database("agentweave")  # Use your DB name
-        return db["agents"]  # Collection name: agents
-
-    @classmethod
-    def save_agent_config(cls, agent_config: "AgentConfigModel") -> str:
-        collection = cls.get_agent_collection()
-        data = agent_config.dict(exclude_none=True)
-        result = collection.insert_one(data)
+    async def get_agent(self, agent_name: str) -> Optional[AgentConfigModel]:
+        doc = await self._agents.find_one({"agent_name": agent_name})
+        return _agent_from_doc(doc) if doc else None
+
+    async def insert_agent(self, agent_config: AgentConfigModel) -> str:
+        from pymongo.errors import DuplicateKeyError
+        try:
+            result = await self._agents.insert_one(agent_config.dict(exclude_none=True))
+        except DuplicateKeyError:
+            raise DuplicateAgentError(f"Agent with name '{agent_config.agent_name}' already exists.")
         return str(result.inserted_id)
 
-    @classmethod
-    def get_all_agents(cls):
-        collection = cls.get_agent_collection()
-        agents = list(collection.find())
-        # Convert ObjectId to string for each agent and return as AgentConfigModel
-        agent_models = []
-        for agent in agents:
-            agent["id"] = str(agent.pop("_id"))
-            agent_models.append(AgentConfigModel(**agent))
-        return agent_models
-
-    @classmethod
-    def delete_agent_by_name(cls, agent_name: str) -> int:
-        collection = cls.get_agent_collection()
-        result = collection.delete_one({"agent_name": agent_name})
+    async def delete_agent(self, agent_name: str) -> int:
+        result = await self._agents.delete_one({"agent_name": agent_name})
         return result.deleted_count
 
-    @staticmethod
-    def update_agent_port_by_name(agent_name, new_port):
-        """
-        Update the port of an agent by agent_name.
-        """
-        from pymongo import MongoClient
-        client = MongoClient("mongodb://localhost:27017/")
-        db = client["agentweave"]
-        agents = db["agents"]
-        result = agents.update_one({"agent_name": agent_name}, {"$set": {"port": new_port}})
+    async def update_agent_port(self, agent_name: str, port: int) -> int:
+        result = await self._agents.update_one({"agent_name": agent_name}, {"$set": {"port": port}})
         return result.modified_count
 
-    @classmethod
-    def get_llm_provider_collection(cls):
-        db = cls.get_database("agentweave")
-        return db["llm_provider_config"]
-
-    @classmethod
-    def save_llm_provider_config(cls, config: dict) -> str:
-        collection = cls.get_llm_provider_collection()
-        collection.delete_many({})  # Only keep one config document
-        result = collection.insert_one(config)
-        return str(result.inserted_id)
+    async def upsert_agents(self, agent_configs: Iterable[AgentConfigModel]) -> int:
+        from pymongo import UpdateOne
+        ops = [
+            UpdateOne({"agent_name": a.agent_name}, {"$set": a.dict(exclude_none=True, exclude={"id"})}, upsert=True)
+            for a in agent_configs
+        ]
+        if not ops:
+            return 0
+        result = await self._agents.bulk_write(ops, ordered=False)
+        return result.upserted_count + result.modified_count
 
-    @classmethod
-    def get_llm_provider_config(cls) -> Optional[dict]:
-        collection = cls.get_llm_provider_collection()
-        doc = collection.find_one()
+    async def get_llm_provider_config(self) -> Optional[dict]:
+        doc = await self._llm_config.find_one()
         if doc:
             doc["id"] = str(doc.pop("_id"))
             return doc
         return None
 
-class AgentConfigModel(BaseModel):
-    agent_name: str = Field(...)
-    agent_description: str = Field(...)
-    agent_prompt: str = Field(...)
-    mcp_address: str = Field(...)
-    mcp_transport_type: str = Field(...)
-    host: str = Field(...)
-    port: int = Field(...)
-    # Optionally, add an id field for MongoDB's _id
-    id: Optional[str] = None
+    async def save_llm_provider_config(self, config: dict) -> str:
+        await self._llm_config.delete_many({})  # Only keep one config document
+        result = await self._llm_config.insert_one(dict(config))
+        return str(result.inserted_id)
+
+
+class InMemoryAgentRepository(AgentRepository):
+    """Dict-backed repository with the same semantics as MongoAgentRepository (unique agent_name,
+    copies in and out), for tests and benchmarks without a MongoDB server."""
+
+    def __init__(self):
+        self._agents: Dict[str, dict] = {}
+        self._llm_config: Optional[dict] = None
+        self._next_id = 0
+        self._lock = asyncio.Lock()
+
+    def _new_id(self) -> str:
+        self._next_id += 1
+        return f"{self._next_id:024x}"
+
+    async def list_agents(self) -> List[AgentConfigModel]:
+        return [_agent_from_doc(copy.deepcopy(doc)) for doc in self._agents.values()]
+
+    async def list_agent_fields(self, fields: Iterable[str]) -> List[Dict[str, Any]]:
+        fields = list(fields)
+        return [{f: doc[f] for f in fields if f in doc} for doc in self._agents.values()]
+
+    async def get_agent(self, agent_name: str) -> Optional[AgentConfigModel]:
+        doc = self._agents.get(agent_name)
+        return _agent_from_doc(copy.deepcopy(doc)) if doc else None
+
+    async def insert_agent(self, agent_config: AgentConfigModel) -> str:
+        async with self._lock:
+            if agent_config.agent_name in self._agents:
+                raise DuplicateAgentError(f"Agent with name '{agent_config.agent_name}' already exists.")
+            doc = agent_config.dict(exclude_none=True, exclude={"id"})
+            doc["_id"] = self._new_id()
+            self._agents[agent_config.agent_name] = doc
+            return doc["_id"]
+
+    async def delete_agent(self, agent_name: str) -> int:
+        return 1 if self._agents.pop(agent_name, None) is not None else 0
+
+    async def update_agent_port(self, agent_name: str, port: int) -> int:
+        doc = self._agents.get(agent_name)
+        if doc is None or doc.get("port") == port:
+            return 0
+        doc["port"] = port
+        return 1
+
+    async def upsert_agents(self, agent_configs: Iterable[AgentConfigModel]) -> int:
+        count = 0
+        async with self._lock:
+            for agent_config in agent_configs:
+                fields = agent_config.dict(exclude_none=True, exclude={"id"})
+                existing = self._agents.get(agent_config.agent_name)
+                if existing is None:
+                    fields["_id"] = self._new_id()
+                    self._agents[agent_config.agent_name] = fields
+                    count += 1
+                elif any(existing.get(k) != v for k, v in fields.items()):
+                    # Same as $set: fields left unset on the model keep their stored value
+                    existing.update(fields)
+                    count += 1
+        return count
+
+    async def get_llm_provider_config(self) -> Optional[dict]:
+        if self._llm_config is None:
+            return None
+        doc = copy.deepcopy(self._llm_config)
+        doc["id"] = str(doc.pop("_id"))
+        return doc
+
+    async def save_llm_provider_config(self, config: dict) -> str:
+        doc = copy.deepcopy(config)
+        doc.pop("id", None)
+        doc["_id"] = self._new_id()
+        self._llm_config = doc
+        return doc["_id"]
+
+
+_repository: Optional[AgentRepository] = None
+
+
+def get_agent_repository() -> AgentRepository:
+    """Return the process-wide repository for the configured AGENTWEAVE_DB_BACKEND."""
+    global _repository
+    if _repository is None:
+        _repository = InMemoryAgentRepository() if DB_BACKEND == "memory" else MongoAgentRepository()
+    return _repository
+
+
+_async_database = None
+
+
+def get_async_mongo_database():
+    """Async database handle for other collections (e.g. persisted tasks), sharing the
+    repository's connection pool when the repository is MongoDB-backed."""
+    global _async_database
+    if _async_database is None:
+        repository = get_agent_repository()
+        if isinstance(repository, MongoAgentRepository):
+            _async_database = repository.database
+        else:
+            from pymongo import AsyncMongoClient
+            _async_database = AsyncMongoClient(MONGODB_URI, maxPoolSize=MONGODB_MAX_POOL_SIZE)[MONGODB_DB_NAME]
+    return _async_database
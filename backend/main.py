@@ -5,132 +5,120 @@ import signal
 import socket
 import json
 from dotenv import load_dotenv
-from src.task_manager import AgentTaskManager
-from src.helpers import get_agent_card, get_next_agent_port, get_server_config, fetch_skills
-from utils.push_notification_auth import PushNotificationSenderAuth
-from src.llm_provider import get_llm_provider_config
+from src.helpers import get_next_agent_port, fetch_skills
+from src.status_probe import probe_agent_socket
+from src.health_monitor import AgentHealthMonitor
+from src.skills_cache import SKILLS_CACHE
+from src.mcp_pool import MCP_POOL
+from src.port_allocator import get_port_allocator, init_port_allocator
+from src.sharding import AgentWorkerPool, AGENT_WORKERS, SUPERVISOR_MODE
+from src import agent_runtime
+from src.agent_runtime import (
+    AGENT_SERVER_TASKS,
+    SHARED_HOST,
+    WARMUP_TASKS,
+    close_task_stores,
+    get_llm_provider_and_config,
+    set_llm_env_vars_from_config,
+)
+from utils.key_manager import get_key_manager
+from utils.push_dispatcher import get_push_dispatcher
 import uvicorn
-from fastapi import FastAPI, Body, Path
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Body, Path, Query
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from db import MongoDBClient, AgentConfigModel
-from src.base_server import BaseA2AServer
-from typing import Dict, Any
+from db import AgentConfigModel, DuplicateAgentError, get_agent_repository
+from typing import Dict, Any, Optional
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
-def get_agent_instance(agent: AgentConfigModel, provider):
-    kwargs = get_llm_provider_config(provider)
-    from backend.src.agent import Agent
-    return Agent(prompt=agent.agent_prompt, servers_cfg=get_server_config(agent), **kwargs)
-
-async def run_starlette_app(app, host, port, server_ref=None):
-    config = uvicorn.Config(app, host=host, port=port, log_level="info")
-    server = uvicorn.Server(config)
-    if server_ref is not None:
-        server_ref["uvicorn_server"] = server
-    await server.serve()
-
-def get_llm_provider_and_config():
-    """
-    Fetch the current LLM provider and its fields from the DB (or .env as fallback).
-    Returns (provider, config_dict)
-    """
-    config = MongoDBClient.get_llm_provider_config()
-    if config:
-        provider = config.get("LLM_PROVIDER") or config.get("provider")
-        return provider, config
-    # fallback: return from env
-    import os
-    provider = os.getenv("LLM_PROVIDER", "azure")
-    result = {"LLM_PROVIDER": provider}
-    if provider == "openai":
-        result["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY", "")
-    elif provider == "google":
-        result["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY", "")
-    elif provider == "azure":
-        result["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-        result["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY", "")
-        result["AZURE_OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION", "")
-    return provider, result
-
-async def create_server(agent: AgentConfigModel):
-    host = agent.host
-    port = int(agent.port)
-    provider, provider_config = get_llm_provider_and_config()
-    _agent_card = await get_agent_card(agent)
-    agent_inst = get_agent_instance(agent, provider)
-    # Optionally, pass provider_config to agent_inst if needed
-    notification_sender_auth = PushNotificationSenderAuth()
-    notification_sender_auth.generate_jwk()
-    server = BaseA2AServer(
-        host=host,
-        port=port,
-        agent_card=_agent_card,
-        task_manager=AgentTaskManager(agent=agent_inst, notification_sender_auth=notification_sender_auth)
-    )
-    server.app.add_route(
-        "/.well-known/jwks.json", notification_sender_auth.handle_jwks_endpoint, methods=["GET"]
-    )
-    return server
-
 # --- FastAPI app for server discovery ---
 app = FastAPI()
 
+# With AGENT_WORKERS > 0 this process is a supervisor: agent servers run in worker processes
+# (see src.sharding) and control operations are routed to the owning worker.
+# Agents hosted in this process (see src.agent_runtime) live in SHARED_HOST / AGENT_SERVER_TASKS.
+WORKER_POOL = AgentWorkerPool(AGENT_WORKERS) if SUPERVISOR_MODE else None
+
+def get_agent_url(agent: AgentConfigModel) -> str:
+    if WORKER_POOL is not None:
+        return WORKER_POOL.agent_url(agent.agent_name) or f"http://{agent.host}:{agent.port}/"
+    return agent_runtime.agent_url(agent)
+
+def get_agent_readiness(agent_name: str) -> str | None:
+    """Warm-up state of the agent's graph: cold, warming, ready or failed (None if not started)."""
+    if WORKER_POOL is not None:
+        return WORKER_POOL.readiness(agent_name)
+    entry = AGENT_SERVER_TASKS.get(agent_name)
+    return entry["server"].readiness if entry else None
+
+def agent_status_extra(agent: AgentConfigModel) -> dict:
+    extra = {"readiness": get_agent_readiness(agent.agent_name)}
+    if WORKER_POOL is not None:
+        extra.update(WORKER_POOL.describe(agent.agent_name))
+    return extra
+
+def is_agent_serving(agent: AgentConfigModel) -> bool:
+    if WORKER_POOL is not None:
+        return WORKER_POOL.is_running(agent.agent_name)
+    return SHARED_HOST.is_mounted(agent.agent_name)
+
+HEALTH_MONITOR = AgentHealthMonitor(
+    status_detail=lambda status: get_status_detail(status),
+    agent_url=get_agent_url,
+    is_serving=is_agent_serving if WORKER_POOL is not None or SHARED_HOST is not None else None,
+    extra=agent_status_extra,
+)
+
+def report_agent_status(agent: AgentConfigModel, status: str | None):
+    if status is None:
+        # Only the details changed (e.g. readiness after warm-up): keep the last status
+        current = HEALTH_MONITOR.get_agent(agent.agent_name)
+        status = current["status"] if current else "running"
+    HEALTH_MONITOR.update_agent(agent, status)
+
+agent_runtime.set_status_listener(report_agent_status)
+
+async def start_agent_servers(agent_models, **kwargs):
+    """Starts agents in this process, or on their owning workers in supervisor mode
+    (see agent_runtime.start_agent_servers for the options)."""
+    if WORKER_POOL is not None:
+        kwargs["launcher"] = WORKER_POOL.start_agent
+    return await agent_runtime.start_agent_servers(agent_models, **kwargs)
+
+async def stop_agent_server(agent_name):
+    """Stops a running agent server (or unmounts it from the shared host / its worker)."""
+    if WORKER_POOL is not None:
+        await WORKER_POOL.stop_agent(agent_name)
+        return
+    await agent_runtime.stop_agent_server(agent_name)
+
+@app.on_event("startup")
+async def start_health_monitor():
+    HEALTH_MONITOR.start()
+    if WORKER_POOL is None:
+        # Pre-generate signing keys in the background and rotate them if configured
+        get_key_manager().start()
+
+@app.on_event("shutdown")
+async def stop_health_monitor():
+    await HEALTH_MONITOR.stop()
+    await get_key_manager().stop()
+    await get_push_dispatcher().stop()
+    await close_task_stores()
+
 @app.get("/api/agent-servers")
-async def list_agents_with_status():
+async def list_agents_with_status(fresh: bool = Query(False)):
     """
     Returns all agents from the DB, with an extra field 'status' (detailed connection status),
     based on socket connection to their host/port and MCP tool connectivity.
+    Served from the health monitor's last snapshot; 'status_checked_at' is the time each agent
+    was actually probed. Pass ?fresh=1 to force an immediate re-probe.
     """
-    import errno
-    import time
     try:
-        db_agents = MongoDBClient.get_all_agents()
-        agents = []
-        for agent in db_agents:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(0.5)
-            status = "unknown"
-            error_detail = None
-            mcp_failed = False
-            try:
-                s.connect((agent.host, int(agent.port)))
-                status = "running"
-            except socket.timeout:
-                status = "timeout"
-            except ConnectionRefusedError:
-                status = "connection refused"
-            except OSError as e:
-                if e.errno == errno.ECONNREFUSED:
-                    status = "connection refused"
-                elif e.errno == errno.EHOSTUNREACH:
-                    status = "host unreachable"
-                elif e.errno == errno.ENETUNREACH:
-                    status = "network unreachable"
-                else:
-                    status = f"oserror ({e.errno})"
-                    error_detail = str(e)
-            except Exception as e:
-                status = "error"
-                error_detail = str(e)
-            finally:
-                s.close()
-            # If running, check MCP tool connection
-            if status == "running":
-                try:
-                    await fetch_skills(agent)
-                except Exception as mcp_exc:
-                    status = "mcp error"
-                    error_detail = f"MCP fetch_skills failed: {str(mcp_exc)}"
-                    mcp_failed = True
-            agent_dict = agent.dict()
-            agent_dict["status"] = status
-            agent_dict["status_checked_at"] = int(time.time())
-            # Set status_detail
-            agent_dict["status_detail"] = get_status_detail(status)
-            agents.append(agent_dict)
-        return JSONResponse(content={"agents": agents})
+        if fresh or HEALTH_MONITOR.version == 0:
+            await HEALTH_MONITOR.refresh()
+        return Response(content=HEALTH_MONITOR.snapshot_body(), media_type="application/json")
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
@@ -140,6 +128,8 @@ class AgentCreateRequest(BaseModel):
     agent_prompt: str
     mcp_address: str
     mcp_transport_type: str
+    history_max_length: Optional[int] = None
+    max_concurrent_tasks: Optional[int] = None
 
 @app.post("/api/agent")
 async def create_agent(agent: AgentCreateRequest = Body(...)):
@@ -149,27 +139,37 @@ async def create_agent(agent: AgentCreateRequest = Body(...)):
     Starts the agent server and only returns after the server is running and port is finalized.
     """
     try:
-        # Check if agent_name already exists
-        db_agents = MongoDBClient.get_all_agents()
-        if any(a.agent_name == agent.agent_name for a in db_agents):
+        repo = get_agent_repository()
+        # Check if agent_name already exists (the unique index also guards concurrent creates)
+        if await repo.get_agent(agent.agent_name) is not None:
             return JSONResponse(content={"error": f"Agent with name '{agent.agent_name}' already exists."}, status_code=400)
+        # An explicit create should not be answered from a cached MCP failure
+        SKILLS_CACHE.invalidate(agent.mcp_address, agent.mcp_transport_type)
         host = "localhost"
-        port = get_next_agent_port()
+        if SHARED_HOST is not None:
+            port = SHARED_HOST.port
+        elif WORKER_POOL is not None:
+            # Stay inside the owning worker's slice of the port range, which only that worker allocates from
+            port = await get_next_agent_port(within=WORKER_POOL.port_range(agent.agent_name))
+        else:
+            port = await get_next_agent_port()
         agent_data = agent.dict()
         agent_data["host"] = host
         agent_data["port"] = port
         agent_model = AgentConfigModel(**agent_data)
-        inserted_id = MongoDBClient.save_agent_config(agent_model)
+        inserted_id = await repo.insert_agent(agent_model)
         agent_dict = agent_model.dict()
         agent_dict["id"] = inserted_id
         # Start the agent server synchronously and wait for port assignment
         await start_agent_servers([agent_model])
         # Fetch the latest agent config from DB (in case port changed)
-        updated_agent = next((a for a in MongoDBClient.get_all_agents() if a.agent_name == agent.agent_name), None)
+        updated_agent = await repo.get_agent(agent.agent_name)
         if updated_agent:
             agent_dict = updated_agent.dict()
             agent_dict["id"] = inserted_id
         return JSONResponse(content={"agent": agent_dict}, status_code=201)
+    except DuplicateAgentError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
     except RuntimeError as e:
         # Custom error for MCP server not running
         return JSONResponse(content={"error": str(e)}, status_code=502)
@@ -178,98 +178,40 @@ async def create_agent(agent: AgentCreateRequest = Body(...)):
         traceback.print_exc()
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-# Global registry to track running agent server tasks and server instances
-AGENT_SERVER_TASKS = {}  # {agent_name: {"task": ..., "server": ...}}
-
-def is_port_in_use(host, port):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.settimeout(0.5)
-        s.connect((host, int(port)))
-        return True
-    except Exception:
-        return False
-    finally:
-        s.close()
-
-async def start_agent_servers(agent_models, max_retries=5, retry_delay=1):
-    tasks = []
-    for agent in agent_models:
-        retries = 0
-        tried_ports = set()
-        while retries < max_retries:
-            if not is_port_in_use(agent.host, agent.port) and agent.port not in tried_ports:
-                break
-            tried_ports.add(agent.port)
-            print(f"Port {agent.port} is in use, getting next port and retrying...")
-            next_port = get_next_agent_port(exclude_ports=tried_ports)
-            # Avoid looping on the same ports
-            while next_port in tried_ports:
-                tried_ports.add(next_port)
-                next_port = get_next_agent_port(exclude_ports=tried_ports)
-            agent.port = next_port
-            MongoDBClient.update_agent_port_by_name(agent.agent_name, agent.port)
-            await asyncio.sleep(retry_delay)
-            retries += 1
-        if is_port_in_use(agent.host, agent.port):
-            print(f"Port {agent.port} is still in use after {max_retries} retries. Skipping agent {agent.agent_name}.")
-            continue
-        server = await create_server(agent)
-        print(f"Starting {agent.agent_name} agent server on {agent.host}:{agent.port}")
-        server_ref = {}
-        task = asyncio.create_task(run_starlette_app(server.app, server.host, agent.port, server_ref))
-        AGENT_SERVER_TASKS[agent.agent_name] = {"task": task, "server": server, "uvicorn_server": server_ref}
-        tasks.append(task)
-    return tasks
-
 @app.delete("/api/agent/{agent_name}")
-def delete_agent(agent_name: str = Path(...)):
+async def delete_agent(agent_name: str = Path(...)):
     """
     Deletes an agent by agent_name. Stops the agent server if running, then deletes from DB.
     """
     try:
         print(f"[API] Deleting agent: {agent_name}")
-        db_agents = MongoDBClient.get_all_agents()
-        agent = next((a for a in db_agents if a.agent_name == agent_name), None)
+        repo = get_agent_repository()
+        agent = await repo.get_agent(agent_name)
         if not agent:
             return JSONResponse(content={"error": f"Agent '{agent_name}' not found."}, status_code=404)
-        entry = AGENT_SERVER_TASKS.get(agent_name)
-        if entry:
-            uvicorn_server = entry.get("uvicorn_server", {}).get("uvicorn_server")
-            if uvicorn_server:
-                uvicorn_server.should_exit = True
-            server = entry.get("server")
-            task = entry.get("task")
-            if hasattr(server, "shutdown") and asyncio.iscoroutinefunction(server.shutdown):
-                try:
-                    asyncio.get_event_loop().run_until_complete(server.shutdown())
-                except Exception:
-                    pass
-            if task:
-                task.cancel()
-                try:
-                    asyncio.get_event_loop().run_until_complete(task)
-                except Exception:
-                    pass
-            AGENT_SERVER_TASKS.pop(agent_name, None)
-        deleted_count = MongoDBClient.delete_agent_by_name(agent_name)
+        await stop_agent_server(agent_name)
+        deleted_count = await repo.delete_agent(agent_name)
+        await get_key_manager().forget(agent_name)
+        if SHARED_HOST is None:
+            get_port_allocator().release(agent.port)
+        HEALTH_MONITOR.remove_agent(agent_name)
+        # Close the pooled MCP session (used by skill listings) unless another agent shares the server
+        remaining = await repo.list_agent_fields(["mcp_address", "mcp_transport_type"])
+        mcp_server = (agent.mcp_address.rstrip("/"), agent.mcp_transport_type)
+        if all(((a.get("mcp_address") or "").rstrip("/"), a.get("mcp_transport_type")) != mcp_server for a in remaining):
+            await MCP_POOL.remove(mcp_server[0] + "/mcp", mcp_server[1])
         if deleted_count == 0:
             return JSONResponse(content={"error": f"Agent '{agent_name}' not found in DB."}, status_code=404)
         return JSONResponse(content={"message": f"Agent '{agent_name}' deleted and server stopped."}, status_code=200)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-def check_agent_socket_connection(agent):
+async def check_agent_socket_connection(agent):
     """Check if agent's socket is connectable."""
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(0.5)
-    try:
-        s.connect((agent.host, int(agent.port)))
-        return True
-    except Exception:
+    if (WORKER_POOL is not None or SHARED_HOST is not None) and not is_agent_serving(agent):
         return False
-    finally:
-        s.close()
+    status, _ = await probe_agent_socket(agent.host, agent.port)
+    return status == "running"
 
 async def check_mcp_tool_connection(agent, loop=None):
     """Try to fetch skills from MCP tool, returns (success, error_detail)."""
@@ -293,6 +235,8 @@ def get_status_detail(status):
         return "MCP tool connection failed"
     elif status == "running":
         return "Connected to agent and MCP tool"
+    elif status == "starting":
+        return "Agent server is starting"
     elif status == "not connected":
         return "Agent server not running or unreachable"
     elif status == "timeout":
@@ -319,12 +263,13 @@ async def refresh_agent(agent_name: str = Path(...)):
     import socket
     try:
         logging.info(f"[API] Refreshing agent: {agent_name}")
-        db_agents = MongoDBClient.get_all_agents()
-        agent = next((a for a in db_agents if a.agent_name == agent_name), None)
+        agent = await get_agent_repository().get_agent(agent_name)
         if not agent:
             return JSONResponse(content={"error": f"Agent '{agent_name}' not found."}, status_code=404)
+        # Refresh re-verifies the MCP tools, so drop any cached listing first
+        SKILLS_CACHE.invalidate(agent.mcp_address, agent.mcp_transport_type)
         # 1. Check socket connection
-        connected = check_agent_socket_connection(agent)
+        connected = await check_agent_socket_connection(agent)
         status = "running" if connected else "not connected"
         error_detail = None
         mcp_failed = False
@@ -347,9 +292,10 @@ async def refresh_agent(agent_name: str = Path(...)):
                 agent_dict["status"] = "error"
                 agent_dict["status_checked_at"] = int(time.time())
                 agent_dict["status_detail"] = get_status_detail("error")
+                HEALTH_MONITOR.update_agent(agent, "error", agent_dict["status_checked_at"])
                 return JSONResponse(content={"agent": agent_dict}, status_code=200)
             # Re-check connection
-            connected2 = check_agent_socket_connection(agent)
+            connected2 = await check_agent_socket_connection(agent)
             if connected2:
                 ok, mcp_error = await check_mcp_tool_connection(agent)
                 if ok:
@@ -363,6 +309,7 @@ async def refresh_agent(agent_name: str = Path(...)):
         agent_dict["status"] = status
         agent_dict["status_checked_at"] = int(time.time())
         agent_dict["status_detail"] = get_status_detail(status)
+        HEALTH_MONITOR.update_agent(agent, status, agent_dict["status_checked_at"])
         return JSONResponse(content={"agent": agent_dict})
     except Exception as e:
         logging.error(f"[API] Error refreshing agent {agent_name}: {str(e)}")
@@ -376,6 +323,44 @@ async def refresh_agent(agent_name: str = Path(...)):
         else:
             return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.post("/api/skills-cache/invalidate")
+async def invalidate_skills_cache(agent_name: str = Query(None), mcp_address: str = Query(None), mcp_transport_type: str = Query(None)):
+    """
+    Drops cached MCP skill listings. Scope it with agent_name (that agent's MCP server) or
+    mcp_address/mcp_transport_type; with no parameters the whole skills cache is cleared.
+    """
+    try:
+        if agent_name:
+            agent = await get_agent_repository().get_agent(agent_name)
+            if not agent:
+                return JSONResponse(content={"error": f"Agent '{agent_name}' not found."}, status_code=404)
+            mcp_address, mcp_transport_type = agent.mcp_address, agent.mcp_transport_type
+        removed = SKILLS_CACHE.invalidate(mcp_address, mcp_transport_type)
+        # Pooled sessions re-list their tools on the next graph build
+        MCP_POOL.invalidate_tools(mcp_address.rstrip("/") + "/mcp" if mcp_address else None, mcp_transport_type)
+        return JSONResponse(content={"invalidated": removed})
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Engine metrics: push-notification queue depth, delivery counters and latency.
+    In worker mode the figures are reported per worker.
+    """
+    if WORKER_POOL is not None:
+        replies = await WORKER_POOL.broadcast("metrics")
+        return {"workers": [r.get("metrics") for r in replies if not isinstance(r, BaseException)]}
+    return agent_runtime.get_metrics()
+
+@app.get("/api/mcp-sessions")
+async def list_mcp_sessions():
+    """
+    Returns the pooled MCP sessions held by this process (connection state, call and reconnect counts).
+    In worker mode each worker holds its own pool for the agents it serves.
+    """
+    return {"sessions": MCP_POOL.describe()}
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
@@ -393,6 +378,9 @@ async def shutdown_engine():
         shutdown_tasks = []
         for agent_name, entry in AGENT_SERVER_TASKS.items():
             logger.info(f"[Shutdown] Stopping agent server: {agent_name}")
+            if entry.get("shared"):
+                SHARED_HOST.unmount(agent_name)
+                continue
             
             # Stop uvicorn server gracefully
             uvicorn_server = entry.get("uvicorn_server", {}).get("uvicorn_server")
@@ -412,6 +400,11 @@ async def shutdown_engine():
             if task:
                 task.cancel()
         
+        if SHARED_HOST is not None:
+            SHARED_HOST.stop()
+        if WORKER_POOL is not None:
+            WORKER_POOL.stop()
+
         # Wait for all shutdowns to complete
         if shutdown_tasks:
             await asyncio.gather(*shutdown_tasks, return_exceptions=True)
@@ -455,7 +448,7 @@ async def get_llm_provider_config_from_db():
     """
     Fetch the current LLM provider and its fields from the DB (or .env as fallback).
     """
-    provider, config = get_llm_provider_and_config()
+    provider, config = await get_llm_provider_and_config()
     # Remove MongoDB _id if present
     if config and "_id" in config:
         config["id"] = str(config.pop("_id"))
@@ -466,32 +459,13 @@ async def save_llm_provider_config(payload: Dict[str, Any]):
     """
     Save the LLM provider and its fields to the DB and set as environment variables.
     """
-    db = MongoDBClient.get_database("agentweave")
-    collection = db["llm_provider_config"]
-    collection.delete_many({})  # Only one config at a time
-    result = collection.insert_one(payload)
+    inserted_id = await get_agent_repository().save_llm_provider_config(payload)
 
     # Set as environment variables for the current process
     set_llm_env_vars_from_config(payload)
-    return {"success": True, "id": str(result.inserted_id)}
-
-def set_llm_env_vars_from_config(config: dict):
-    """
-    Set LLM provider config values as environment variables in the current process.
-    """
-    env_keys = [
-        "LLM_PROVIDER",
-        "OPENAI_API_KEY",
-        "GOOGLE_API_KEY",
-        "AZURE_OPENAI_ENDPOINT",
-        "AZURE_OPENAI_API_KEY",
-        "AZURE_OPENAI_API_VERSION",
-        "OPENAI_API_VERSION"
-    ]
-    # logger.info(f"Setting LLM provider config as environment variables: {config}")
-    for key in env_keys:
-        if key in config:
-            os.environ[key] = str(config[key])
+    if WORKER_POOL is not None:
+        await WORKER_POOL.broadcast("set_env", config=payload)
+    return {"success": True, "id": inserted_id}
 
 if __name__ == "__main__":
     load_dotenv(override=True)  # Load .env file if present
@@ -503,11 +477,6 @@ if __name__ == "__main__":
     parser.add_argument("--agent", default="github", help="Agent to run (github, confluence, etc.) (single mode)")
     args = parser.parse_args()
 
-    # --- Set LLM provider config as env vars from MongoDB if present ---
-    config = MongoDBClient.get_llm_provider_config()
-    if config:
-        set_llm_env_vars_from_config(config)
-
     async def run_discovery_server():
         # Load configuration from shared config file
         from utils.shared_config import load_shared_config
@@ -515,7 +484,9 @@ if __name__ == "__main__":
         engine_port = shared_config["ENGINE_PORT"]
         
         # Run the FastAPI discovery server on configured port
-        config = uvicorn.Config("main:app", host="0.0.0.0", port=engine_port, log_level="info", reload=False)
+        # Pass the app object (not "main:app") so the API shares this module's registries
+        # and health monitor instead of a second import of main.py.
+        config = uvicorn.Config(app, host="0.0.0.0", port=engine_port, log_level="info", reload=False)
         server = uvicorn.Server(config)
         await server.serve()
 
@@ -525,8 +496,15 @@ if __name__ == "__main__":
         tasks.append(asyncio.create_task(run_discovery_server()))
 
         from pymongo.errors import ServerSelectionTimeoutError, PyMongoError
+        repo = get_agent_repository()
         try:
-            db_agents = MongoDBClient.get_all_agents()
+            await repo.ensure_indexes()
+            # --- Set LLM provider config as env vars from MongoDB if present ---
+            config = await repo.get_llm_provider_config()
+            if config:
+                set_llm_env_vars_from_config(config)
+            db_agents = await repo.list_agents()
+            await init_port_allocator()
         except (ServerSelectionTimeoutError, PyMongoError) as e:
             logger.error(f"MongoDB connection error: {e}")
             print(f"[Startup] MongoDB is not running or not reachable: {e}")
@@ -538,12 +516,12 @@ if __name__ == "__main__":
             import sys
             sys.exit(1)
 
-        try:
-            tasks += await start_agent_servers(db_agents)
-        except RuntimeError as e:
-            logger.error(f"Startup error: {e}")
-            print(f"[Startup] MCP server is not running or not reachable: {e}")
-            # Optionally, you could exit or continue depending on your needs
+        if WORKER_POOL is not None:
+            WORKER_POOL.start()
+
+        # Bring the fleet up in the background so the discovery server serves traffic meanwhile;
+        # per-agent failures are logged and reported through the health monitor.
+        tasks.append(asyncio.create_task(start_agent_servers(db_agents, raise_on_error=False)))
 
         # Handle shutdown signals
         loop = asyncio.get_running_loop()
@@ -558,8 +536,13 @@ if __name__ == "__main__":
         try:
             await stop_event.wait()
         finally:
+            tasks += [entry["task"] for entry in AGENT_SERVER_TASKS.values()] + list(WARMUP_TASKS)
             for task in tasks:
                 task.cancel()
             await asyncio.gather(*tasks, return_exceptions=True)
+            await close_task_stores()
+            await MCP_POOL.close()
+            if WORKER_POOL is not None:
+                WORKER_POOL.stop()
 
     asyncio.run(main())
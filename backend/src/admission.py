@@ -0,0 +1,139 @@
+"""
+Per-agent admission control for tasks/send and tasks/sendSubscribe.
+
+At most AGENT_MAX_CONCURRENT_TASKS tasks of an agent run at once (0 disables
+the limit); further tasks wait in a FIFO queue of AGENT_TASK_QUEUE_SIZE for up
+to AGENT_TASK_QUEUE_TIMEOUT seconds. When the queue is full a task is rejected
+right away with AgentBusy, carrying a retry hint (AGENT_BUSY_RETRY_AFTER).
+"""
+import os
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+AGENT_MAX_CONCURRENT_TASKS = int(os.getenv("AGENT_MAX_CONCURRENT_TASKS", "8"))
+AGENT_TASK_QUEUE_SIZE = int(os.getenv("AGENT_TASK_QUEUE_SIZE", "32"))
+AGENT_TASK_QUEUE_TIMEOUT = float(os.getenv("AGENT_TASK_QUEUE_TIMEOUT", "30"))
+AGENT_BUSY_RETRY_AFTER = float(os.getenv("AGENT_BUSY_RETRY_AFTER", "5"))
+
+
+class AgentBusy(Exception):
+    """The agent can't take the task now (queue full, or waited too long)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    __slots__ = ("admitted", "done", "position", "moved")
+
+    def __init__(self):
+        self.admitted = False
+        self.done = False
+        self.position = 0  # 1-based place in the wait queue while not admitted
+        self.moved = asyncio.Event()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = AGENT_MAX_CONCURRENT_TASKS,
+        queue_size: int = AGENT_TASK_QUEUE_SIZE,
+        queue_timeout: float = AGENT_TASK_QUEUE_TIMEOUT,
+        retry_after: float = AGENT_BUSY_RETRY_AFTER,
+    ):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.running = 0
+        self._queue: "deque[Ticket]" = deque()
+        self.counters = {"admitted": 0, "queued_total": 0, "rejected": 0, "timed_out": 0}
+
+    def _has_slot(self) -> bool:
+        return self.max_concurrent <= 0 or self.running < self.max_concurrent
+
+    def enter(self) -> Ticket:
+        """Take a slot, or a place in the queue. Raises AgentBusy if the queue is full."""
+        ticket = Ticket()
+        if self._has_slot() and not self._queue:
+            self._admit(ticket)
+            return ticket
+        if len(self._queue) >= self.queue_size:
+            self.counters["rejected"] += 1
+            raise AgentBusy(f"{self.running} task(s) running and {len(self._queue)} queued", self.retry_after)
+        self._queue.append(ticket)
+        ticket.position = len(self._queue)
+        self.counters["queued_total"] += 1
+        return ticket
+
+    async def wait(self, ticket: Ticket, on_position: Optional[Callable[[int], Awaitable]] = None):
+        """Wait until the ticket is admitted; on_position is awaited with each new queue position.
+        Raises AgentBusy after queue_timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        reported = None
+        try:
+            while not ticket.admitted:
+                if on_position is not None and ticket.position != reported:
+                    reported = ticket.position
+                    await on_position(reported)
+                    continue
+                ticket.moved.clear()
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(ticket.moved.wait(), remaining)
+        except asyncio.TimeoutError:
+            if ticket.admitted:
+                return
+            self.leave(ticket)
+            self.counters["timed_out"] += 1
+            raise AgentBusy(f"Timed out after {self.queue_timeout:g}s in the queue", self.retry_after)
+        except asyncio.CancelledError:
+            self.leave(ticket)
+            raise
+
+    def leave(self, ticket: Ticket):
+        """Give the ticket back: free its slot (admitting the next queued one) or its queue place.
+        Safe to call more than once."""
+        if ticket.done:
+            return
+        ticket.done = True
+        if not ticket.admitted:
+            self._leave_queue(ticket)
+            return
+        self.running -= 1
+        while self._queue and self._has_slot():
+            self._admit(self._queue.popleft())
+        self._renumber()
+
+    def _admit(self, ticket: Ticket):
+        self.running += 1
+        ticket.admitted = True
+        ticket.position = 0
+        ticket.moved.set()
+        self.counters["admitted"] += 1
+
+    def _leave_queue(self, ticket: Ticket):
+        try:
+            self._queue.remove(ticket)
+        except ValueError:
+            return
+        self._renumber()
+
+    def _renumber(self):
+        for position, ticket in enumerate(self._queue, 1):
+            if ticket.position != position:
+                ticket.position = position
+                ticket.moved.set()
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": len(self._queue),
+            "max_concurrent": self.max_concurrent,
+            "queue_size": self.queue_size,
+            **self.counters,
+        }
@@ -1,41 +1,90 @@
+import os
 import asyncio
 from typing import Any, AsyncIterable, Dict
-from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
 from langchain_core.tools import BaseTool
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from dotenv import load_dotenv
 from .llm_factory import LLMFactory
+# Imported through the "src" package (like helpers) so agents, fetch_skills and health
+# checks share the same process-wide pool
+from src.mcp_pool import MCP_POOL
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
 SUPPORTED_CONTENT_TYPES = ["text", "text/plain"]
+# Stream the model's answer token by token (items with "token": True) instead of only status steps
+AGENT_STREAM_TOKENS = os.getenv("AGENT_STREAM_TOKENS", "false").lower() in ("1", "true", "yes")
+
+
+def _text_of(content) -> str:
+    """Text of a message's content, which is a string or a list of content blocks."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
+
+
 class Agent:
     def __init__(self, prompt: str, servers_cfg: dict, provider: str, **model_kwargs):
         self._provider = provider
         self._model_kwargs = model_kwargs
         self._graph = None
-        self._client_cm = None
+        self._build_task = None
         self._memory = MemorySaver()
+        self.readiness = "cold"  # cold -> warming -> ready (or failed)
+        self.readiness_error = None
         self.prompt = prompt  # Set by argument
         self.servers_cfg = servers_cfg  # Set by argument
 
     async def aclose(self):
-        """Gracefully shut down MCP subprocesses / SSE streams."""
-        if self._client_cm:
-            await self._client_cm.__aexit__(None, None, None)
-            self._client_cm = None
+        """Drop the graph. MCP sessions belong to the shared pool and stay open."""
+        if self._build_task and not self._build_task.done():
+            self._build_task.cancel()
+            await asyncio.gather(self._build_task, return_exceptions=True)
+        self._build_task = None
         self._graph = None
+        self.readiness = "cold"
+
+    async def warm_up(self) -> bool:
+        """Build the graph ahead of the first request. Returns True if the agent is ready."""
+        try:
+            await self._ensure_graph()
+        except Exception as e:
+            logger.error(f"Agent warm-up failed: {e}")
+            return False
+        return True
 
     async def _ensure_graph(self):
-        """Ensure the agent's graph is initialized."""
+        """Ensure the agent's graph is initialized.
+        Concurrent callers (a warm-up and early requests) share one in-flight build;
+        a failed build is retried by the next caller."""
         if self._graph:
             return
+        if self._build_task is None or self._build_task.done():
+            self._build_task = asyncio.create_task(self._build_graph())
+        await asyncio.shield(self._build_task)
+
+    async def _build_graph(self):
+        self.readiness = "warming"
+        try:
+            await self._create_graph()
+        except Exception as e:
+            self.readiness = "failed"
+            self.readiness_error = str(e)
+            raise
+        self.readiness = "ready"
+        self.readiness_error = None
+
+    async def _create_graph(self):
         model = LLMFactory.create(self._provider, **self._model_kwargs)
         logger.info(f"Creating agent graph with prvider: {self._provider}, kwargs: {self._model_kwargs}")
-        self._client_cm = MultiServerMCPClient(self.servers_cfg)
-        tools: list[BaseTool] = await self._client_cm.get_tools()
+        # Tools call through pooled, long-lived MCP sessions instead of reconnecting per call
+        tools: list[BaseTool] = await MCP_POOL.get_tools(self.servers_cfg)
         self._graph = create_react_agent(
             model=model,
             tools=tools,
@@ -55,12 +104,29 @@ class Agent:
             "content": assistant_msg.content
         }
 
-    async def astream(self, query: str, session_id: str) -> AsyncIterable[Dict[str, Any]]:
-        """Streaming interaction with the agent."""
+    async def astream(
+        self, query: str, session_id: str, stream_tokens: bool = AGENT_STREAM_TOKENS
+    ) -> AsyncIterable[Dict[str, Any]]:
+        """Streaming interaction with the agent.
+        With stream_tokens, text deltas of the model's messages are yielded as they are
+        generated (marked "token": True), between the usual status steps."""
         await self._ensure_graph()
         cfg = {"configurable": {"thread_id": session_id}}
         inputs = {"messages": [("user", query)]}
-        async for item in self._graph.astream(inputs, cfg, stream_mode="values"):
+        stream_mode = ["values", "messages"] if stream_tokens else ["values"]
+        async for mode, item in self._graph.astream(inputs, cfg, stream_mode=stream_mode):
+            if mode == "messages":
+                chunk, _metadata = item
+                if isinstance(chunk, AIMessageChunk) and not chunk.tool_call_chunks:
+                    text = _text_of(chunk.content)
+                    if text:
+                        yield {
+                            "is_task_complete": False,
+                            "require_user_input": False,
+                            "content": text,
+                            "token": True,
+                        }
+                continue
             msg = item["messages"][-1]
             if isinstance(msg, AIMessage) and msg.tool_calls:
                 yield {
@@ -81,5 +147,5 @@ class Agent:
         yield {
             "is_task_complete": True,
             "require_user_input": False,
-            "content": assistant_msg.content,
+            "content": _text_of(assistant_msg.content),
         }
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Shared ASGI host for agent servers.
+
+Instead of one uvicorn server (and listening socket) per agent, every agent's
+Starlette app is mounted on a single app under /agents/{agent_name}/. When a
+host domain is configured, agents are also routed by Host header
+({agent_name}.{domain}). Agents can be mounted and unmounted while the server
+is running.
+"""
+import os
+import asyncio
+from typing import Dict, Optional
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Host, Mount
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+AGENT_HOSTING_MODE = os.getenv("AGENT_HOSTING_MODE", "port")  # "port" (one server per agent) or "shared"
+# Just above the default agent port range (the allocator never hands this port out either way)
+SHARED_HOST_PORT = int(os.getenv("AGENT_SHARED_HOST_PORT", "11000"))
+SHARED_HOST_DOMAIN = os.getenv("AGENT_SHARED_HOST_DOMAIN") or None
+AGENT_PATH_PREFIX = "/agents"
+
+
+class SharedAgentHost:
+    def __init__(self, host: str = "localhost", port: int = SHARED_HOST_PORT, domain: Optional[str] = SHARED_HOST_DOMAIN):
+        self.host = host
+        self.port = port
+        self.domain = domain
+        self.app = Starlette()
+        self.app.add_route("/health", self.health, methods=["GET"])
+        self.server_ref: Dict = {}
+        self._apps: Dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def agent_url(self, agent_name: str) -> str:
+        return f"http://{self.host}:{self.port}{AGENT_PATH_PREFIX}/{agent_name}/"
+
+    def is_mounted(self, agent_name: str) -> bool:
+        return agent_name in self._apps
+
+    def mount(self, agent_name: str, app):
+        """Route /agents/{agent_name}/ (and {agent_name}.{domain}, if configured) to app."""
+        self.unmount(agent_name)
+        routes = self.app.router.routes
+        if self.domain:
+            # Host routes go first so a matching Host header wins over the path prefix
+            routes.insert(0, Host(f"{agent_name}.{self.domain}", app=app, name=f"host:{agent_name}"))
+        routes.append(Mount(f"{AGENT_PATH_PREFIX}/{agent_name}", app=app, name=f"agent:{agent_name}"))
+        self._apps[agent_name] = app
+        logger.info(f"Mounted agent {agent_name} at {self.agent_url(agent_name)}")
+
+    def unmount(self, agent_name: str):
+        app = self._apps.pop(agent_name, None)
+        if app is None:
+            return
+        self.app.router.routes[:] = [
+            route for route in self.app.router.routes if getattr(route, "app", None) is not app
+        ]
+        logger.info(f"Unmounted agent {agent_name}")
+
+    def ensure_started(self) -> asyncio.Task:
+        """Start the shared uvicorn server once; returns its task."""
+        if self._task is None or self._task.done():
+            config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="info")
+            server = uvicorn.Server(config)
+            self.server_ref["uvicorn_server"] = server
+            self._task = asyncio.create_task(server.serve())
+        return self._task
+
+    def stop(self):
+        server = self.server_ref.get("uvicorn_server")
+        if server:
+            server.should_exit = True
+
+    async def health(self, request: Request) -> JSONResponse:
+        return JSONResponse({"status": "ok", "agents": sorted(self._apps)})
@@ -0,0 +1,354 @@
+"""
+In-process hosting of agent servers.
+
+Builds each agent's A2A server and runs it on its own uvicorn server (or mounts
+it on the shared host in "shared" hosting mode), and keeps the registry of the
+agents this process serves. The engine uses it when it hosts agents itself;
+in supervisor mode each worker process (see src.sharding) uses it for the
+agents it owns. Status changes are reported to the listener set with
+set_status_listener (the engine's health monitor).
+"""
+import os
+import asyncio
+from typing import Awaitable, Callable, Optional
+import uvicorn
+from fastapi.responses import JSONResponse
+from src.task_manager import AgentTaskManager
+from src.helpers import get_agent_card, get_server_config
+from src.port_allocator import init_port_allocator, is_port_bindable
+from src.agent_host import SharedAgentHost, AGENT_HOSTING_MODE
+from src.sharding import SUPERVISOR_MODE
+from src.task_store import create_task_store
+from src.mcp_pool import MCP_POOL
+from src.base_server import BaseA2AServer
+from src.llm_provider import get_llm_provider_config
+from utils.push_notification_auth import PushNotificationSenderAuth
+from utils.push_dispatcher import get_push_dispatcher
+from utils.verified_url_cache import VERIFIED_URLS
+from db import AgentConfigModel, get_agent_repository
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+# In "shared" hosting mode all agent apps are mounted on one uvicorn server under /agents/{name}/
+# (a supervisor hosts no agents itself; its workers each run their own shared host)
+SHARED_HOST = SharedAgentHost() if AGENT_HOSTING_MODE == "shared" and not SUPERVISOR_MODE else None
+
+def get_agent_instance(agent: AgentConfigModel, provider):
+    kwargs = get_llm_provider_config(provider)
+    from backend.src.agent import Agent
+    return Agent(prompt=agent.agent_prompt, servers_cfg=get_server_config(agent), **kwargs)
+
+async def run_starlette_app(app, host, port, server_ref=None):
+    config = uvicorn.Config(app, host=host, port=port, log_level="info")
+    server = uvicorn.Server(config)
+    if server_ref is not None:
+        server_ref["uvicorn_server"] = server
+    await server.serve()
+
+async def get_llm_provider_and_config():
+    """
+    Fetch the current LLM provider and its fields from the DB (or .env as fallback).
+    Returns (provider, config_dict)
+    """
+    config = await get_agent_repository().get_llm_provider_config()
+    if config:
+        provider = config.get("LLM_PROVIDER") or config.get("provider")
+        return provider, config
+    # fallback: return from env
+    import os
+    provider = os.getenv("LLM_PROVIDER", "azure")
+    result = {"LLM_PROVIDER": provider}
+    if provider == "openai":
+        result["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY", "")
+    elif provider == "google":
+        result["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY", "")
+    elif provider == "azure":
+        result["AZURE_OPENAI_ENDPOINT"] = os.getenv("AZURE_OPENAI_ENDPOINT", "")
+        result["AZURE_OPENAI_API_KEY"] = os.getenv("AZURE_OPENAI_API_KEY", "")
+        result["AZURE_OPENAI_API_VERSION"] = os.getenv("OPENAI_API_VERSION", "")
+    return provider, result
+
+async def create_server(agent: AgentConfigModel, url: str | None = None):
+    host = agent.host
+    port = int(agent.port)
+    provider, provider_config = await get_llm_provider_and_config()
+    _agent_card = await get_agent_card(agent, url=url)
+    agent_inst = get_agent_instance(agent, provider)
+    # Optionally, pass provider_config to agent_inst if needed
+    notification_sender_auth = PushNotificationSenderAuth()
+    # Reuses the agent's persisted key, or takes one pre-generated off the event loop
+    await notification_sender_auth.load_signing_key(agent.agent_name)
+    server = BaseA2AServer(
+        host=host,
+        port=port,
+        agent_card=_agent_card,
+        task_manager=AgentTaskManager(
+            agent=agent_inst,
+            notification_sender_auth=notification_sender_auth,
+            task_store=create_task_store(agent.agent_name),
+            history_max_length=agent.history_max_length,
+            max_concurrent_tasks=agent.max_concurrent_tasks,
+        )
+    )
+    server.app.add_route(
+        "/.well-known/jwks.json", notification_sender_auth.handle_jwks_endpoint, methods=["GET"]
+    )
+
+    async def handle_metrics(_request):
+        return JSONResponse({
+            "push": get_push_dispatcher().source_metrics(agent.agent_name),
+            "tasks": server.task_manager.tasks.metrics(),
+            "streams": server.task_manager.sse_metrics(),
+            "admission": server.task_manager.admission.metrics(),
+        })
+
+    server.app.add_route("/metrics", handle_metrics, methods=["GET"])
+    return server
+
+def agent_url(agent: AgentConfigModel) -> str:
+    if SHARED_HOST is not None:
+        return SHARED_HOST.agent_url(agent.agent_name)
+    return f"http://{agent.host}:{agent.port}/"
+
+# Global registry to track running agent server tasks and server instances
+AGENT_SERVER_TASKS = {}  # {agent_name: {"task": ..., "server": ...}}
+
+# Number of agents brought up concurrently by start_agent_servers
+AGENT_STARTUP_CONCURRENCY = int(os.getenv("AGENT_STARTUP_CONCURRENCY", "8"))
+# How long to wait for a freshly started uvicorn server to report it is listening
+AGENT_READY_TIMEOUT = float(os.getenv("AGENT_READY_TIMEOUT", "10"))
+# Build agent graphs (LLM client, MCP tools) in the background right after startup,
+# so the first request to each agent does not pay for it
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "false").lower() in ("1", "true", "yes")
+AGENT_WARMUP_CONCURRENCY = int(os.getenv("AGENT_WARMUP_CONCURRENCY", "4"))
+_warmup_semaphore = asyncio.Semaphore(max(1, AGENT_WARMUP_CONCURRENCY))
+WARMUP_TASKS = set()
+
+_status_listener: Optional[Callable[[AgentConfigModel, Optional[str]], None]] = None
+
+def set_status_listener(listener: Optional[Callable[[AgentConfigModel, Optional[str]], None]]):
+    """Report agent status changes as listener(agent, status); status is None when only the
+    agent's details (e.g. readiness) changed."""
+    global _status_listener
+    _status_listener = listener
+
+def report_status(agent: AgentConfigModel, status: Optional[str]):
+    if _status_listener is not None:
+        _status_listener(agent, status)
+
+async def wait_until_started(server_ref, task, timeout=AGENT_READY_TIMEOUT):
+    """Wait for the uvicorn server behind server_ref to start listening. Returns True once it does."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        uvicorn_server = server_ref.get("uvicorn_server")
+        if uvicorn_server is not None and uvicorn_server.started:
+            return True
+        if task.done():
+            return False
+        await asyncio.sleep(0.05)
+    return False
+
+async def warm_up_agent(agent):
+    """Build the agent's graph now; requests arriving meanwhile wait on this build."""
+    entry = AGENT_SERVER_TASKS.get(agent.agent_name)
+    if not entry:
+        return
+    async with _warmup_semaphore:
+        ready = await entry["server"].task_manager.agent.warm_up()
+    logger.info(f"[Startup] Agent {agent.agent_name} warm-up {'done' if ready else 'failed'}")
+    report_status(agent, None)
+
+def schedule_warm_up(agent):
+    task = asyncio.create_task(warm_up_agent(agent))
+    WARMUP_TASKS.add(task)
+    task.add_done_callback(WARMUP_TASKS.discard)
+
+async def start_agent_server(agent, max_retries=5):
+    """
+    Starts a single agent server: picks a free port, builds the server and launches uvicorn.
+    Returns the server task, or None if no free port could be found. Raises on other failures.
+    In shared hosting mode the agent is mounted on the shared server instead.
+    """
+    if SHARED_HOST is not None:
+        return await mount_agent_server(agent)
+    allocator = await init_port_allocator()
+    original_port = agent.port
+    tried_ports = set()
+    for _ in range(max_retries):
+        if is_port_bindable(agent.host, agent.port):
+            break
+        tried_ports.add(agent.port)
+        print(f"Port {agent.port} is in use, getting next port and retrying...")
+        if agent.port != original_port:
+            allocator.release(agent.port)
+        try:
+            agent.port = allocator.allocate(agent.host, exclude=tried_ports)
+        except RuntimeError as e:
+            logger.error(f"[Startup] {e}")
+            break
+    if not is_port_bindable(agent.host, agent.port):
+        print(f"Port {agent.port} is still in use after {max_retries} retries. Skipping agent {agent.agent_name}.")
+        if agent.port != original_port:
+            allocator.release(agent.port)
+            agent.port = original_port
+        return None
+    if agent.port != original_port:
+        # Persist the final port once, and hand the old one back to the allocator
+        await get_agent_repository().update_agent_port(agent.agent_name, agent.port)
+        allocator.release(original_port)
+    server = await create_server(agent)
+    print(f"Starting {agent.agent_name} agent server on {agent.host}:{agent.port}")
+    server_ref = {}
+    task = asyncio.create_task(run_starlette_app(server.app, server.host, agent.port, server_ref))
+    AGENT_SERVER_TASKS[agent.agent_name] = {"task": task, "server": server, "uvicorn_server": server_ref}
+    return task
+
+async def mount_agent_server(agent):
+    """Mounts the agent's app on the shared host, starting the shared server if needed."""
+    if agent.port != SHARED_HOST.port:
+        agent.port = SHARED_HOST.port
+        await get_agent_repository().update_agent_port(agent.agent_name, agent.port)
+    server = await create_server(agent, url=SHARED_HOST.agent_url(agent.agent_name))
+    SHARED_HOST.mount(agent.agent_name, server.app)
+    task = SHARED_HOST.ensure_started()
+    AGENT_SERVER_TASKS[agent.agent_name] = {"task": task, "server": server, "uvicorn_server": SHARED_HOST.server_ref, "shared": True}
+    return task
+
+async def start_agent_servers(
+    agent_models,
+    max_retries=5,
+    concurrency=AGENT_STARTUP_CONCURRENCY,
+    raise_on_error=True,
+    warm_up=AGENT_WARMUP,
+    launcher: Optional[Callable[[AgentConfigModel], Awaitable]] = None,
+):
+    """
+    Starts agent servers concurrently, at most `concurrency` at a time.
+    Each agent's readiness or failure is logged and reported (see set_status_listener) as soon
+    as it happens. Failures are isolated per agent; if raise_on_error is set, the first failure
+    is re-raised after every agent has been attempted.
+    With warm_up, each agent's graph is built in the background once its server is up.
+    A launcher starts agents outside this process instead (e.g. on a sharding worker, which
+    warms up its own agents); it must return once the agent is listening.
+    Returns the list of server tasks that were started.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _start(agent):
+        async with semaphore:
+            report_status(agent, "starting")
+            try:
+                if launcher is not None:
+                    await launcher(agent)
+                    logger.info(f"[Startup] Agent {agent.agent_name} ready on {agent.host}:{agent.port}")
+                    report_status(agent, "running")
+                    return None
+                task = await start_agent_server(agent, max_retries)
+            except Exception as e:
+                logger.error(f"[Startup] Agent {agent.agent_name} failed to start: {e}")
+                report_status(agent, "mcp error" if isinstance(e, RuntimeError) else "error")
+                raise
+            if task is None:
+                report_status(agent, "error")
+                return None
+        if await wait_until_started(AGENT_SERVER_TASKS[agent.agent_name]["uvicorn_server"], task):
+            logger.info(f"[Startup] Agent {agent.agent_name} ready on {agent.host}:{agent.port}")
+            report_status(agent, "running")
+            if warm_up:
+                schedule_warm_up(agent)
+        else:
+            logger.warning(f"[Startup] Agent {agent.agent_name} did not report ready within {AGENT_READY_TIMEOUT}s")
+        return task
+
+    results = await asyncio.gather(*(_start(agent) for agent in agent_models), return_exceptions=True)
+    tasks = [r for r in results if isinstance(r, asyncio.Task)]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        logger.error(f"[Startup] {len(errors)}/{len(results)} agent(s) failed to start")
+        if raise_on_error:
+            raise errors[0]
+    return tasks
+
+async def stop_agent_server(agent_name):
+    """Stops a running agent server (or unmounts it from the shared host)."""
+    entry = AGENT_SERVER_TASKS.pop(agent_name, None)
+    if not entry:
+        return
+    try:
+        if entry.get("shared"):
+            SHARED_HOST.unmount(agent_name)
+            await entry["server"].task_manager.tasks.close()
+            return
+        uvicorn_server = entry.get("uvicorn_server", {}).get("uvicorn_server")
+        if uvicorn_server:
+            uvicorn_server.should_exit = True
+        server = entry.get("server")
+        task = entry.get("task")
+        if hasattr(server, "shutdown") and asyncio.iscoroutinefunction(server.shutdown):
+            try:
+                await server.shutdown()
+            except Exception:
+                pass
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # Persist pending task changes (write-behind stores)
+        await server.task_manager.tasks.close()
+    finally:
+        await _release_mcp_sessions(entry["server"].task_manager.agent.servers_cfg)
+
+async def _release_mcp_sessions(servers_cfg: dict):
+    """Close pooled MCP sessions of a stopped agent that no other agent of this process uses."""
+    in_use = {
+        (cfg["url"].rstrip("/"), cfg["transport"])
+        for entry in AGENT_SERVER_TASKS.values()
+        for cfg in entry["server"].task_manager.agent.servers_cfg.values()
+    }
+    for cfg in servers_cfg.values():
+        if (cfg["url"].rstrip("/"), cfg["transport"]) not in in_use:
+            await MCP_POOL.remove(cfg["url"], cfg["transport"])
+
+def get_task_store_metrics() -> dict:
+    return {name: entry["server"].task_manager.tasks.metrics() for name, entry in AGENT_SERVER_TASKS.items()}
+
+def get_stream_metrics() -> dict:
+    return {name: entry["server"].task_manager.sse_metrics() for name, entry in AGENT_SERVER_TASKS.items()}
+
+def get_admission_metrics() -> dict:
+    return {name: entry["server"].task_manager.admission.metrics() for name, entry in AGENT_SERVER_TASKS.items()}
+
+async def close_task_stores():
+    """Stop sweepers and flush write-behind task stores of all running agents."""
+    await asyncio.gather(
+        *(entry["server"].task_manager.tasks.close() for entry in AGENT_SERVER_TASKS.values()),
+        return_exceptions=True,
+    )
+
+def get_metrics() -> dict:
+    return {
+        "push": get_push_dispatcher().metrics(),
+        "verified_urls": VERIFIED_URLS.metrics(),
+        "task_stores": get_task_store_metrics(),
+        "streams": get_stream_metrics(),
+        "admission": get_admission_metrics(),
+    }
+
+def set_llm_env_vars_from_config(config: dict):
+    """
+    Set LLM provider config values as environment variables in the current process.
+    """
+    env_keys = [
+        "LLM_PROVIDER",
+        "OPENAI_API_KEY",
+        "GOOGLE_API_KEY",
+        "AZURE_OPENAI_ENDPOINT",
+        "AZURE_OPENAI_API_KEY",
+        "AZURE_OPENAI_API_VERSION",
+        "OPENAI_API_VERSION"
+    ]
+    # logger.info(f"Setting LLM provider config as environment variables: {config}")
+    for key in env_keys:
+        if key in config:
+            os.environ[key] = str(config[key])
+
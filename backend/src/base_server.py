@@ -52,21 +52,29 @@ class BaseA2AServer:
             raise ValueError("task_manager is not defined")
         await run_starlette_app(self.app, host=self.host, port=self.port)
 
+    @property
+    def readiness(self) -> str | None:
+        """Warm-up state of the agent behind the task manager (cold, warming, ready, failed)."""
+        return getattr(getattr(self.task_manager, "agent", None), "readiness", None)
+
     def _get_agent_card(self, request: Request) -> JSONResponse:
-        return JSONResponse(self.agent_card.model_dump(exclude_none=True))
+        card = self.agent_card.model_dump(exclude_none=True)
+        if self.readiness is not None:
+            card["readiness"] = self.readiness
+        return JSONResponse(card)
 
     async def _process_request(self, request: Request):
         try:
             body = await request.json()
             json_rpc_request = A2ARequest.validate_python(body)
 
-            result = await self._handle_task_request(json_rpc_request)
+            result = await self._handle_task_request(json_rpc_request, request)
             return self._create_response(result)
 
         except Exception as e:
             return self._handle_exception(e)
 
-    async def _handle_task_request(self, json_rpc_request):
+    async def _handle_task_request(self, json_rpc_request, request: Request | None = None):
         if isinstance(json_rpc_request, GetTaskRequest):
             return await self.task_manager.on_get_task(json_rpc_request)
         elif isinstance(json_rpc_request, SendTaskRequest):
@@ -80,7 +88,9 @@ class BaseA2AServer:
         elif isinstance(json_rpc_request, GetTaskPushNotificationRequest):
             return await self.task_manager.on_get_task_push_notification(json_rpc_request)
         elif isinstance(json_rpc_request, TaskResubscriptionRequest):
-            return await self.task_manager.on_resubscribe_to_task(json_rpc_request)
+            # Reconnecting clients send the id of the last event they received
+            last_event_id = request.headers.get("Last-Event-ID") if request is not None else None
+            return await self.task_manager.on_resubscribe_to_task(json_rpc_request, last_event_id)
         else:
             logger.warning(f"Unexpected request type: {type(json_rpc_request)}")
             raise ValueError(f"Unexpected request type: {type(json_rpc_request)}")
@@ -99,9 +109,13 @@ class BaseA2AServer:
 
     def _create_response(self, result: Any) -> JSONResponse | EventSourceResponse:
         if isinstance(result, AsyncIterable):
-            async def event_generator(result) -> AsyncIterable[dict[str, str]]:
+            async def event_generator(result) -> AsyncIterable[bytes | dict[str, str]]:
                 async for item in result:
-                    yield {"data": item.model_dump_json(exclude_none=True)}
+                    if isinstance(item, bytes):
+                        # Pre-encoded SSE frame (see src.sse_frames)
+                        yield item
+                    else:
+                        yield {"data": item.model_dump_json(exclude_none=True)}
             return EventSourceResponse(event_generator(result))
         elif isinstance(result, JSONRPCResponse):
             return JSONResponse(result.model_dump(exclude_none=True))
@@ -112,5 +126,7 @@ class BaseA2AServer:
     async def health(self, request: Request) -> JSONResponse:
         logger.info("[BASE AGENT] /health endpoint hit")
         response = {"status": "ok"}
+        if self.readiness is not None:
+            response["readiness"] = self.readiness
         logger.info(f"[BASE AGENT] /health response: {response}")
         return JSONResponse(response)
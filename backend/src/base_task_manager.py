@@ -32,12 +32,29 @@ from utils.types import (
     InternalError,
 )
 from src.helpers import new_not_implemented_error
+from src.task_store import InMemoryTaskStore, TaskStore, TERMINAL_STATES
+from src.sse_frames import SSEFrame, SubscriberQueue, TaskEventLog, frame_prefix
+import os
 import asyncio
 import logging
+from collections import deque
+from itertools import islice
 import src.helpers as helpers
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
+# Number of locks task reads/writes are spread over (by task id)
+TASK_LOCK_STRIPES = int(os.getenv("TASK_LOCK_STRIPES", "64"))
+# Messages kept per task history by default (0 keeps all); agents can override it
+TASK_HISTORY_MAX_LENGTH = int(os.getenv("TASK_HISTORY_MAX_LENGTH", "1000"))
+# Streamed events kept per task for Last-Event-ID replay, and for how long after the stream ended
+TASK_EVENT_LOG_SIZE = int(os.getenv("TASK_EVENT_LOG_SIZE", "256"))
+TASK_EVENT_LOG_RETENTION = float(os.getenv("TASK_EVENT_LOG_RETENTION", "300"))
+# Cancel a task's work once its last SSE subscriber is gone (unless it has push notifications),
+# after a grace period for reconnects
+TASK_CANCEL_ON_DISCONNECT = os.getenv("TASK_CANCEL_ON_DISCONNECT", "true").lower() in ("1", "true", "yes")
+TASK_CANCEL_GRACE_PERIOD = float(os.getenv("TASK_CANCEL_GRACE_PERIOD", "10"))
+
 class TaskManager(ABC):
     @abstractmethod
     async def on_get_task(self, request: GetTaskRequest) -> GetTaskResponse:
@@ -71,25 +88,38 @@ class TaskManager(ABC):
 
     @abstractmethod
     async def on_resubscribe_to_task(
-        self, request: TaskResubscriptionRequest
+        self, request: TaskResubscriptionRequest, last_event_id: str | None = None
     ) -> Union[AsyncIterable[SendTaskResponse], JSONRPCResponse]:
         pass
 
 
 class InMemoryTaskManager(TaskManager):
-    def __init__(self):
-        self.tasks: dict[str, Task] = {}
-        self.push_notification_infos: dict[str, PushNotificationConfig] = {}
-        self.lock = asyncio.Lock()
-        self.task_sse_subscribers: dict[str, List[asyncio.Queue]] = {}
-        self.subscriber_lock = asyncio.Lock()
+    def __init__(self, task_store: TaskStore | None = None, history_max_length: int | None = None):
+        # Bounded LRU/TTL store for tasks and their push-notification config
+        # (optionally persisted write-behind, see src.task_store.create_task_store)
+        self.tasks: TaskStore = task_store or InMemoryTaskStore()
+        if history_max_length is None:
+            history_max_length = TASK_HISTORY_MAX_LENGTH
+        self.history_max_length = history_max_length if history_max_length > 0 else None
+        # Striped locks: updates to one task are serialized, unrelated tasks don't contend
+        self._task_locks = [asyncio.Lock() for _ in range(max(1, TASK_LOCK_STRIPES))]
+        # Only mutated without awaiting in between, so the registry itself needs no lock
+        self.task_sse_subscribers: dict[str, List[SubscriberQueue]] = {}
+        self.task_event_logs: dict[str, TaskEventLog] = {}
+        self.sse_disconnects = 0
+        # Agent work in progress, by task id (see run_task)
+        self.running_tasks: dict[str, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+
+    def task_lock(self, task_id: str) -> asyncio.Lock:
+        return self._task_locks[hash(task_id) % len(self._task_locks)]
 
     async def on_get_task(self, request: GetTaskRequest) -> GetTaskResponse:
         logger.info(f"Getting task {request.params.id}")
         task_query_params: TaskQueryParams = request.params
 
-        async with self.lock:
-            task = self.tasks.get(task_query_params.id)
+        async with self.task_lock(task_query_params.id):
+            task = await self.tasks.get(task_query_params.id)
             if task is None:
                 return GetTaskResponse(id=request.id, error=TaskNotFoundError())
 
@@ -103,12 +133,71 @@ class InMemoryTaskManager(TaskManager):
         logger.info(f"Cancelling task {request.params.id}")
         task_id_params: TaskIdParams = request.params
 
-        async with self.lock:
-            task = self.tasks.get(task_id_params.id)
+        async with self.task_lock(task_id_params.id):
+            task = await self.tasks.get(task_id_params.id)
             if task is None:
                 return CancelTaskResponse(id=request.id, error=TaskNotFoundError())
+            if task.status.state in TERMINAL_STATES:
+                return CancelTaskResponse(id=request.id, error=TaskNotCancelableError())
+
+        task = await self.cancel_task(task_id_params.id)
+        if task is None:
+            return CancelTaskResponse(id=request.id, error=TaskNotCancelableError())
+        return CancelTaskResponse(id=request.id, result=self.append_task_history(task, None))
+
+    def run_task(self, task_id: str, coro) -> asyncio.Task:
+        """Run the agent work for a task in the background, cancellable via cancel_task."""
+        running = asyncio.create_task(coro)
+        self.running_tasks[task_id] = running
+        # Kept out of store eviction until the work ends
+        self.tasks.pin(task_id)
+
+        def _done(finished: asyncio.Task):
+            self.tasks.unpin(task_id)
+            if self.running_tasks.get(task_id) is finished:
+                del self.running_tasks[task_id]
+
+        running.add_done_callback(_done)
+        return running
+
+    async def cancel_task(self, task_id: str) -> Task | None:
+        """Interrupt the task's running work (LLM request or tool call), record the CANCELED
+        state and publish it as the final event. Returns None if the task had already finished."""
+        running = self.running_tasks.get(task_id)
+        if running is not None:
+            running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+        return await self.mark_canceled(task_id)
+
+    async def mark_canceled(self, task_id: str) -> Task | None:
+        """Record the CANCELED state of a task whose work was interrupted and publish it as the
+        final event, once. Returns the task, or None if it is gone or ended in another state."""
+        async with self.task_lock(task_id):
+            task = await self.tasks.get(task_id)
+            if task is None:
+                return None
+            if task.status.state == TaskState.CANCELED:
+                return task
+            if task.status.state in TERMINAL_STATES:
+                return None
+            task.status = TaskStatus(state=TaskState.CANCELED)
+            await self.tasks.updated(task)
+        logger.info(f"Task {task_id} canceled")
+        await self.enqueue_events_for_sse(task_id, TaskStatusUpdateEvent(id=task_id, status=task.status, final=True))
+        await self.send_task_notification(task)
+        return task
+
+    async def send_task_notification(self, task: Task):
+        pass
 
-        return CancelTaskResponse(id=request.id, error=TaskNotCancelableError())
+    async def _cancel_if_abandoned(self, task_id: str):
+        await asyncio.sleep(TASK_CANCEL_GRACE_PERIOD)
+        if task_id in self.task_sse_subscribers or task_id not in self.running_tasks:
+            return
+        if await self.tasks.get_push_info(task_id) is not None:
+            return  # the client still gets updates by push notification
+        logger.info(f"Canceling task {task_id}: no SSE subscriber left")
+        await self.cancel_task(task_id)
 
     @abstractmethod
     async def on_send_task(self, request: SendTaskRequest) -> SendTaskResponse:
@@ -121,28 +210,28 @@ class InMemoryTaskManager(TaskManager):
         pass
 
     async def set_push_notification_info(self, task_id: str, notification_config: PushNotificationConfig):
-        async with self.lock:
-            task = self.tasks.get(task_id)
+        async with self.task_lock(task_id):
+            task = await self.tasks.get(task_id)
             if task is None:
                 raise ValueError(f"Task not found for {task_id}")
 
-            self.push_notification_infos[task_id] = notification_config
+            await self.tasks.set_push_info(task_id, notification_config)
 
         return
     
     async def get_push_notification_info(self, task_id: str) -> PushNotificationConfig:
-        async with self.lock:
-            task = self.tasks.get(task_id)
+        async with self.task_lock(task_id):
+            task = await self.tasks.get(task_id)
             if task is None:
                 raise ValueError(f"Task not found for {task_id}")
 
-            return self.push_notification_infos[task_id]
+            return await self.tasks.get_push_info(task_id)
             
         return
     
     async def has_push_notification_info(self, task_id: str) -> bool:
-        async with self.lock:
-            return task_id in self.push_notification_infos
+        async with self.task_lock(task_id):
+            return await self.tasks.get_push_info(task_id) is not None
             
 
     async def on_set_task_push_notification(
@@ -185,94 +274,173 @@ class InMemoryTaskManager(TaskManager):
 
     async def upsert_task(self, task_send_params: TaskSendParams) -> Task:
         logger.info(f"Upserting task {task_send_params.id}")
-        async with self.lock:
-            task = self.tasks.get(task_send_params.id)
+        async with self.task_lock(task_send_params.id):
+            task = await self.tasks.get(task_send_params.id)
             if task is None:
                 task = Task(
                     id=task_send_params.id,
                     sessionId = task_send_params.sessionId,
                     messages=[task_send_params.message],
                     status=TaskStatus(state=TaskState.SUBMITTED),
-                    history=[task_send_params.message],
                 )
-                self.tasks[task_send_params.id] = task
+                task.history = deque([task_send_params.message], maxlen=self.history_max_length)
+                await self.tasks.put(task)
             else:
-                task.history.append(task_send_params.message)
+                dropped = self.append_history(task, task_send_params.message)
+                await self.tasks.updated(task, messages=[task_send_params.message], dropped=dropped)
 
             return task
 
     async def on_resubscribe_to_task(
-        self, request: TaskResubscriptionRequest
+        self, request: TaskResubscriptionRequest, last_event_id: str | None = None
     ) -> Union[AsyncIterable[SendTaskStreamingResponse], JSONRPCResponse]:
         return new_not_implemented_error(request.id)
 
     async def update_store(
         self, task_id: str, status: TaskStatus, artifacts: list[Artifact]
     ) -> Task:
-        async with self.lock:
-            try:
-                task = self.tasks[task_id]
-            except KeyError:
+        async with self.task_lock(task_id):
+            task = await self.tasks.get(task_id)
+            if task is None:
                 logger.error(f"Task {task_id} not found for updating the task")
                 raise ValueError(f"Task {task_id} not found")
 
             task.status = status
 
+            dropped = []
             if status.message is not None:
-                task.history.append(status.message)
+                dropped = self.append_history(task, status.message)
 
             if artifacts is not None:
                 if task.artifacts is None:
                     task.artifacts = []
                 task.artifacts.extend(artifacts)
 
+            await self.tasks.updated(
+                task,
+                messages=[] if status.message is None else [status.message],
+                artifacts=artifacts or [],
+                dropped=dropped,
+            )
             return task
 
+    def append_history(self, task: Task, message) -> list:
+        """Append to the task's history ring buffer; returns the messages that fell out.
+
+        The deque only lives on the manager's own task objects: responses, push payloads and
+        the task store get the history as a list (append_task_history, task_snapshot)."""
+        history = task.history
+        if not isinstance(history, deque) or history.maxlen != self.history_max_length:
+            # e.g. loaded from a persisted store, or the agent's limit changed
+            history = deque(history or (), maxlen=self.history_max_length)
+            task.history = history
+        dropped = [history[0]] if history.maxlen is not None and len(history) == history.maxlen else []
+        history.append(message)
+        return dropped
+
+    @staticmethod
+    def task_snapshot(task: Task) -> Task:
+        """Shallow copy of the task with its history as a plain list, for use outside the manager."""
+        return task.model_copy(update={"history": None if task.history is None else list(task.history)})
+
     def append_task_history(self, task: Task, historyLength: int | None):
-        new_task = task.model_copy()
-        if historyLength is not None and historyLength > 0:
-            new_task.history = new_task.history[-historyLength:]
+        """Shallow view of the task with only its last historyLength messages."""
+        if historyLength is not None and historyLength > 0 and task.history:
+            history = list(islice(reversed(task.history), historyLength))
+            history.reverse()
         else:
-            new_task.history = []
-
-        return new_task        
-
-    async def setup_sse_consumer(self, task_id: str, is_resubscribe: bool = False):
-        async with self.subscriber_lock:
-            if task_id not in self.task_sse_subscribers:
-                if is_resubscribe:
-                    raise ValueError("Task not found for resubscription")
-                else:
-                    self.task_sse_subscribers[task_id] = []
-
-            sse_event_queue = asyncio.Queue(maxsize=0) # <=0 is unlimited
-            self.task_sse_subscribers[task_id].append(sse_event_queue)
-            return sse_event_queue
+            history = []
+        return task.model_copy(update={"history": history})
+
+    async def setup_sse_consumer(self, task_id: str, is_resubscribe: bool = False, last_event_id: str | None = None):
+        """Register an SSE queue for the task. On resubscription with the id of the last
+        event the client received, the events it missed are queued first."""
+        missed: list[SSEFrame] = []
+        if is_resubscribe:
+            async with self.task_lock(task_id):
+                task = await self.tasks.get(task_id)
+            if task is None:
+                raise ValueError("Task not found for resubscription")
+            seq = _parse_event_id(last_event_id)
+            event_log = self.task_event_logs.get(task_id)
+            if seq is not None and event_log is not None:
+                missed = event_log.since(seq)
+                if missed and missed[0].seq > seq + 1:
+                    logger.warning(f"Events {seq + 1}-{missed[0].seq - 1} of task {task_id} are no longer retained")
+            if task.status.state in TERMINAL_STATES and not missed:
+                raise ValueError("Task has already finished")
+        sse_event_queue = SubscriberQueue()
+        # No await between the replay and registering: nothing is missed or sent twice
+        for frame in missed:
+            sse_event_queue.put(frame)
+        self.task_sse_subscribers.setdefault(task_id, []).append(sse_event_queue)
+        return sse_event_queue
+
+    def _log_event(self, task_id: str, task_update_event) -> SSEFrame:
+        event_log = self.task_event_logs.get(task_id)
+        if event_log is None:
+            event_log = self.task_event_logs[task_id] = TaskEventLog(TASK_EVENT_LOG_SIZE)
+        elif event_log.expiry is not None:
+            # A new turn on the task
+            event_log.expiry.cancel()
+            event_log.expiry = None
+        frame = event_log.append(task_update_event)
+        if frame.final:
+            event_log.expiry = asyncio.get_running_loop().call_later(
+                TASK_EVENT_LOG_RETENTION, self.task_event_logs.pop, task_id, None
+            )
+        return frame
 
     async def enqueue_events_for_sse(self, task_id, task_update_event):
-        async with self.subscriber_lock:
-            if task_id not in self.task_sse_subscribers:
-                return
-
-            current_subscribers = self.task_sse_subscribers[task_id]
-            for subscriber in current_subscribers:
-                await subscriber.put(task_update_event)
+        # Serialized and numbered once here (and logged for replay); subscribers only add their request id
+        frame = self._log_event(task_id, task_update_event)
+        # Puts never block: a slow subscriber is handled by its queue's overflow policy
+        for subscriber in self.task_sse_subscribers.get(task_id, ()):
+            subscriber.put(frame)
+
+    def sse_metrics(self) -> dict:
+        """Per-subscriber queue depth and lag of the tasks currently streamed."""
+        return {
+            "subscribers": {
+                task_id: [subscriber.metrics() for subscriber in subscribers]
+                for task_id, subscribers in self.task_sse_subscribers.items()
+            },
+            "disconnected_slow": self.sse_disconnects,
+            "running_tasks": len(self.running_tasks),
+        }
 
     async def dequeue_events_for_sse(
-        self, request_id, task_id, sse_event_queue: asyncio.Queue
-    ) -> AsyncIterable[SendTaskStreamingResponse] | JSONRPCResponse:
+        self, request_id, task_id, sse_event_queue: SubscriberQueue
+    ) -> AsyncIterable[bytes] | JSONRPCResponse:
+        """Yield the task's events as SSE frames (bytes) for the subscriber of request_id."""
+        prefix = frame_prefix(request_id)
         try:
-            while True:                
-                event = await sse_event_queue.get()
-                if isinstance(event, JSONRPCError):
-                    yield SendTaskStreamingResponse(id=request_id, error=event)
+            while True:
+                frame = await sse_event_queue.get()
+                if frame is None:
+                    # Fell too far behind: end with an error carrying the id to resume from
+                    self.sse_disconnects += 1
+                    logger.warning(f"Disconnecting slow SSE subscriber of task {task_id}")
+                    error = InternalError(message="Subscriber too slow; resubscribe with Last-Event-ID to resume")
+                    yield SSEFrame(error, sse_event_queue.last_sent_seq).encode(prefix)
                     break
-                                                
-                yield SendTaskStreamingResponse(id=request_id, result=event)
-                if isinstance(event, TaskStatusUpdateEvent) and event.final:
+                yield frame.encode(prefix)
+                if frame.final:
                     break
         finally:
-            async with self.subscriber_lock:
-                if task_id in self.task_sse_subscribers:
-                    self.task_sse_subscribers[task_id].remove(sse_event_queue)
-
+            subscribers = self.task_sse_subscribers.get(task_id)
+            if subscribers is not None:
+                subscribers.remove(sse_event_queue)
+                if not subscribers:
+                    del self.task_sse_subscribers[task_id]
+                    if TASK_CANCEL_ON_DISCONNECT and task_id in self.running_tasks:
+                        check = asyncio.create_task(self._cancel_if_abandoned(task_id))
+                        self._background.add(check)
+                        check.add_done_callback(self._background.discard)
+
+
+def _parse_event_id(last_event_id: str | None) -> int | None:
+    try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        return None
@@ -0,0 +1,162 @@
+"""
+Background health monitor for agent servers.
+
+A supervisor task periodically probes every agent (see src.status_probe) and
+publishes the result as a versioned, immutable snapshot. Readers such as
+/api/agent-servers serve the last snapshot without touching the DB or the
+network; `refresh()` forces an immediate re-probe and is single-flight, so
+concurrent callers share one sweep.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from db import AgentConfigModel, get_agent_repository
+from src.status_probe import probe_agents
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("AGENT_HEALTH_INTERVAL", "15"))
+HEALTH_CHECK_JITTER = float(os.getenv("AGENT_HEALTH_JITTER", "0.2"))
+
+
+class AgentHealthMonitor:
+    def __init__(
+        self,
+        interval: float = HEALTH_CHECK_INTERVAL,
+        jitter: float = HEALTH_CHECK_JITTER,
+        load_agents: Optional[Callable[[], Awaitable[List[AgentConfigModel]]]] = None,
+        status_detail: Callable[[str], str] = lambda status: "",
+        agent_url: Optional[Callable[[AgentConfigModel], str]] = None,
+        is_serving: Optional[Callable[[AgentConfigModel], bool]] = None,
+        extra: Optional[Callable[[AgentConfigModel], dict]] = None,
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self._load_agents = load_agents or (lambda: get_agent_repository().list_agents())
+        self._status_detail = status_detail
+        self._agent_url = agent_url
+        self._is_serving = is_serving
+        self._extra = extra
+        self._agents: Dict[str, dict] = {}
+        self._version = 0
+        self._checked_at: Optional[float] = None
+        self._body: Optional[bytes] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sweep: Optional[asyncio.Task] = None
+        # time.monotonic() of the last update_agent/remove_agent per agent, so a sweep that was
+        # already probing does not overwrite what they published
+        self._touched: Dict[str, float] = {}
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _next_delay(self) -> float:
+        spread = self.interval * self.jitter
+        return max(0.0, self.interval + random.uniform(-spread, spread))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"[HealthMonitor] Sweep failed: {e}")
+            await asyncio.sleep(self._next_delay())
+
+    async def refresh(self):
+        """Re-probe all agents now. Concurrent callers share one in-flight sweep."""
+        if self._sweep is None or self._sweep.done():
+            self._sweep = asyncio.create_task(self._do_sweep())
+        await asyncio.shield(self._sweep)
+
+    def _touched_since(self, agent_name: str, since: float) -> bool:
+        touched = self._touched.get(agent_name)
+        return touched is not None and touched >= since
+
+    async def _do_sweep(self):
+        started = time.monotonic()
+        agents = await self._load_agents()
+        results = await probe_agents(agents, is_serving=self._is_serving)
+        # Merge into the current snapshot: agents updated or removed while we were probing keep
+        # that newer state, and a probe never replaces a more recent check
+        entries = dict(self._agents)
+        for agent in agents:
+            if self._touched_since(agent.agent_name, started):
+                continue
+            result = results[agent.agent_name]
+            entry = self._make_entry(agent, result["status"], result["checked_at"])
+            current = entries.get(agent.agent_name)
+            if current is not None and current["status_checked_at"] > entry["status_checked_at"]:
+                continue
+            entries[agent.agent_name] = entry
+        # Drop agents that are gone from the DB, unless they were (re)added during the sweep
+        loaded = {agent.agent_name for agent in agents}
+        for agent_name in list(entries):
+            if agent_name not in loaded and not self._touched_since(agent_name, started):
+                del entries[agent_name]
+        self._touched = {name: at for name, at in self._touched.items() if at >= started}
+        self._publish(entries)
+        logger.debug(f"[HealthMonitor] Snapshot v{self._version}: {len(entries)} agents")
+
+    def _make_entry(self, agent: AgentConfigModel, status: str, checked_at: Optional[int] = None) -> dict:
+        agent_dict = agent.dict()
+        agent_dict["status"] = status
+        agent_dict["status_checked_at"] = checked_at if checked_at is not None else int(time.time())
+        agent_dict["status_detail"] = self._status_detail(status)
+        if self._agent_url is not None:
+            agent_dict["url"] = self._agent_url(agent)
+        if self._extra is not None:
+            agent_dict.update(self._extra(agent))
+        return agent_dict
+
+    def _publish(self, entries: Dict[str, dict]):
+        # Snapshots are replaced wholesale, never mutated, so readers need no lock.
+        self._agents = entries
+        self._version += 1
+        self._checked_at = time.time()
+        self._body = None
+
+    def update_agent(self, agent: AgentConfigModel, status: str, checked_at: Optional[int] = None):
+        """Record a status observed outside the periodic sweep (create/refresh/startup)."""
+        self._touched[agent.agent_name] = time.monotonic()
+        entries = dict(self._agents)
+        entries[agent.agent_name] = self._make_entry(agent, status, checked_at)
+        self._publish(entries)
+
+    def remove_agent(self, agent_name: str):
+        self._touched[agent_name] = time.monotonic()
+        if agent_name in self._agents:
+            entries = dict(self._agents)
+            entries.pop(agent_name)
+            self._publish(entries)
+
+    def get_agent(self, agent_name: str) -> Optional[dict]:
+        return self._agents.get(agent_name)
+
+    def snapshot(self) -> dict:
+        return {
+            "agents": list(self._agents.values()),
+            "version": self._version,
+            "checked_at": self._checked_at,
+        }
+
+    def snapshot_body(self) -> bytes:
+        """JSON-encoded snapshot, rendered once per version."""
+        body = self._body
+        if body is None:
+            body = json.dumps(self.snapshot()).encode()
+            self._body = body
+        return body
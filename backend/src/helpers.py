@@ -3,8 +3,6 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from utils.types import AgentCard, AgentCapabilities, AgentSkill
 from backend.src.agent import SUPPORTED_CONTENT_TYPES
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_core.tools import BaseTool
 
 from utils.types import (
     JSONRPCResponse,
@@ -13,6 +11,8 @@ from utils.types import (
 )
 from typing import List
 from db import AgentConfigModel
+from src.skills_cache import SKILLS_CACHE
+from src.mcp_pool import MCP_POOL
 
 
 def are_modalities_compatible(
@@ -45,11 +45,24 @@ def get_server_config(agent: AgentConfigModel):
     }
     return SERVER_CFG
 
-async def fetch_skills(agent: AgentConfigModel) -> List[AgentSkill]:
-    SERVER_CFG = get_server_config(agent)
+async def fetch_skills(agent: AgentConfigModel, use_cache: bool = True) -> List[AgentSkill]:
+    """
+    Returns the agent's MCP tools as AgentSkills. Results are cached per
+    (mcp_address, transport) in src.skills_cache; pass use_cache=False to force a fresh listing.
+    """
+    if not use_cache:
+        return await _list_mcp_skills(agent)
+    return await SKILLS_CACHE.get(
+        agent.mcp_address, agent.mcp_transport_type, lambda: _list_mcp_skills(agent)
+    )
+
+async def _list_mcp_skills(agent: AgentConfigModel) -> List[AgentSkill]:
+    server_cfg = get_server_config(agent)[agent.agent_name]
     try:
-        client_cm = MultiServerMCPClient(SERVER_CFG)
-        tools: list[BaseTool] = await client_cm.get_tools()
+        # Listing goes through the pooled session the agent's tools use, so health
+        # checks also keep that connection warm (and notice when it drops)
+        result = await MCP_POOL.get(server_cfg["url"], server_cfg["transport"]).list_tools()
+        tools = result.tools
     except Exception as e:
         print("Exception in fetch_skills:")
         # import traceback
@@ -65,14 +78,14 @@ async def fetch_skills(agent: AgentConfigModel) -> List[AgentSkill]:
 
 
 async def get_agent_card(
-    agent: AgentConfigModel
+    agent: AgentConfigModel, url: str | None = None
 ) -> AgentCard:
     capabilities = AgentCapabilities(streaming=False, pushNotifications=True)
     skills = await fetch_skills(agent)
     agent_card = AgentCard(
         name=agent.agent_name,
         description=agent.agent_description,
-        url=f"http://{agent.host}:{agent.port}/",
+        url=url or f"http://{agent.host}:{agent.port}/",
         version="1.0.0",
         defaultInputModes=SUPPORTED_CONTENT_TYPES,
         defaultOutputModes=SUPPORTED_CONTENT_TYPES,
@@ -81,17 +94,12 @@ async def get_agent_card(
     )
     return agent_card
 
-def get_next_agent_port(start_port: int = 10000, exclude_ports=None) -> int:
+async def get_next_agent_port(exclude_ports=None, host: str = "localhost", within=None) -> int:
     """
-    Returns the next available port for a new agent by checking all existing agent ports in the DB,
-    and optionally skipping ports in exclude_ports.
+    Reserves and returns the next available port for a new agent from the engine's
+    port allocator (seeded once from the DB), optionally skipping ports in exclude_ports
+    and limited to the (start, end) sub-range `within`.
     """
-    from db import MongoDBClient
-    agents = MongoDBClient.get_all_agents()
-    used_ports = {int(agent.port) for agent in agents if hasattr(agent, 'port') and agent.port is not None}
-    if exclude_ports:
-        used_ports.update(exclude_ports)
-    port = start_port
-    while port in used_ports:
-        port += 1
-    return port
+    from src.port_allocator import init_port_allocator
+    allocator = await init_port_allocator()
+    return allocator.allocate(host, exclude=exclude_ports, within=within)
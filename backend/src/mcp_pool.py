@@ -0,0 +1,232 @@
+"""
+Pooled, long-lived MCP client sessions.
+
+One session is kept open per (url, transport) and shared by every Agent graph,
+fetch_skills and the health checks that point at the same MCP server, so tool
+calls don't pay a connect + initialize handshake each time. A holder task owns
+each session (the MCP transports must be entered and exited in one task),
+reconnects with exponential backoff when it drops, and closes it after a period
+without use (reconnecting stops as well once nobody has used the session for
+that long). Calls per server are bounded by a semaphore. Only idempotent
+requests (list_tools) are retried after a transport failure: a tool call may
+have reached the server before the connection dropped.
+"""
+import os
+import time
+import random
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.tools import BaseTool
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+MCP_MAX_CONCURRENT_CALLS = int(os.getenv("MCP_MAX_CONCURRENT_CALLS", "16"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "10"))
+MCP_SESSION_IDLE_TIMEOUT = float(os.getenv("MCP_SESSION_IDLE_TIMEOUT", "300"))
+MCP_RECONNECT_MIN_DELAY = float(os.getenv("MCP_RECONNECT_MIN_DELAY", "0.5"))
+MCP_RECONNECT_MAX_DELAY = float(os.getenv("MCP_RECONNECT_MAX_DELAY", "30"))
+# Safe to send again on a fresh session if the transport failed mid-request
+IDEMPOTENT_METHODS = {"list_tools"}
+
+
+class PooledMCPSession:
+    """A shared session to one MCP server. Duck-types the ClientSession methods the
+    langchain adapters use (call_tool, list_tools), so tools built from it go through the pool."""
+
+    def __init__(self, url: str, transport: str, max_concurrent_calls: int = MCP_MAX_CONCURRENT_CALLS):
+        self.url = url
+        self.transport = transport
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent_calls))
+        self._session = None
+        self._connected = asyncio.Event()
+        self._lost = asyncio.Event()
+        self._holder: Optional[asyncio.Task] = None
+        self._closed = False
+        self._last_used = time.monotonic()
+        self._active = 0
+        self._tools: Optional[List[BaseTool]] = None
+        self.last_error: Optional[str] = None
+        self.reconnects = 0
+        self.calls = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._session is not None
+
+    def _connection(self) -> Dict[str, Any]:
+        return {"url": self.url, "transport": self.transport}
+
+    def _ensure_holder(self):
+        if not self._closed and (self._holder is None or self._holder.done()):
+            self._holder = asyncio.create_task(self._hold())
+
+    async def _hold(self):
+        from langchain_mcp_adapters.sessions import create_session
+        delay = MCP_RECONNECT_MIN_DELAY
+        while not self._closed:
+            idle = False
+            try:
+                async with create_session(self._connection()) as session:
+                    await session.initialize()
+                    self._session = session
+                    self._connected.set()
+                    self.last_error = None
+                    delay = MCP_RECONNECT_MIN_DELAY
+                    logger.info(f"[MCPPool] Connected to {self.url} ({self.transport})")
+                    idle = await self._wait_until_lost_or_idle()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"[MCPPool] Session to {self.url} failed: {e}")
+            finally:
+                self._session = None
+                self._connected.clear()
+                self._lost.clear()
+            if self._closed:
+                return
+            if idle:
+                if self._idle():
+                    return
+                continue  # a caller arrived while the idle session was closing
+            if self._idle():
+                # Nobody is waiting for this server; the next caller starts a new holder
+                logger.info(f"[MCPPool] Not reconnecting to idle server {self.url}")
+                return
+            self.reconnects += 1
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, MCP_RECONNECT_MAX_DELAY)
+
+    def _idle(self) -> bool:
+        return self._active == 0 and time.monotonic() - self._last_used >= MCP_SESSION_IDLE_TIMEOUT
+
+    async def _wait_until_lost_or_idle(self) -> bool:
+        """Block while the session is healthy. Returns True if it was closed for being idle."""
+        while not self._closed:
+            remaining = self._last_used + MCP_SESSION_IDLE_TIMEOUT - time.monotonic()
+            if remaining <= 0 and self._active == 0:
+                logger.info(f"[MCPPool] Closing idle session to {self.url}")
+                return True
+            try:
+                await asyncio.wait_for(self._lost.wait(), max(remaining, 1.0))
+                return False
+            except asyncio.TimeoutError:
+                continue
+        return False
+
+    async def _get_session(self):
+        self._last_used = time.monotonic()
+        self._ensure_holder()
+        try:
+            await asyncio.wait_for(self._connected.wait(), MCP_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"MCP server {self.url} is not reachable: {self.last_error or 'connect timed out'}")
+        return self._session
+
+    async def _run(self, method: str, *args, **kwargs):
+        async with self._semaphore:
+            self._active += 1
+            try:
+                return await self._run_with_retry(method, *args, **kwargs)
+            finally:
+                self._active -= 1
+
+    async def _run_with_retry(self, method: str, *args, **kwargs):
+        from mcp.shared.exceptions import McpError
+        attempts = 2 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            session = await self._get_session()
+            try:
+                result = await getattr(session, method)(*args, **kwargs)
+            except McpError:
+                # Protocol-level error from the server; the session itself is fine
+                raise
+            except Exception as e:
+                # Transport failure: drop the session (and retry idempotent requests once on a fresh one)
+                self.last_error = str(e)
+                if session is self._session:
+                    self._lost.set()
+                    self._connected.clear()
+                if attempt == attempts - 1:
+                    raise
+                continue
+            finally:
+                self._last_used = time.monotonic()
+            self.calls += 1
+            return result
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, *args, **kwargs):
+        return await self._run("call_tool", name, arguments, *args, **kwargs)
+
+    async def list_tools(self, *args, **kwargs):
+        return await self._run("list_tools", *args, **kwargs)
+
+    async def get_tools(self) -> List[BaseTool]:
+        """LangChain tools for this server whose calls go through the pooled session."""
+        if self._tools is None:
+            from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+            result = await self.list_tools()
+            self._tools = [convert_mcp_tool_to_langchain_tool(self, tool) for tool in result.tools]
+        return list(self._tools)
+
+    def invalidate_tools(self):
+        self._tools = None
+
+    async def close(self):
+        self._closed = True
+        self._lost.set()
+        if self._holder is not None:
+            await asyncio.gather(self._holder, return_exceptions=True)
+            self._holder = None
+
+    def describe(self) -> dict:
+        return {
+            "url": self.url,
+            "transport": self.transport,
+            "connected": self.connected,
+            "calls": self.calls,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+
+class MCPSessionPool:
+    def __init__(self, max_concurrent_calls: int = MCP_MAX_CONCURRENT_CALLS):
+        self.max_concurrent_calls = max_concurrent_calls
+        self._sessions: Dict[Tuple[str, str], PooledMCPSession] = {}
+
+    def get(self, url: str, transport: str) -> PooledMCPSession:
+        key = (url.rstrip("/"), transport)
+        session = self._sessions.get(key)
+        if session is None:
+            session = PooledMCPSession(key[0], transport, self.max_concurrent_calls)
+            self._sessions[key] = session
+        return session
+
+    async def get_tools(self, servers_cfg: Dict[str, Dict[str, Any]]) -> List[BaseTool]:
+        """Tools for every server in a MultiServerMCPClient-style config."""
+        sessions = [self.get(cfg["url"], cfg["transport"]) for cfg in servers_cfg.values()]
+        tools: List[BaseTool] = []
+        for server_tools in await asyncio.gather(*(s.get_tools() for s in sessions)):
+            tools.extend(server_tools)
+        return tools
+
+    def invalidate_tools(self, url: Optional[str] = None, transport: Optional[str] = None):
+        for (key_url, key_transport), session in self._sessions.items():
+            if (url is None or key_url == url.rstrip("/")) and (transport is None or key_transport == transport):
+                session.invalidate_tools()
+
+    async def remove(self, url: str, transport: str):
+        """Close and drop the session to one server (once no agent uses it)."""
+        session = self._sessions.pop((url.rstrip("/"), transport), None)
+        if session is not None:
+            await session.close()
+
+    def describe(self) -> List[dict]:
+        return [session.describe() for session in self._sessions.values()]
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+
+
+MCP_POOL = MCPSessionPool()
@@ -0,0 +1,204 @@
+"""
+Engine-owned port allocator for agent servers.
+
+Ports in the configured range are tracked in a bitmap (one bit per port) that
+is seeded once from the agents stored in the DB, plus the shared agent host's
+port. Allocation is next-fit from a rotating cursor, and candidates are
+bind-tested in batches, so picking a port does not scan the DB or wait on
+connect timeouts. All operations hold a lock,
+making reserve/release atomic across the event loop and worker threads.
+"""
+import os
+import socket
+import threading
+from typing import Iterable, List, Optional, Tuple
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+PORT_RANGE_START = int(os.getenv("AGENT_PORT_RANGE_START", "10000"))
+PORT_RANGE_END = int(os.getenv("AGENT_PORT_RANGE_END", "10999"))
+BIND_TEST_BATCH = int(os.getenv("AGENT_PORT_BIND_BATCH", "16"))
+
+
+def is_port_bindable(host: str, port: int) -> bool:
+    """Return True if a listening socket could be bound to host:port right now."""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        return False
+    for family, socktype, proto, _, addr in infos:
+        s = socket.socket(family, socktype, proto)
+        try:
+            # Match uvicorn, which binds with SO_REUSEADDR, so TIME_WAIT sockets don't count as busy
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(addr)
+        except OSError:
+            return False
+        finally:
+            s.close()
+    return True
+
+
+class PortAllocator:
+    def __init__(self, start: int = PORT_RANGE_START, end: int = PORT_RANGE_END):
+        if end < start:
+            raise ValueError(f"Invalid agent port range {start}-{end}")
+        self.start = start
+        self.end = end
+        self._size = end - start + 1
+        self._bits = bytearray((self._size + 7) // 8)
+        self._free = self._size
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self.seeded = False
+
+    def _in_range(self, port: int) -> bool:
+        return self.start <= port <= self.end
+
+    def _is_set(self, i: int) -> bool:
+        return bool(self._bits[i >> 3] & (1 << (i & 7)))
+
+    def _set(self, i: int):
+        if not self._is_set(i):
+            self._bits[i >> 3] |= 1 << (i & 7)
+            self._free -= 1
+
+    def _clear(self, i: int):
+        if self._is_set(i):
+            self._bits[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+            self._free += 1
+
+    @property
+    def free_count(self) -> int:
+        return self._free
+
+    def seed(self, ports: Iterable[int]):
+        """Mark ports already assigned to agents as reserved."""
+        with self._lock:
+            for port in ports:
+                if port is not None and self._in_range(int(port)):
+                    self._set(int(port) - self.start)
+
+    def is_reserved(self, port: int) -> bool:
+        with self._lock:
+            return self._in_range(port) and self._is_set(port - self.start)
+
+    def reserve(self, port: int) -> bool:
+        """Reserve a specific port. Returns False if it was already reserved.
+        Ports outside the managed range are not tracked and always succeed."""
+        with self._lock:
+            if not self._in_range(port):
+                return True
+            i = port - self.start
+            if self._is_set(i):
+                return False
+            self._set(i)
+            return True
+
+    def release(self, port: Optional[int]):
+        if port is None:
+            return
+        with self._lock:
+            if self._in_range(int(port)):
+                self._clear(int(port) - self.start)
+
+    def _next_candidates(self, count: int, exclude: set, lo: int = 0, hi: Optional[int] = None) -> List[int]:
+        """Up to count free indexes in [lo, hi), scanning next-fit from the cursor."""
+        hi = self._size if hi is None else hi
+        candidates = []
+        scanned = 0
+        i = self._cursor if lo <= self._cursor < hi else lo
+        while scanned < hi - lo and len(candidates) < count:
+            byte = self._bits[i >> 3]
+            if byte == 0xFF and (i & 7) == 0:
+                # Whole byte reserved: skip 8 ports at once
+                step = min(8, hi - i)
+                i += step
+                scanned += step
+            else:
+                if not self._is_set(i) and (self.start + i) not in exclude:
+                    candidates.append(i)
+                i += 1
+                scanned += 1
+            if i >= hi:
+                i = lo
+        return candidates
+
+    def allocate(
+        self,
+        host: str = "localhost",
+        exclude: Optional[Iterable[int]] = None,
+        within: Optional[Tuple[int, int]] = None,
+    ) -> int:
+        """Reserve and return a free port that can currently be bound on host.
+
+        Candidates are taken next-fit from the bitmap and bind-tested in batches;
+        ports that fail the bind test are held by something outside the engine
+        for now; they are skipped but stay free, so a later allocation tests
+        them again. `within` limits
+        the search to a (start, end) sub-range, e.g. one worker's slice.
+        Raises RuntimeError when the range is exhausted.
+        """
+        exclude = set(exclude or ())
+        start, end = within or (self.start, self.end)
+        start, end = max(start, self.start), min(end, self.end)
+        lo, hi = start - self.start, end - self.start + 1
+        with self._lock:
+            while self._free > 0 and lo < hi:
+                candidates = self._next_candidates(BIND_TEST_BATCH, exclude, lo, hi)
+                if not candidates:
+                    break
+                for i in candidates:
+                    port = self.start + i
+                    if is_port_bindable(host, port):
+                        self._set(i)
+                        self._cursor = (i + 1) % self._size
+                        return port
+                    exclude.add(port)
+                    logger.debug(f"Port {port} is held outside the engine, skipping")
+        raise RuntimeError(f"No free agent port left in range {start}-{end}")
+
+
+_allocator: Optional[PortAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def configure_port_range(start: int, end: int):
+    """Restrict this process's allocator to start-end (e.g. one worker's slice of the range)."""
+    global _allocator, PORT_RANGE_START, PORT_RANGE_END
+    with _allocator_lock:
+        PORT_RANGE_START, PORT_RANGE_END = start, end
+        _allocator = None
+
+
+def get_port_allocator() -> PortAllocator:
+    """Return this process's allocator (unseeded until init_port_allocator has run)."""
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                allocator = PortAllocator(PORT_RANGE_START, PORT_RANGE_END)
+                allocator.seed(_shared_host_ports())
+                _allocator = allocator
+    return _allocator
+
+
+def _shared_host_ports() -> Iterable[int]:
+    """Ports of the shared agent host (one per sharding worker), which are never handed out to
+    agents, so no worker's slice hands out another worker's shared host port."""
+    from src.agent_host import SHARED_HOST_PORT
+    from src.sharding import AGENT_WORKERS
+    return range(SHARED_HOST_PORT, SHARED_HOST_PORT + max(1, AGENT_WORKERS))
+
+
+async def init_port_allocator() -> PortAllocator:
+    """Return the allocator, seeding it once from the ports stored in the DB."""
+    allocator = get_port_allocator()
+    if not allocator.seeded:
+        from db import get_agent_repository
+        rows = await get_agent_repository().list_agent_fields(["port"])
+        if not allocator.seeded:
+            allocator.seed(row.get("port") for row in rows)
+            allocator.seeded = True
+            logger.info(f"Port allocator seeded: {allocator.free_count} free ports in {allocator.start}-{allocator.end}")
+    return allocator
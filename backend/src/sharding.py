@@ -0,0 +1,375 @@
+"""
+Multi-process agent sharding.
+
+In supervisor mode (AGENT_WORKERS > 0) the engine process only runs the
+discovery API. Agent servers live in N worker processes; each agent is owned
+by the worker chosen by a consistent-hash ring over agent names, so adding an
+agent never moves the others. Workers get a disjoint slice of the agent port
+range, are restarted (with their agents) when they crash, and receive control
+operations (start, stop, status, set_env) over a pipe.
+"""
+import os
+import time
+import bisect
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from typing import Any, Dict, Iterable, List, Optional
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "0"))
+WORKER_CALL_TIMEOUT = float(os.getenv("AGENT_WORKER_CALL_TIMEOUT", "60"))
+WORKER_RESTART_DELAY = float(os.getenv("AGENT_WORKER_RESTART_DELAY", "1"))
+# Poll worker status every N supervision ticks
+WORKER_STATUS_EVERY = int(os.getenv("AGENT_WORKER_STATUS_EVERY", "5"))
+# True in the engine process when agents are sharded over workers (never inside a worker)
+SUPERVISOR_MODE = AGENT_WORKERS > 0 and multiprocessing.parent_process() is None
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], replicas: int = 128):
+        self._ring: List[tuple] = []
+        for node in nodes:
+            for i in range(replicas):
+                self._ring.append((self._hash(f"{node}#{i}"), node))
+        self._ring.sort()
+        self._keys = [h for h, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> str:
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[i][1]
+
+
+def _port_slice(worker_id: int, num_workers: int):
+    from src.port_allocator import PORT_RANGE_START, PORT_RANGE_END
+    size = (PORT_RANGE_END - PORT_RANGE_START + 1) // num_workers
+    start = PORT_RANGE_START + worker_id * size
+    end = PORT_RANGE_END if worker_id == num_workers - 1 else start + size - 1
+    return start, end
+
+
+# --- worker process side ---
+
+def _worker_main(worker_id: int, num_workers: int, conn):
+    # Module-level settings may already have been imported from the parent's environment,
+    # so configure this worker explicitly: a private slice of the port range and its own
+    # shared-host port.
+    from src.port_allocator import configure_port_range
+    configure_port_range(*_port_slice(worker_id, num_workers))
+    from src import agent_runtime
+    if agent_runtime.SHARED_HOST is not None:
+        agent_runtime.SHARED_HOST.port += worker_id
+    try:
+        asyncio.run(_worker_loop(worker_id, conn, agent_runtime))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(worker_id: int, conn, runtime):
+    from db import AgentConfigModel
+    from src.mcp_pool import MCP_POOL
+    from db import get_agent_repository
+    from src.port_allocator import get_port_allocator, init_port_allocator
+    from utils.key_manager import get_key_manager
+    from utils.push_dispatcher import get_push_dispatcher
+    loop = asyncio.get_running_loop()
+    closed = asyncio.Event()
+    send_lock = threading.Lock()
+    owned_ports: Dict[str, int] = {}  # agent_name -> port reserved in this worker's allocator
+
+    def _send(reply: Dict[str, Any]):
+        with send_lock:
+            conn.send(reply)
+
+    def _reader():
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                loop.call_soon_threadsafe(closed.set)
+                return
+            loop.call_soon_threadsafe(lambda m=msg: asyncio.create_task(_handle(m)))
+
+    async def _handle(msg: Dict[str, Any]):
+        reply = {"id": msg.get("id")}
+        try:
+            reply.update(await _dispatch(msg))
+            reply["ok"] = reply.get("ok", True)
+        except Exception as e:
+            reply.update(ok=False, error=str(e), error_type="RuntimeError" if isinstance(e, RuntimeError) else "Exception")
+        try:
+            # A full pipe blocks send, so keep it off the event loop
+            await loop.run_in_executor(None, _send, reply)
+        except (BrokenPipeError, OSError):
+            closed.set()
+
+    async def _claim_port(agent):
+        """Reserve the agent's port in this worker's slice. An agent whose port lies outside the
+        slice, or is taken by another agent of this worker, is moved to a free port of the slice."""
+        allocator = await init_port_allocator()
+        port = agent.port
+        taken = any(p == port for name, p in owned_ports.items() if name != agent.agent_name)
+        in_slice = allocator.start <= port <= allocator.end
+        # reserve() is False for a port seeded from the DB, which is this agent's own unless taken
+        if in_slice and (allocator.reserve(port) or not taken):
+            owned_ports[agent.agent_name] = port
+            return
+        agent.port = allocator.allocate(agent.host)
+        await get_agent_repository().update_agent_port(agent.agent_name, agent.port)
+        owned_ports[agent.agent_name] = agent.port
+        logger.info(f"[Worker {worker_id}] Moved agent {agent.agent_name} from port {port} to {agent.port}")
+
+    def _release_port(agent_name: str):
+        port = owned_ports.pop(agent_name, None)
+        if port is not None and port not in owned_ports.values():
+            get_port_allocator().release(port)
+
+    async def _dispatch(msg: Dict[str, Any]) -> Dict[str, Any]:
+        op = msg["op"]
+        if op == "start":
+            agent = AgentConfigModel(**msg["agent"])
+            if runtime.SHARED_HOST is None:
+                await _claim_port(agent)
+            await runtime.start_agent_servers([agent])
+            started = agent.agent_name in runtime.AGENT_SERVER_TASKS
+            if not started:
+                _release_port(agent.agent_name)
+            elif runtime.SHARED_HOST is None:
+                # start_agent_server moves the agent (and its reservation) if the port was busy
+                owned_ports[agent.agent_name] = agent.port
+            return {"ok": started, "port": agent.port, "url": runtime.agent_url(agent),
+                    "error": None if started else f"No free port for agent {agent.agent_name}"}
+        if op == "stop":
+            await runtime.stop_agent_server(msg["agent_name"])
+            _release_port(msg["agent_name"])
+            await get_key_manager().forget(msg["agent_name"])
+            return {}
+        if op == "status":
+            return {"agents": {
+                name: {"running": not entry["task"].done(), "readiness": entry["server"].readiness}
+                for name, entry in runtime.AGENT_SERVER_TASKS.items()
+            }}
+        if op == "metrics":
+            return {"metrics": {"worker_id": worker_id, **runtime.get_metrics()}}
+        if op == "set_env":
+            runtime.set_llm_env_vars_from_config(msg["config"])
+            return {}
+        raise ValueError(f"Unknown worker op: {op}")
+
+    threading.Thread(target=_reader, daemon=True).start()
+    get_key_manager().start()
+    logger.info(f"[Worker {worker_id}] started (pid {os.getpid()})")
+    await closed.wait()
+    await get_key_manager().stop()
+    await get_push_dispatcher().stop()
+    for entry in list(runtime.AGENT_SERVER_TASKS.values()):
+        entry["task"].cancel()
+    await runtime.close_task_stores()
+    await MCP_POOL.close()
+
+
+# --- supervisor side ---
+
+class _WorkerHandle:
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.agents: Dict[str, dict] = {}   # agent_name -> agent config owned by this worker
+        self.state: Dict[str, dict] = {}    # agent_name -> {"port", "url", "running"}
+        self.started_at: Optional[float] = None
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+
+class AgentWorkerPool:
+    def __init__(self, num_workers: int = AGENT_WORKERS):
+        self.num_workers = num_workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = {f"worker-{i}": _WorkerHandle(i) for i in range(num_workers)}
+        self._ring = HashRing(self._workers.keys())
+        self._next_id = 0
+        self._monitor: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    def _owner(self, agent_name: str) -> _WorkerHandle:
+        return self._workers[self._ring.owner(agent_name)]
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for handle in self._workers.values():
+            self._spawn(handle)
+        self._monitor = asyncio.create_task(self._supervise())
+
+    def _spawn(self, handle: _WorkerHandle):
+        if handle.conn is not None:
+            handle.conn.close()
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main, args=(handle.worker_id, self.num_workers, child_conn),
+            name=f"agentweave-worker-{handle.worker_id}", daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        handle.process, handle.conn, handle.started_at = process, parent_conn, time.time()
+        threading.Thread(target=self._reader, args=(handle, parent_conn), daemon=True).start()
+        logger.info(f"[WorkerPool] Spawned worker {handle.worker_id} (pid {process.pid})")
+
+    def _reader(self, handle: _WorkerHandle, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                return
+            self._loop.call_soon_threadsafe(self._resolve, handle, msg)
+
+    @staticmethod
+    def _resolve(handle: _WorkerHandle, msg: dict):
+        future = handle.pending.pop(msg.get("id"), None)
+        if future is not None and not future.done():
+            future.set_result(msg)
+
+    @staticmethod
+    def _send(handle: _WorkerHandle, conn, msg: dict):
+        with handle.send_lock:
+            conn.send(msg)
+
+    async def _call(self, handle: _WorkerHandle, op: str, timeout: float = WORKER_CALL_TIMEOUT, **kwargs) -> dict:
+        self._next_id += 1
+        msg_id = self._next_id
+        future = self._loop.create_future()
+        handle.pending[msg_id] = future
+        try:
+            # A worker that stops reading fills the pipe and blocks send, so keep it off the event loop
+            await self._loop.run_in_executor(None, self._send, handle, handle.conn, {"id": msg_id, "op": op, **kwargs})
+            return await asyncio.wait_for(future, timeout)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"Worker {handle.worker_id} is not reachable: {e}")
+        finally:
+            handle.pending.pop(msg_id, None)
+
+    async def _supervise(self):
+        tick = 0
+        while not self._stopping:
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            tick += 1
+            if tick % WORKER_STATUS_EVERY == 0:
+                # Reconcile the supervisor's view with what each worker actually serves
+                asyncio.create_task(self.collect_status())
+            for handle in self._workers.values():
+                if handle.alive or self._stopping:
+                    continue
+                logger.error(f"[WorkerPool] Worker {handle.worker_id} died (exit code {handle.process.exitcode}), restarting")
+                for future in handle.pending.values():
+                    if not future.done():
+                        future.set_exception(RuntimeError(f"Worker {handle.worker_id} crashed"))
+                handle.pending.clear()
+                handle.state.clear()
+                handle.restarts += 1
+                self._spawn(handle)
+                agents = list(handle.agents.values())
+                if agents:
+                    asyncio.create_task(self._restart_agents(handle, agents))
+
+    async def _restart_agents(self, handle: _WorkerHandle, agents: List[dict]):
+        results = await asyncio.gather(*(self._start_on(handle, agent) for agent in agents), return_exceptions=True)
+        failed = [a["agent_name"] for a, r in zip(agents, results) if isinstance(r, BaseException)]
+        if failed:
+            logger.error(f"[WorkerPool] Could not restart agents on worker {handle.worker_id}: {failed}")
+
+    async def _start_on(self, handle: _WorkerHandle, agent: dict) -> dict:
+        handle.agents[agent["agent_name"]] = agent
+        reply = await self._call(handle, "start", agent=agent)
+        if not reply.get("ok"):
+            handle.state.pop(agent["agent_name"], None)
+            error = reply.get("error") or "Agent failed to start"
+            raise RuntimeError(error) if reply.get("error_type") == "RuntimeError" else Exception(error)
+        agent["port"] = reply["port"]
+        handle.state[agent["agent_name"]] = {"port": reply["port"], "url": reply["url"], "running": True}
+        return reply
+
+    async def start_agent(self, agent) -> dict:
+        """Start the agent on its owning worker. Updates agent.port with the port the worker bound."""
+        reply = await self._start_on(self._owner(agent.agent_name), agent.dict())
+        if reply["port"] != agent.port:
+            # The worker moved the agent; keep the engine's allocator in step
+            from src.port_allocator import get_port_allocator
+            allocator = get_port_allocator()
+            allocator.release(agent.port)
+            allocator.reserve(reply["port"])
+            agent.port = reply["port"]
+        return reply
+
+    async def stop_agent(self, agent_name: str):
+        handle = self._owner(agent_name)
+        handle.agents.pop(agent_name, None)
+        handle.state.pop(agent_name, None)
+        if handle.alive:
+            await self._call(handle, "stop", agent_name=agent_name)
+
+    async def broadcast(self, op: str, **kwargs) -> List[Any]:
+        handles = [h for h in self._workers.values() if h.alive]
+        return await self._broadcast_to(handles, op, **kwargs)
+
+    async def _broadcast_to(self, handles: List[_WorkerHandle], op: str, **kwargs) -> List[Any]:
+        return await asyncio.gather(*(self._call(h, op, **kwargs) for h in handles), return_exceptions=True)
+
+    async def collect_status(self) -> Dict[str, dict]:
+        """Ask every worker which agents it is serving and merge the answers."""
+        merged: Dict[str, dict] = {}
+        handles = [h for h in self._workers.values() if h.alive]
+        for handle, reply in zip(handles, await self._broadcast_to(handles, "status")):
+            if isinstance(reply, BaseException):
+                continue
+            served = reply.get("agents", {})
+            for name, state in handle.state.items():
+                state["running"] = served.get(name, {}).get("running", False)
+                state["readiness"] = served.get(name, {}).get("readiness")
+            for name in served:
+                merged[name] = {**handle.state.get(name, served[name]), **self.describe(name)}
+        return merged
+
+    def port_range(self, agent_name: str):
+        """The slice of the agent port range owned by the agent's worker (start, end)."""
+        return _port_slice(self._owner(agent_name).worker_id, self.num_workers)
+
+    def agent_url(self, agent_name: str) -> Optional[str]:
+        return self._owner(agent_name).state.get(agent_name, {}).get("url")
+
+    def is_running(self, agent_name: str) -> bool:
+        handle = self._owner(agent_name)
+        return handle.alive and handle.state.get(agent_name, {}).get("running", False)
+
+    def readiness(self, agent_name: str) -> Optional[str]:
+        return self._owner(agent_name).state.get(agent_name, {}).get("readiness")
+
+    def describe(self, agent_name: str) -> dict:
+        handle = self._owner(agent_name)
+        return {
+            "worker_id": handle.worker_id,
+            "worker_pid": handle.process.pid if handle.process else None,
+            "worker_alive": handle.alive,
+            "worker_restarts": handle.restarts,
+        }
+
+    def stop(self):
+        self._stopping = True
+        if self._monitor:
+            self._monitor.cancel()
+        for handle in self._workers.values():
+            if handle.conn is not None:
+                handle.conn.close()
+            if handle.alive:
+                handle.process.terminate()
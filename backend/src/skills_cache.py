@@ -0,0 +1,92 @@
+"""
+Cache for MCP skill discovery.
+
+Skills are keyed by (mcp_address, transport) and stored in the shared
+utils.in_memory_cache.InMemoryCache with a TTL. Failed lookups are cached too
+(negative caching, with a shorter TTL) so an unreachable MCP server is not
+re-dialled by every status check. Concurrent misses for the same key share a
+single in-flight fetch.
+"""
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from utils.in_memory_cache import InMemoryCache
+from utils.types import AgentSkill
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SKILLS_CACHE_TTL = int(os.getenv("MCP_SKILLS_CACHE_TTL", "60"))
+SKILLS_NEGATIVE_TTL = int(os.getenv("MCP_SKILLS_NEGATIVE_TTL", "10"))
+
+_KEY_PREFIX = "mcp_skills"
+
+
+class SkillsCache:
+    def __init__(self, ttl: int = SKILLS_CACHE_TTL, negative_ttl: int = SKILLS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache = InMemoryCache()
+        self._keys: Set[Tuple[str, str]] = set()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def _key(mcp_address: str, transport: str) -> str:
+        return f"{_KEY_PREFIX}:{transport}:{mcp_address.rstrip('/')}"
+
+    async def get(
+        self,
+        mcp_address: str,
+        transport: str,
+        loader: Callable[[], Awaitable[List[AgentSkill]]],
+    ) -> List[AgentSkill]:
+        """Return cached skills, or run `loader` once for all concurrent callers.
+
+        Raises RuntimeError if the (possibly cached) lookup failed.
+        """
+        key = self._key(mcp_address, transport)
+        entry = self._cache.get(key)
+        if entry is not None:
+            ok, value = entry
+            if not ok:
+                raise RuntimeError(value)
+            return list(value)
+        task = self._inflight.get(key)
+        if task is None:
+            self._keys.add((mcp_address.rstrip("/"), transport))
+            task = asyncio.create_task(self._load(key, loader))
+            self._inflight[key] = task
+        return list(await asyncio.shield(task))
+
+    async def _load(self, key: str, loader) -> List[AgentSkill]:
+        try:
+            skills = await loader()
+        except Exception as e:
+            logger.warning(f"Caching MCP skill lookup failure for {key} ({self.negative_ttl}s): {e}")
+            self._cache.set(key, (False, str(e)), ttl=self.negative_ttl)
+            raise
+        else:
+            self._cache.set(key, (True, skills), ttl=self.ttl)
+            return skills
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, mcp_address: Optional[str] = None, transport: Optional[str] = None) -> int:
+        """Drop cached entries. With no arguments every skills entry is dropped;
+        with only mcp_address, entries for all transports of that address.
+
+        Returns the number of entries removed.
+        """
+        address = mcp_address.rstrip("/") if mcp_address else None
+        removed = 0
+        for key_address, key_transport in list(self._keys):
+            if address is not None and key_address != address:
+                continue
+            if transport is not None and key_transport != transport:
+                continue
+            if self._cache.delete(self._key(key_address, key_transport)):
+                removed += 1
+            self._keys.discard((key_address, key_transport))
+        return removed
+
+
+SKILLS_CACHE = SkillsCache()
@@ -0,0 +1,171 @@
+"""
+Pre-encoded SSE frames for task streaming.
+
+An event is serialized once when it is enqueued, into the bytes of a complete
+`data:` frame minus the JSON-RPC envelope's id. Each subscriber encodes its
+request id once and prepends it, so fanning an event out to N viewers costs
+one model_dump_json instead of N. EventSourceResponse writes bytes as-is.
+
+Frames are numbered per task and carry an SSE `id:` field. TaskEventLog keeps
+the most recent frames of a task so a client reconnecting with Last-Event-ID
+gets only the events it missed.
+
+Each subscriber reads from a bounded SubscriberQueue. When a consumer falls
+behind and its queue is full, SSE_OVERFLOW_POLICY decides what gives:
+"drop" discards the oldest intermediate status update, "coalesce" replaces a
+queued WORKING status with the newer one (falling back to drop), and
+"disconnect" ends the consumer's stream so it can resume via Last-Event-ID.
+Final events are never dropped; a consumer with nothing left to drop is
+disconnected.
+"""
+import os
+import json
+import asyncio
+from collections import deque
+from itertools import islice
+from typing import List, Optional, Union
+
+from utils.types import JSONRPCError, TaskArtifactUpdateEvent, TaskStatusUpdateEvent, TaskState
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+SSE_SEPARATOR = b"\r\n\r\n"
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+SSE_OVERFLOW_POLICY = os.getenv("SSE_OVERFLOW_POLICY", "coalesce")  # drop, coalesce or disconnect
+OVERFLOW_POLICIES = ("drop", "coalesce", "disconnect")
+
+
+def frame_prefix(request_id: Union[int, str, None]) -> bytes:
+    """Start of every frame sent to the subscriber of request_id (matches exclude_none dumps)."""
+    if request_id is None:
+        return b'data: {"jsonrpc":"2.0"'
+    return b'data: {"jsonrpc":"2.0","id":' + json.dumps(request_id).encode()
+
+
+class SSEFrame:
+    __slots__ = ("event", "seq", "final", "_id_line", "_tail")
+
+    def __init__(self, event: Union[TaskStatusUpdateEvent, TaskArtifactUpdateEvent, JSONRPCError], seq: int):
+        self.event = event
+        self.seq = seq
+        self._id_line = b"id: %d\r\n" % seq
+        is_error = isinstance(event, JSONRPCError)
+        # An error or a final status update ends the stream
+        self.final = is_error or (isinstance(event, TaskStatusUpdateEvent) and event.final)
+        key = b"error" if is_error else b"result"
+        body = event.model_dump_json(exclude_none=True).encode()
+        self._tail = b',"' + key + b'":' + body + b"}" + SSE_SEPARATOR
+
+    def encode(self, prefix: bytes) -> bytes:
+        return self._id_line + prefix + self._tail
+
+    @property
+    def intermediate(self) -> bool:
+        """A non-final status update, which a newer one supersedes."""
+        return isinstance(self.event, TaskStatusUpdateEvent) and not self.final
+
+    @property
+    def working(self) -> bool:
+        return self.intermediate and self.event.status.state == TaskState.WORKING
+
+
+class SubscriberQueue:
+    """Bounded frame queue of one SSE subscriber; put never blocks the producer."""
+
+    def __init__(self, maxsize: int = SSE_QUEUE_SIZE, policy: str = SSE_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown SSE_OVERFLOW_POLICY {policy!r}, using coalesce")
+            policy = "coalesce"
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self._frames: "deque[SSEFrame]" = deque()
+        self._ready = asyncio.Event()
+        self.disconnected = False
+        self.last_put_seq = 0
+        self.last_sent_seq = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def put(self, frame: SSEFrame) -> bool:
+        """Queue a frame, applying the overflow policy. Returns False once disconnected."""
+        if self.disconnected:
+            return False
+        self.last_put_seq = frame.seq
+        if len(self._frames) >= self.maxsize and not frame.final and not self._make_room(frame):
+            return not self.disconnected
+        self._frames.append(frame)
+        self._ready.set()
+        return True
+
+    def _make_room(self, frame: SSEFrame) -> bool:
+        """Free a slot for frame; False if frame itself was dropped or the consumer disconnected."""
+        if self.policy == "coalesce" and frame.working:
+            for queued in reversed(self._frames):
+                if queued.working:
+                    self._frames.remove(queued)
+                    self.coalesced += 1
+                    return True
+        if self.policy in ("drop", "coalesce"):
+            for queued in self._frames:
+                if queued.intermediate:
+                    self._frames.remove(queued)
+                    self.dropped += 1
+                    return True
+            if frame.intermediate:
+                self.dropped += 1
+                return False
+        # Nothing that may be dropped (or policy is disconnect)
+        self.disconnect()
+        return False
+
+    def disconnect(self):
+        self.disconnected = True
+        self._frames.clear()
+        self._ready.set()
+
+    async def get(self) -> Optional[SSEFrame]:
+        """Next frame, or None once the subscriber was disconnected."""
+        while not self._frames:
+            if self.disconnected:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        frame = self._frames.popleft()
+        self.last_sent_seq = frame.seq
+        return frame
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._frames),
+            # Events produced that this subscriber hasn't been sent yet (including dropped ones)
+            "lag": self.last_put_seq - self.last_sent_seq,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "disconnected": self.disconnected,
+        }
+
+
+class TaskEventLog:
+    """Append-only log of a task's most recent frames, numbered from 1."""
+
+    def __init__(self, max_events: int):
+        self.frames: "deque[SSEFrame]" = deque(maxlen=max(1, max_events))
+        self.last_seq = 0
+        # Drops the log some time after the task's stream ended (set by the task manager)
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+    def append(self, event) -> SSEFrame:
+        self.last_seq += 1
+        frame = SSEFrame(event, self.last_seq)
+        self.frames.append(frame)
+        return frame
+
+    def since(self, seq: int) -> List[SSEFrame]:
+        """Frames after seq that are still retained (older ones may have been dropped)."""
+        if not self.frames or seq >= self.last_seq:
+            return []
+        start = max(0, seq - self.frames[0].seq + 1)
+        return list(islice(self.frames, start, None))
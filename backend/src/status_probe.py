@@ -0,0 +1,134 @@
+"""
+Concurrent status probing for agent servers.
+
+Each probe opens a non-blocking asyncio connection to the agent's host/port and,
+if the agent is reachable, checks MCP tool connectivity through fetch_skills.
+A sweep runs all probes concurrently under a semaphore, with a time budget per
+probe and for the whole sweep; agents whose probe did not finish in time are
+reported with status "timeout" so callers always get a result for every agent.
+"""
+import os
+import errno
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, Optional
+from db import AgentConfigModel
+from src.helpers import fetch_skills
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+PROBE_CONCURRENCY = int(os.getenv("AGENT_PROBE_CONCURRENCY", "32"))
+PROBE_CONNECT_TIMEOUT = float(os.getenv("AGENT_PROBE_CONNECT_TIMEOUT", "0.5"))
+PROBE_TIMEOUT = float(os.getenv("AGENT_PROBE_TIMEOUT", "5"))
+SWEEP_TIMEOUT = float(os.getenv("AGENT_PROBE_SWEEP_TIMEOUT", "10"))
+
+
+def _oserror_status(e: OSError):
+    if e.errno == errno.ECONNREFUSED:
+        return "connection refused", None
+    elif e.errno == errno.EHOSTUNREACH:
+        return "host unreachable", None
+    elif e.errno == errno.ENETUNREACH:
+        return "network unreachable", None
+    return f"oserror ({e.errno})", str(e)
+
+
+async def probe_agent_socket(host: str, port: int, timeout: float = PROBE_CONNECT_TIMEOUT):
+    """Open (and immediately close) a TCP connection to the agent server.
+
+    Returns (status, error_detail) using the same status vocabulary as the
+    /api/agent-servers endpoint.
+    """
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), timeout)
+    except asyncio.TimeoutError:
+        return "timeout", None
+    except ConnectionRefusedError:
+        return "connection refused", None
+    except OSError as e:
+        return _oserror_status(e)
+    except Exception as e:
+        return "error", str(e)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return "running", None
+
+
+async def probe_agent(
+    agent: AgentConfigModel,
+    connect_timeout: float = PROBE_CONNECT_TIMEOUT,
+    is_serving: Optional[Callable[[AgentConfigModel], bool]] = None,
+) -> Dict:
+    """Probe a single agent: socket connectivity first, then MCP tool connectivity.
+
+    `is_serving` lets callers veto a reachable socket, e.g. when several agents share
+    one server and the agent itself is not mounted on it.
+    """
+    status, error_detail = await probe_agent_socket(agent.host, agent.port, connect_timeout)
+    if status == "running" and is_serving is not None and not is_serving(agent):
+        status = "not connected"
+    if status == "running":
+        try:
+            await fetch_skills(agent)
+        except Exception as mcp_exc:
+            status = "mcp error"
+            error_detail = f"MCP fetch_skills failed: {str(mcp_exc)}"
+    return {"status": status, "error_detail": error_detail, "checked_at": int(time.time())}
+
+
+async def probe_agents(
+    agents: Iterable[AgentConfigModel],
+    concurrency: int = PROBE_CONCURRENCY,
+    probe_timeout: float = PROBE_TIMEOUT,
+    sweep_timeout: Optional[float] = SWEEP_TIMEOUT,
+    is_serving: Optional[Callable[[AgentConfigModel], bool]] = None,
+) -> Dict[str, Dict]:
+    """Probe all agents concurrently.
+
+    At most `concurrency` probes run at once, each probe is bounded by
+    `probe_timeout` and the whole sweep by `sweep_timeout`. Probes still
+    running when the sweep budget runs out are cancelled and reported as
+    "timeout", so the result always has an entry for every agent.
+
+    Returns a dict keyed by agent_name.
+    """
+    agents = list(agents)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _bounded_probe(agent):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(probe_agent(agent, is_serving=is_serving), probe_timeout)
+            except asyncio.TimeoutError:
+                return {
+                    "status": "timeout",
+                    "error_detail": f"Probe exceeded {probe_timeout}s",
+                    "checked_at": int(time.time()),
+                }
+
+    tasks = {asyncio.create_task(_bounded_probe(agent)): agent for agent in agents}
+    results: Dict[str, Dict] = {}
+    if not tasks:
+        return results
+    done, pending = await asyncio.wait(tasks.keys(), timeout=sweep_timeout)
+    for task in done:
+        agent = tasks[task]
+        try:
+            results[agent.agent_name] = task.result()
+        except Exception as e:
+            results[agent.agent_name] = {"status": "error", "error_detail": str(e), "checked_at": int(time.time())}
+    for task in pending:
+        task.cancel()
+        agent = tasks[task]
+        results[agent.agent_name] = {
+            "status": "timeout",
+            "error_detail": f"Status sweep exceeded {sweep_timeout}s",
+            "checked_at": int(time.time()),
+        }
+    if pending:
+        logger.warning(f"Status sweep budget exhausted: {len(pending)}/{len(tasks)} probes unfinished")
+        await asyncio.gather(*pending, return_exceptions=True)
+    return results
@@ -26,10 +26,14 @@ from utils.types import (
     TaskPushNotificationConfig,
     TaskNotFoundError,
     InvalidParamsError,
+    AgentBusyError,
 )
 from src.base_task_manager import InMemoryTaskManager
+from src.task_store import TaskStore
+from src.admission import AdmissionController, AgentBusy, Ticket, AGENT_MAX_CONCURRENT_TASKS
 from backend.src.agent import Agent, SUPPORTED_CONTENT_TYPES
 from utils.push_notification_auth import PushNotificationSenderAuth
+from utils.push_coalescer import PushNotificationCoalescer
 import src.helpers as helpers
 from typing import Union
 import asyncio
@@ -37,30 +41,154 @@ import logging
 import traceback
 from utils.logger import get_logger
 
+# Token deltas are sent in batches: whichever comes first of this many seconds or characters
+STREAM_TOKEN_FLUSH_INTERVAL = float(os.getenv("STREAM_TOKEN_FLUSH_INTERVAL", "0.05"))
+STREAM_TOKEN_FLUSH_CHARS = int(os.getenv("STREAM_TOKEN_FLUSH_CHARS", "256"))
+
+
+class _ArtifactStreamer:
+    """Streams an answer as appended chunks of artifact 0, batching token deltas."""
+
+    def __init__(self, task_manager: "AgentTaskManager", task_id: str):
+        self.task_manager = task_manager
+        self.task_id = task_id
+        self.sent = ""
+        self._buffer: list[str] = []
+        self._buffered = 0
+        # Flushes a partial batch once it is STREAM_TOKEN_FLUSH_INTERVAL old, even if no token follows
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    async def add(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= STREAM_TOKEN_FLUSH_CHARS:
+            await self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(STREAM_TOKEN_FLUSH_INTERVAL, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        self._cancel_timer()
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        await self._send(text, append=bool(self.sent), last_chunk=False)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def reset(self):
+        """Text so far wasn't the answer (the model went on to call tools): the next chunk replaces it."""
+        self.sent = ""
+        self.close()
+
+    def close(self):
+        """Drop what is buffered and stop the flush timer."""
+        self._cancel_timer()
+        self._buffer, self._buffered = [], 0
+
+    async def finish(self, content: str) -> bool:
+        """Send the rest of the final answer as the last chunk. False if nothing was streamed."""
+        if not self.sent and not self._buffer:
+            return False
+        self.close()
+        if content.startswith(self.sent):
+            await self._send(content[len(self.sent):], append=bool(self.sent), last_chunk=True)
+        else:
+            await self._send(content, append=False, last_chunk=True)
+        return True
+
+    async def _send(self, text: str, append: bool, last_chunk: bool):
+        self.sent = self.sent + text if append else text
+        artifact = Artifact(parts=[{"type": "text", "text": text}], index=0, append=append, lastChunk=last_chunk)
+        await self.task_manager.enqueue_events_for_sse(
+            self.task_id, TaskArtifactUpdateEvent(id=self.task_id, artifact=artifact)
+        )
+
+
 class AgentTaskManager(InMemoryTaskManager):
-    def __init__(self, agent: Agent, notification_sender_auth: PushNotificationSenderAuth):
-        super().__init__()
+    def __init__(
+        self,
+        agent: Agent,
+        notification_sender_auth: PushNotificationSenderAuth,
+        task_store: TaskStore | None = None,
+        history_max_length: int | None = None,
+        max_concurrent_tasks: int | None = None,
+    ):
+        super().__init__(task_store, history_max_length)
         self.logger = get_logger(__name__)
         self.agent = agent
         self.notification_sender_auth = notification_sender_auth
+        # Holds back intermediate updates per task (PUSH_COALESCE_WINDOW) and serializes on send
+        self.push_coalescer = PushNotificationCoalescer(notification_sender_auth.enqueue_push_notification)
+        # Limits how many tasks run the agent at once; the rest wait in a bounded queue
+        self.admission = AdmissionController(
+            AGENT_MAX_CONCURRENT_TASKS if max_concurrent_tasks is None else max_concurrent_tasks
+        )
         self.logger.debug("AgentTaskManager initialized")
 
-    async def _run_streaming_agent(self, request: SendTaskStreamingRequest):
+    def _run_admitted(self, task_id: str, coro, ticket: Ticket) -> asyncio.Task:
+        """run_task, giving the admission ticket back however the work ends."""
+        running = self.run_task(task_id, coro)
+        running.add_done_callback(lambda _: self.admission.leave(ticket))
+        return running
+
+    @staticmethod
+    def _busy_error(e: AgentBusy) -> AgentBusyError:
+        return AgentBusyError(message=f"Agent is busy: {e}", data={"retryAfter": e.retry_after})
+
+    async def _report_queue_position(self, task_id: str, position: int):
+        event = TaskStatusUpdateEvent(
+            id=task_id, status=TaskStatus(state=TaskState.SUBMITTED), metadata={"queuePosition": position}
+        )
+        await self.enqueue_events_for_sse(task_id, event)
+
+    async def _fail_not_admitted(self, task_id: str, e: AgentBusy) -> Task:
+        """Mark a task that gave up waiting for an admission slot as FAILED."""
+        message = Message(role="agent", parts=[{"type": "text", "text": f"Agent is busy: {e}"}])
+        task = await self.update_store(task_id, TaskStatus(state=TaskState.FAILED, message=message), None)
+        await self.send_task_notification(task)
+        return task
+
+    async def _run_streaming_agent(self, request: SendTaskStreamingRequest, ticket: Ticket):
         task_send_params: TaskSendParams = request.params
+        try:
+            await self.admission.wait(
+                ticket, lambda position: self._report_queue_position(task_send_params.id, position)
+            )
+        except AgentBusy as e:
+            self.logger.warning(f"Task {task_send_params.id} not started: {e}")
+            await self._fail_not_admitted(task_send_params.id, e)
+            await self.enqueue_events_for_sse(task_send_params.id, self._busy_error(e))
+            return
         query = self._get_user_query(task_send_params)
+        streamer = _ArtifactStreamer(self, task_send_params.id)
 
         try:
             async for item in self.agent.astream(query, task_send_params.sessionId):
+                if item.get("token"):
+                    # Only sent to SSE subscribers; the store and push notifications get the full answer
+                    await streamer.add(item["content"])
+                    continue
                 is_task_complete = item["is_task_complete"]
                 require_user_input = item["require_user_input"]
                 artifact = None
                 message = None
                 parts = [{"type": "text", "text": item["content"]}]
                 end_stream = False
+                streamed = False
 
                 if not is_task_complete and not require_user_input:
                     task_state = TaskState.WORKING
                     message = Message(role="agent", parts=parts)
+                    streamer.reset()
                 elif require_user_input:
                     task_state = TaskState.INPUT_REQUIRED
                     message = Message(role="agent", parts=parts)
@@ -69,6 +197,7 @@ class AgentTaskManager(InMemoryTaskManager):
                     task_state = TaskState.COMPLETED
                     artifact = Artifact(parts=parts, index=0, append=False)
                     end_stream = True
+                    streamed = await streamer.finish(item["content"])
 
                 task_status = TaskStatus(state=task_state, message=message)
                 latest_task = await self.update_store(
@@ -78,7 +207,7 @@ class AgentTaskManager(InMemoryTaskManager):
                 )
                 await self.send_task_notification(latest_task)
 
-                if artifact:
+                if artifact and not streamed:
                     task_artifact_update_event = TaskArtifactUpdateEvent(
                         id=task_send_params.id, artifact=artifact
                     )
@@ -100,6 +229,8 @@ class AgentTaskManager(InMemoryTaskManager):
                 task_send_params.id,
                 InternalError(message=f"An error occurred while streaming the response: {e}")                
             )
+        finally:
+            streamer.close()
 
     def _validate_request(
         self, request: Union[SendTaskRequest, SendTaskStreamingRequest]
@@ -134,50 +265,100 @@ class AgentTaskManager(InMemoryTaskManager):
                 self.logger.error("Invalid push notification URL")
                 return SendTaskResponse(id=request.id, error=InvalidParamsError(message="Push notification URL is invalid"))
 
-        self.logger.debug(f"Upserting task {request.params.id}")
-        await self.upsert_task(request.params)
+        try:
+            ticket = self.admission.enter()
+        except AgentBusy as e:
+            self.logger.warning(f"Rejecting task {request.params.id}: {e}")
+            return SendTaskResponse(id=request.id, error=self._busy_error(e))
+
+        task_send_params: TaskSendParams = request.params
+        # Kept out of store eviction until the response is recorded, after the agent run ended
+        self.tasks.pin(task_send_params.id)
+        try:
+            self.logger.debug(f"Upserting task {request.params.id}")
+            await self.upsert_task(request.params)
+            # Registered so tasks/cancel can interrupt it, also while it is queued
+            agent_run = self._run_admitted(task_send_params.id, self._invoke_agent(task_send_params, ticket), ticket)
+        except BaseException:
+            self.admission.leave(ticket)
+            self.tasks.unpin(task_send_params.id)
+            raise
+        try:
+            try:
+                await asyncio.wait([agent_run])
+            except asyncio.CancelledError:
+                agent_run.cancel()
+                raise
+            if agent_run.cancelled():
+                # tasks/cancel may still be waiting to record the state; the response must carry it
+                task = await self.mark_canceled(task_send_params.id) or await self.tasks.get(task_send_params.id)
+                return SendTaskResponse(id=request.id, result=self.append_task_history(task, task_send_params.historyLength))
+            try:
+                agent_response = agent_run.result()
+                self.logger.info(f"Agent response received for task {request.params.id}")
+            except AgentBusy as e:
+                self.logger.warning(f"Task {request.params.id} not started: {e}")
+                return SendTaskResponse(id=request.id, error=self._busy_error(e))
+            except Exception as e:
+                self.logger.error(f"Error invoking agent: {e}")
+                raise ValueError(f"Error invoking agent: {e}")
+            return await self._process_agent_response(
+                request, agent_response
+            )
+        finally:
+            self.tasks.unpin(task_send_params.id)
+
+    async def _invoke_agent(self, task_send_params: TaskSendParams, ticket: Ticket) -> dict:
+        try:
+            await self.admission.wait(ticket)
+        except AgentBusy as e:
+            await self._fail_not_admitted(task_send_params.id, e)
+            raise
         task = await self.update_store(
-            request.params.id, TaskStatus(state=TaskState.WORKING), None
+            task_send_params.id, TaskStatus(state=TaskState.WORKING), None
         )
-        self.logger.info(f"Task {request.params.id} updated to WORKING state")
+        self.logger.info(f"Task {task_send_params.id} updated to WORKING state")
         await self.send_task_notification(task)
 
-        task_send_params: TaskSendParams = request.params
         query = self._get_user_query(task_send_params)
         self.logger.info(f"Invoking agent with query: {query}")
-        try:
-            agent_response = await self.agent.ainvoke(query, task_send_params.sessionId)
-            self.logger.info(f"Agent response received for task {request.params.id}")
-        except Exception as e:
-            self.logger.error(f"Error invoking agent: {e}")
-            raise ValueError(f"Error invoking agent: {e}")
-        return await self._process_agent_response(
-            request, agent_response
-        )
+        return await self.agent.ainvoke(query, task_send_params.sessionId)
 
     async def on_send_task_subscribe(
         self, request: SendTaskStreamingRequest
     ) -> AsyncIterable[SendTaskStreamingResponse] | JSONRPCResponse:
+        ticket = None
         try:
             error = self._validate_request(request)
             if error:
                 return error
 
+            try:
+                ticket = self.admission.enter()
+            except AgentBusy as e:
+                self.logger.warning(f"Rejecting task {request.params.id}: {e}")
+                return JSONRPCResponse(id=request.id, error=self._busy_error(e))
+
             await self.upsert_task(request.params)
 
             if request.params.pushNotification:
                 if not await self.set_push_notification_info(request.params.id, request.params.pushNotification):
+                    self.admission.leave(ticket)
                     return JSONRPCResponse(id=request.id, error=InvalidParamsError(message="Push notification URL is invalid"))
 
             task_send_params: TaskSendParams = request.params
             sse_event_queue = await self.setup_sse_consumer(task_send_params.id, False)            
 
-            asyncio.create_task(self._run_streaming_agent(request))
+            # Waits for an admission slot (reporting SUBMITTED with queuePosition), then runs the agent
+            self._run_admitted(task_send_params.id, self._run_streaming_agent(request, ticket), ticket)
+            ticket = None
 
             return self.dequeue_events_for_sse(
                 request.id, task_send_params.id, sse_event_queue
             )
         except Exception as e:
+            if ticket is not None:
+                self.admission.leave(ticket)
             self.logger.error(f"Error in SSE stream: {e}")
             print(traceback.format_exc())
             return JSONRPCResponse(
@@ -226,17 +407,15 @@ class AgentTaskManager(InMemoryTaskManager):
         push_info = await self.get_push_notification_info(task.id)
 
         self.logger.info(f"Notifying for task {task.id} => {task.status.state}")
-        await self.notification_sender_auth.send_push_notification(
-            push_info.url,
-            data=task.model_dump(exclude_none=True)
-        )
+        # Delivered in the background so a slow webhook doesn't hold up the agent
+        self.push_coalescer.notify(self.task_snapshot(task), push_info.url)
 
     async def on_resubscribe_to_task(
-        self, request
+        self, request, last_event_id: str | None = None
     ) -> AsyncIterable[SendTaskStreamingResponse] | JSONRPCResponse:
         task_id_params: TaskIdParams = request.params
         try:
-            sse_event_queue = await self.setup_sse_consumer(task_id_params.id, True)
+            sse_event_queue = await self.setup_sse_consumer(task_id_params.id, True, last_event_id)
             return self.dequeue_events_for_sse(request.id, task_id_params.id, sse_event_queue)
         except Exception as e:
             self.logger.error(f"Error while reconnecting to SSE stream: {e}")
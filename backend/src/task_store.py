@@ -0,0 +1,532 @@
+"""
+Task stores for A2A tasks.
+
+InMemoryTaskStore keeps tasks (and their push-notification config) in LRU order
+with a cap on the number of entries and on their approximate serialized size.
+Tasks that reached a terminal state expire after a TTL; a background sweeper
+removes them so idle agents release memory too. When a cap is hit, terminal
+tasks are evicted before in-flight ones.
+
+WriteBehindTaskStore adds durability on top of it: changed tasks are batched
+and persisted asynchronously (SQLite in WAL mode, or MongoDB), terminal states
+are flushed right away, and tasks missing from memory are loaded back from the
+backend, so completed tasks survive a restart. TASK_STORE_BACKEND selects
+memory (default), sqlite or mongodb.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.types import Artifact, Message, PushNotificationConfig, Task, TaskState
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+TASK_STORE_MAX_TASKS = int(os.getenv("TASK_STORE_MAX_TASKS", "10000"))
+TASK_STORE_MAX_BYTES = int(os.getenv("TASK_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+TASK_STORE_TERMINAL_TTL = float(os.getenv("TASK_STORE_TERMINAL_TTL", "3600"))
+TASK_STORE_SWEEP_INTERVAL = float(os.getenv("TASK_STORE_SWEEP_INTERVAL", "60"))
+TASK_STORE_BACKEND = os.getenv("TASK_STORE_BACKEND", "memory")  # memory, sqlite or mongodb
+TASK_STORE_SQLITE_PATH = os.getenv("TASK_STORE_SQLITE_PATH", "agentweave_tasks.db")
+TASK_STORE_FLUSH_INTERVAL = float(os.getenv("TASK_STORE_FLUSH_INTERVAL", "1"))
+TASK_STORE_FLUSH_BATCH = int(os.getenv("TASK_STORE_FLUSH_BATCH", "500"))
+
+TERMINAL_STATES = {TaskState.COMPLETED, TaskState.CANCELED, TaskState.FAILED}
+
+
+def _task_json(task: Task) -> str:
+    # Task managers keep history in a deque (see BaseTaskManager.append_history); persist it as a list
+    if task.history is not None and not isinstance(task.history, list):
+        task = task.model_copy(update={"history": list(task.history)})
+    return task.model_dump_json(exclude_none=True)
+
+
+def _size_of(items: Iterable) -> int:
+    return sum(len(item.model_dump_json(exclude_none=True)) for item in items)
+
+
+class _Entry:
+    __slots__ = ("task", "size", "finished_at", "push_info")
+
+    def __init__(self, task: Task, size: int):
+        self.task = task
+        self.size = size
+        self.finished_at: Optional[float] = None
+        self.push_info: Optional[PushNotificationConfig] = None
+
+
+class TaskStore(ABC):
+    @abstractmethod
+    async def get(self, task_id: str) -> Optional[Task]:
+        pass
+
+    @abstractmethod
+    async def put(self, task: Task):
+        pass
+
+    @abstractmethod
+    async def updated(self, task: Task, messages: Iterable[Message] = (), artifacts: Iterable[Artifact] = (), dropped: Iterable[Message] = ()):
+        """Record that a task was mutated in place (status changed, messages/artifacts appended,
+        `dropped` messages pushed out of its history)."""
+        pass
+
+    @abstractmethod
+    async def set_push_info(self, task_id: str, push_info: PushNotificationConfig):
+        pass
+
+    @abstractmethod
+    async def get_push_info(self, task_id: str) -> Optional[PushNotificationConfig]:
+        pass
+
+    @abstractmethod
+    async def remove(self, task_id: str):
+        pass
+
+    def pin(self, task_id: str):
+        """Keep the task from being evicted or expired while work on it is running.
+        Pins are counted; each pin needs a matching unpin."""
+        pass
+
+    def unpin(self, task_id: str):
+        pass
+
+    async def close(self):
+        pass
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class InMemoryTaskStore(TaskStore):
+    def __init__(
+        self,
+        max_tasks: int = TASK_STORE_MAX_TASKS,
+        max_bytes: int = TASK_STORE_MAX_BYTES,
+        terminal_ttl: float = TASK_STORE_TERMINAL_TTL,
+        sweep_interval: float = TASK_STORE_SWEEP_INTERVAL,
+    ):
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.terminal_ttl = terminal_ttl
+        self.sweep_interval = sweep_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._pinned: Dict[str, int] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self.counters: Dict[str, int] = {"evicted_lru": 0, "evicted_active": 0, "expired": 0}
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, task_id: str) -> Optional[Task]:
+        return self._get(task_id)
+
+    def _get(self, task_id: str) -> Optional[Task]:
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return None
+        if task_id not in self._pinned and self._expired(entry, time.monotonic()):
+            self._remove(task_id)
+            self.counters["expired"] += 1
+            return None
+        self._entries.move_to_end(task_id)
+        return entry.task
+
+    async def put(self, task: Task):
+        self._put(task)
+
+    def _put(self, task: Task):
+        """Add (or replace) a task and enforce the caps."""
+        self._ensure_sweeper()
+        if task.id in self._entries:
+            self._remove(task.id)
+        entry = _Entry(task, len(_task_json(task)))
+        self._entries[task.id] = entry
+        self._bytes += entry.size
+        self._mark_state(entry)
+        self._enforce_caps(keep=task.id)
+
+    async def updated(self, task: Task, messages: Iterable[Message] = (), artifacts: Iterable[Artifact] = (), dropped: Iterable[Message] = ()):
+        self._updated(task, messages, artifacts, dropped)
+
+    def _updated(self, task: Task, messages: Iterable[Message] = (), artifacts: Iterable[Artifact] = (), dropped: Iterable[Message] = ()):
+        entry = self._entries.get(task.id)
+        if entry is None:
+            self._put(task)
+            return
+        added = _size_of(messages) + _size_of(artifacts) - _size_of(dropped)
+        entry.size += added
+        self._bytes += added
+        self._entries.move_to_end(task.id)
+        self._mark_state(entry)
+        if added > 0:
+            self._enforce_caps(keep=task.id)
+
+    async def set_push_info(self, task_id: str, push_info: PushNotificationConfig):
+        self._entries[task_id].push_info = push_info
+
+    async def get_push_info(self, task_id: str) -> Optional[PushNotificationConfig]:
+        entry = self._entries.get(task_id)
+        return entry.push_info if entry else None
+
+    async def remove(self, task_id: str):
+        if task_id in self._entries:
+            self._remove(task_id)
+
+    def _remove(self, task_id: str):
+        entry = self._entries.pop(task_id)
+        self._bytes -= entry.size
+
+    def pin(self, task_id: str):
+        self._pinned[task_id] = self._pinned.get(task_id, 0) + 1
+
+    def unpin(self, task_id: str):
+        count = self._pinned.get(task_id, 0) - 1
+        if count > 0:
+            self._pinned[task_id] = count
+        else:
+            self._pinned.pop(task_id, None)
+
+    @staticmethod
+    def _mark_state(entry: _Entry):
+        if entry.task.status.state in TERMINAL_STATES:
+            if entry.finished_at is None:
+                entry.finished_at = time.monotonic()
+        else:
+            entry.finished_at = None
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return entry.finished_at is not None and now - entry.finished_at >= self.terminal_ttl
+
+    def _over_caps(self) -> bool:
+        return len(self._entries) > self.max_tasks or self._bytes > self.max_bytes
+
+    def _enforce_caps(self, keep: Optional[str] = None):
+        if not self._over_caps():
+            return
+        # Walk from the least recently used end and stop as soon as enough is freed: terminal
+        # tasks go first, then in-flight ones. Pinned tasks have agent work running, which
+        # would fail on its next update if they went.
+        count, size = len(self._entries), self._bytes
+        victims = []
+        for terminal in (True, False):
+            for task_id, entry in self._entries.items():
+                if count <= self.max_tasks and size <= self.max_bytes:
+                    break
+                if task_id == keep or task_id in self._pinned or (entry.finished_at is not None) != terminal:
+                    continue
+                victims.append((task_id, terminal))
+                count -= 1
+                size -= entry.size
+        for task_id, terminal in victims:
+            if terminal:
+                self.counters["evicted_lru"] += 1
+            else:
+                logger.warning(f"[TaskStore] Evicting in-flight task {task_id} (store over capacity)")
+                self.counters["evicted_active"] += 1
+            self._remove(task_id)
+
+    def sweep(self) -> int:
+        """Drop expired terminal tasks. Returns the number removed."""
+        now = time.monotonic()
+        expired = [tid for tid, e in self._entries.items() if tid not in self._pinned and self._expired(e, now)]
+        for task_id in expired:
+            self._remove(task_id)
+        self.counters["expired"] += len(expired)
+        return len(expired)
+
+    def _ensure_sweeper(self):
+        if self.sweep_interval > 0 and (self._sweeper is None or self._sweeper.done()):
+            try:
+                self._sweeper = asyncio.get_running_loop().create_task(self._sweep_periodically())
+            except RuntimeError:
+                pass  # no running loop (e.g. used from sync code); expiry still happens on access
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"[TaskStore] Swept {removed} expired task(s)")
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def metrics(self) -> dict:
+        return {
+            "tasks": len(self._entries),
+            "bytes": self._bytes,
+            "pinned": len(self._pinned),
+            "max_tasks": self.max_tasks,
+            "max_bytes": self.max_bytes,
+            **self.counters,
+        }
+
+
+# --- durable, write-behind stores ---
+
+# A persisted task: (task_id, state, task JSON, push config JSON or None, updated_at)
+TaskRecord = Tuple[str, str, str, Optional[str], float]
+
+
+class TaskPersistence(ABC):
+    @abstractmethod
+    async def save_many(self, records: List[TaskRecord]):
+        pass
+
+    @abstractmethod
+    async def load(self, task_id: str) -> Optional[TaskRecord]:
+        pass
+
+    @abstractmethod
+    async def delete(self, task_id: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SQLiteTaskPersistence(TaskPersistence):
+    """Tasks of one agent in a shared SQLite file (WAL mode); calls run in a thread."""
+
+    def __init__(self, agent_name: str, path: str = TASK_STORE_SQLITE_PATH):
+        self.agent_name = agent_name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " agent TEXT NOT NULL, id TEXT NOT NULL, state TEXT NOT NULL, data TEXT NOT NULL,"
+                " push_info TEXT, updated_at REAL NOT NULL, PRIMARY KEY (agent, id))"
+            )
+            self._conn.commit()
+
+    def _save_many(self, records: List[TaskRecord]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO tasks (agent, id, state, data, push_info, updated_at) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(agent, id) DO UPDATE SET state=excluded.state, data=excluded.data,"
+                " push_info=excluded.push_info, updated_at=excluded.updated_at",
+                [(self.agent_name, *record) for record in records],
+            )
+            self._conn.commit()
+
+    def _load(self, task_id: str) -> Optional[TaskRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, state, data, push_info, updated_at FROM tasks WHERE agent = ? AND id = ?",
+                (self.agent_name, task_id),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def _delete(self, task_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM tasks WHERE agent = ? AND id = ?", (self.agent_name, task_id))
+            self._conn.commit()
+
+    async def save_many(self, records: List[TaskRecord]):
+        await asyncio.to_thread(self._save_many, records)
+
+    async def load(self, task_id: str) -> Optional[TaskRecord]:
+        return await asyncio.to_thread(self._load, task_id)
+
+    async def delete(self, task_id: str):
+        await asyncio.to_thread(self._delete, task_id)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MongoTaskPersistence(TaskPersistence):
+    """Tasks of one agent in the engine's MongoDB ("tasks" collection), written in bulk."""
+
+    def __init__(self, agent_name: str):
+        from db import get_async_mongo_database
+        self.agent_name = agent_name
+        self._collection = get_async_mongo_database()["tasks"]
+        self._indexed = False
+
+    async def _ensure_index(self):
+        if not self._indexed:
+            await self._collection.create_index([("agent", 1), ("task_id", 1)], unique=True)
+            self._indexed = True
+
+    async def save_many(self, records: List[TaskRecord]):
+        from pymongo import UpdateOne
+        await self._ensure_index()
+        ops = [
+            UpdateOne(
+                {"agent": self.agent_name, "task_id": task_id},
+                {"$set": {"state": state, "data": data, "push_info": push_info, "updated_at": updated_at}},
+                upsert=True,
+            )
+            for task_id, state, data, push_info, updated_at in records
+        ]
+        await self._collection.bulk_write(ops, ordered=False)
+
+    async def load(self, task_id: str) -> Optional[TaskRecord]:
+        doc = await self._collection.find_one({"agent": self.agent_name, "task_id": task_id})
+        if not doc:
+            return None
+        return doc["task_id"], doc["state"], doc["data"], doc.get("push_info"), doc["updated_at"]
+
+    async def delete(self, task_id: str):
+        await self._collection.delete_one({"agent": self.agent_name, "task_id": task_id})
+
+
+class WriteBehindTaskStore(InMemoryTaskStore):
+    """In-memory store whose changes are persisted in batches off the request path.
+
+    Dirty tasks are flushed every `flush_interval` seconds (or when a batch fills
+    up); a task reaching a terminal state is flushed before the call returns.
+    Tasks evicted from memory while dirty are still written on the next flush.
+    """
+
+    def __init__(
+        self,
+        persistence: TaskPersistence,
+        flush_interval: float = TASK_STORE_FLUSH_INTERVAL,
+        flush_batch: int = TASK_STORE_FLUSH_BATCH,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.persistence = persistence
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._dirty: set = set()
+        self._evicted_dirty: Dict[str, TaskRecord] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None  # batch-size flush, at most one at a time
+        self._flush_lock = asyncio.Lock()
+        self.counters.update({"flushes": 0, "flushed_tasks": 0, "flush_errors": 0, "loaded": 0})
+
+    def _record(self, task_id: str) -> TaskRecord:
+        entry = self._entries[task_id]
+        push_info = entry.push_info.model_dump_json() if entry.push_info else None
+        return task_id, entry.task.status.state.value, _task_json(entry.task), push_info, time.time()
+
+    def _remove(self, task_id: str):
+        if task_id in self._dirty:
+            self._dirty.discard(task_id)
+            self._evicted_dirty[task_id] = self._record(task_id)
+        super()._remove(task_id)
+
+    async def _mark_dirty(self, task: Task):
+        self._dirty.add(task.id)
+        if task.status.state in TERMINAL_STATES:
+            await self.flush([task.id])
+            return
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+        if len(self._dirty) >= self.flush_batch and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["flush_errors"] += 1
+            logger.error(f"[TaskStore] Batch flush failed: {task.exception()}")
+
+    async def get(self, task_id: str) -> Optional[Task]:
+        task = self._get(task_id)
+        if task is not None:
+            return task
+        record = self._evicted_dirty.get(task_id) or await self.persistence.load(task_id)
+        if record is None:
+            return None
+        _, _, data, push_info, _ = record
+        task = Task.model_validate_json(data)
+        self._put(task)
+        if push_info:
+            self._entries[task_id].push_info = PushNotificationConfig.model_validate_json(push_info)
+        self.counters["loaded"] += 1
+        return task
+
+    async def put(self, task: Task):
+        self._put(task)
+        await self._mark_dirty(task)
+
+    async def updated(self, task: Task, messages: Iterable[Message] = (), artifacts: Iterable[Artifact] = (), dropped: Iterable[Message] = ()):
+        self._updated(task, messages, artifacts, dropped)
+        await self._mark_dirty(task)
+
+    async def set_push_info(self, task_id: str, push_info: PushNotificationConfig):
+        await super().set_push_info(task_id, push_info)
+        await self._mark_dirty(self._entries[task_id].task)
+
+    async def remove(self, task_id: str):
+        await super().remove(task_id)
+        self._dirty.discard(task_id)
+        self._evicted_dirty.pop(task_id, None)
+        await self.persistence.delete(task_id)
+
+    async def flush(self, task_ids: Optional[Iterable[str]] = None):
+        """Persist the given dirty tasks (default: all of them) in one batch."""
+        async with self._flush_lock:
+            ids = list(self._dirty) if task_ids is None else [tid for tid in task_ids if tid in self._dirty]
+            records = [self._record(tid) for tid in ids if tid in self._entries]
+            if task_ids is None:
+                records += list(self._evicted_dirty.values())
+            if not records:
+                return
+            self._dirty.difference_update(ids)
+            evicted = dict(self._evicted_dirty) if task_ids is None else {}
+            for tid in evicted:
+                self._evicted_dirty.pop(tid, None)
+            try:
+                await self.persistence.save_many(records)
+            except Exception as e:
+                # Keep them dirty so the next flush retries
+                self._dirty.update(tid for tid in ids if tid in self._entries)
+                self._evicted_dirty.update({tid: rec for tid, rec in evicted.items() if tid not in self._evicted_dirty})
+                self.counters["flush_errors"] += 1
+                logger.error(f"[TaskStore] Persisting {len(records)} task(s) failed: {e}")
+                return
+            self.counters["flushes"] += 1
+            self.counters["flushed_tasks"] += len(records)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._dirty and not self._evicted_dirty:
+                return  # restarted by the next write
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        await super().close()
+        await self.persistence.close()
+
+    def metrics(self) -> dict:
+        return {**super().metrics(), "dirty": len(self._dirty) + len(self._evicted_dirty)}
+
+
+def create_task_store(agent_name: str, backend: str = TASK_STORE_BACKEND) -> TaskStore:
+    """Task store for one agent, per TASK_STORE_BACKEND."""
+    if backend == "sqlite":
+        return WriteBehindTaskStore(SQLiteTaskPersistence(agent_name))
+    if backend == "mongodb":
+        return WriteBehindTaskStore(MongoTaskPersistence(agent_name))
+    if backend != "memory":
+        logger.warning(f"Unknown TASK_STORE_BACKEND {backend!r}, using memory")
+    return InMemoryTaskStore()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend imports `src.*` and `db` from backend/, and `utils.*` from the repository root
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BACKEND_DIR, os.path.dirname(BACKEND_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,85 @@
+import pytest
+
+from src import port_allocator
+from src.port_allocator import PortAllocator
+
+
+@pytest.fixture
+def bindable(monkeypatch):
+    """Ports the fake bind test accepts; everything is bindable unless removed."""
+    busy = set()
+    monkeypatch.setattr(port_allocator, "is_port_bindable", lambda host, port: port not in busy)
+    return busy
+
+
+def test_reserve_and_release():
+    allocator = PortAllocator(100, 109)
+    assert allocator.reserve(103)
+    assert not allocator.reserve(103)
+    assert allocator.is_reserved(103)
+    assert allocator.free_count == 9
+    allocator.release(103)
+    assert not allocator.is_reserved(103)
+    assert allocator.free_count == 10
+
+
+def test_ports_outside_the_range_are_not_tracked():
+    allocator = PortAllocator(100, 109)
+    assert allocator.reserve(99)
+    assert allocator.reserve(99)
+    assert not allocator.is_reserved(99)
+    allocator.release(200)
+    assert allocator.free_count == 10
+
+
+def test_seed_marks_ports_reserved():
+    allocator = PortAllocator(100, 109)
+    allocator.seed([100, 105, None, 500])
+    assert allocator.is_reserved(100) and allocator.is_reserved(105)
+    assert allocator.free_count == 8
+
+
+def test_allocate_is_next_fit(bindable):
+    allocator = PortAllocator(100, 103)
+    assert [allocator.allocate() for _ in range(3)] == [100, 101, 102]
+    allocator.release(100)
+    # The cursor moves on past the last allocation before wrapping around
+    assert allocator.allocate() == 103
+    assert allocator.allocate() == 100
+
+
+def test_allocate_skips_reserved_ports(bindable):
+    allocator = PortAllocator(100, 120)
+    allocator.seed(range(100, 117))
+    assert allocator.allocate() == 117
+
+
+def test_allocate_within_sub_range(bindable):
+    allocator = PortAllocator(100, 119)
+    assert allocator.allocate(within=(110, 114)) == 110
+    assert allocator.allocate(within=(110, 114), exclude={111}) == 112
+
+
+def test_unbindable_ports_are_skipped_but_stay_free(bindable):
+    allocator = PortAllocator(100, 104)
+    bindable.update({100, 101})
+    assert allocator.allocate() == 102
+    assert not allocator.is_reserved(100)
+    assert not allocator.is_reserved(101)
+    bindable.clear()
+    assert sorted(allocator.allocate() for _ in range(4)) == [100, 101, 103, 104]
+
+
+def test_allocate_raises_when_exhausted(bindable):
+    allocator = PortAllocator(100, 101)
+    allocator.allocate()
+    bindable.add(101)
+    with pytest.raises(RuntimeError):
+        allocator.allocate()
+    with pytest.raises(RuntimeError):
+        PortAllocator(100, 109).allocate(within=(200, 210))
+
+
+def test_invalid_range():
+    with pytest.raises(ValueError):
+        PortAllocator(10, 9)
@@ -0,0 +1,36 @@
+from collections import Counter
+
+from src import port_allocator
+from src.sharding import HashRing, _port_slice
+
+
+def test_owner_is_deterministic():
+    ring = HashRing(["0", "1", "2"])
+    again = HashRing(["2", "1", "0"])
+    for i in range(100):
+        assert ring.owner(f"agent-{i}") == again.owner(f"agent-{i}")
+
+
+def test_keys_spread_over_all_nodes():
+    ring = HashRing(["0", "1", "2", "3"])
+    owners = Counter(ring.owner(f"agent-{i}") for i in range(4000))
+    assert set(owners) == {"0", "1", "2", "3"}
+    assert min(owners.values()) > 500
+
+
+def test_adding_a_node_moves_only_its_share():
+    keys = [f"agent-{i}" for i in range(2000)]
+    before = HashRing(["0", "1", "2"])
+    after = HashRing(["0", "1", "2", "3"])
+    moved = [k for k in keys if before.owner(k) != after.owner(k)]
+    assert all(after.owner(k) == "3" for k in moved)
+    assert len(moved) < len(keys) / 2
+
+
+def test_port_slices_partition_the_range(monkeypatch):
+    monkeypatch.setattr(port_allocator, "PORT_RANGE_START", 10000)
+    monkeypatch.setattr(port_allocator, "PORT_RANGE_END", 10999)
+    slices = [_port_slice(i, 3) for i in range(3)]
+    assert slices[0][0] == 10000 and slices[-1][1] == 10999
+    for (_, end), (start, _) in zip(slices, slices[1:]):
+        assert start == end + 1
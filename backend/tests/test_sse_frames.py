@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("pydantic")
+
+from src.sse_frames import SubscriberQueue, TaskEventLog  # noqa: E402
+from utils.types import TaskState, TaskStatus, TaskStatusUpdateEvent  # noqa: E402
+
+
+def status_event(state: TaskState = TaskState.WORKING, final: bool = False) -> TaskStatusUpdateEvent:
+    return TaskStatusUpdateEvent(id="task-1", status=TaskStatus(state=state), final=final)
+
+
+def test_frames_are_numbered_from_one():
+    log = TaskEventLog(max_events=10)
+    assert [log.append(status_event()).seq for _ in range(3)] == [1, 2, 3]
+    assert log.last_seq == 3
+
+
+def test_replay_returns_only_missed_frames():
+    log = TaskEventLog(max_events=10)
+    for _ in range(5):
+        log.append(status_event())
+    assert [f.seq for f in log.since(0)] == [1, 2, 3, 4, 5]
+    assert [f.seq for f in log.since(3)] == [4, 5]
+    assert log.since(5) == []
+    assert log.since(42) == []
+
+
+def test_replay_after_old_frames_were_dropped():
+    log = TaskEventLog(max_events=3)
+    for _ in range(6):
+        log.append(status_event())
+    # Frames 1-3 are gone: the client gets what is still retained
+    assert [f.seq for f in log.since(1)] == [4, 5, 6]
+    assert [f.seq for f in log.since(4)] == [5, 6]
+
+
+def test_frame_carries_sse_id():
+    log = TaskEventLog(max_events=10)
+    frame = log.append(status_event(TaskState.COMPLETED, final=True))
+    encoded = frame.encode(b"")
+    assert b"id: 1" in encoded
+    assert frame.final
+
+
+def test_coalesce_replaces_queued_working_update():
+    queue = SubscriberQueue(maxsize=2, policy="coalesce")
+    log = TaskEventLog(max_events=10)
+    for _ in range(3):
+        assert queue.put(log.append(status_event()))
+    assert len(queue) == 2
+    assert queue.coalesced == 1
+
+
+def test_final_event_is_never_dropped():
+    queue = SubscriberQueue(maxsize=1, policy="drop")
+    log = TaskEventLog(max_events=10)
+    queue.put(log.append(status_event()))
+    assert queue.put(log.append(status_event(TaskState.COMPLETED, final=True)))
+    # Final frames bypass the size bound rather than displace anything
+    assert not queue.disconnected
+    assert [f.seq for f in queue._frames] == [1, 2]
+
+
+def test_disconnect_policy_ends_the_stream():
+    queue = SubscriberQueue(maxsize=1, policy="disconnect")
+    log = TaskEventLog(max_events=10)
+    queue.put(log.append(status_event()))
+    assert not queue.put(log.append(status_event()))
+    assert queue.disconnected
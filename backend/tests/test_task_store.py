@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from src.task_store import InMemoryTaskStore  # noqa: E402
+from utils.types import Task, TaskState, TaskStatus  # noqa: E402
+
+
+def make_task(task_id: str, state: TaskState = TaskState.WORKING) -> Task:
+    return Task(id=task_id, status=TaskStatus(state=state))
+
+
+def new_store(**kwargs) -> InMemoryTaskStore:
+    kwargs.setdefault("sweep_interval", 0)
+    return InMemoryTaskStore(**kwargs)
+
+
+def test_evicts_least_recently_used_terminal_tasks_first():
+    async def run():
+        store = new_store(max_tasks=3)
+        await store.put(make_task("done-1", TaskState.COMPLETED))
+        await store.put(make_task("working"))
+        await store.put(make_task("done-2", TaskState.COMPLETED))
+        await store.put(make_task("new"))
+        assert "done-1" not in store
+        assert {"working", "done-2", "new"} <= set(store._entries)
+        assert store.counters["evicted_lru"] == 1
+        assert store.counters["evicted_active"] == 0
+
+    asyncio.run(run())
+
+
+def test_access_refreshes_recency():
+    async def run():
+        store = new_store(max_tasks=2)
+        await store.put(make_task("a", TaskState.COMPLETED))
+        await store.put(make_task("b", TaskState.COMPLETED))
+        await store.get("a")
+        await store.put(make_task("c"))
+        assert "a" in store and "b" not in store
+
+    asyncio.run(run())
+
+
+def test_in_flight_tasks_go_only_when_nothing_else_can():
+    async def run():
+        store = new_store(max_tasks=2)
+        await store.put(make_task("a"))
+        await store.put(make_task("b"))
+        await store.put(make_task("c"))
+        assert "a" not in store and len(store) == 2
+        assert store.counters["evicted_active"] == 1
+
+    asyncio.run(run())
+
+
+def test_pinned_tasks_are_not_evicted():
+    async def run():
+        store = new_store(max_tasks=1)
+        await store.put(make_task("pinned"))
+        store.pin("pinned")
+        await store.put(make_task("other"))
+        assert "pinned" in store
+        store.unpin("pinned")
+        await store.put(make_task("third"))
+        assert "pinned" not in store
+
+    asyncio.run(run())
+
+
+def test_byte_cap():
+    async def run():
+        store = new_store(max_bytes=1)
+        await store.put(make_task("a", TaskState.COMPLETED))
+        await store.put(make_task("b", TaskState.COMPLETED))
+        # The task just written is kept even when it alone exceeds the cap
+        assert list(store._entries) == ["b"]
+
+    asyncio.run(run())
+
+
+def test_terminal_tasks_expire_after_ttl():
+    async def run():
+        store = new_store(terminal_ttl=0)
+        await store.put(make_task("done", TaskState.COMPLETED))
+        await store.put(make_task("working"))
+        await store.put(make_task("pinned", TaskState.FAILED))
+        store.pin("pinned")
+        assert store.sweep() == 1
+        assert "done" not in store
+        assert "working" in store and "pinned" in store
+
+    asyncio.run(run())
+
+
+def test_expired_task_is_dropped_on_access():
+    async def run():
+        store = new_store(terminal_ttl=0)
+        await store.put(make_task("done", TaskState.CANCELED))
+        assert await store.get("done") is None
+        kept = new_store(terminal_ttl=3600)
+        await kept.put(make_task("done", TaskState.CANCELED))
+        assert await kept.get("done") is not None
+
+    asyncio.run(run())
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import threading
 
 from utils.push_notification_auth import PushNotificationReceiverAuth
@@ -58,9 +59,10 @@ class PushNotificationListener():
         return Response(content=validation_token, status_code=200)
     
     async def handle_notification(self, request: Request):
-        data = await request.json()
+        body = await request.body()
+        data = json.loads(body)
         try:
-            if not await self.notification_receiver_auth.verify_push_notification(request):
+            if not await self.notification_receiver_auth.verify_push_notification(request, body=body, data=data):
                 print("push notification verification failed")
                 return
         except Exception as e:
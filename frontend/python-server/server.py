@@ -16,6 +16,7 @@ from utils.push_notification_auth import PushNotificationReceiverAuth
 from utils.shared_config import load_shared_config
 import httpx
 from pydantic import BaseModel
+from typing import Optional
 
 # Load configuration from central config file
 config = load_shared_config()
@@ -47,7 +48,8 @@ def get_all_agent_cards():
             servers = servers_data["agents"]
         else:
             servers = []
-        backend_urls = [f"http://{s['host']}:{s['port']}" for s in servers if 'host' in s and 'port' in s]
+        # Prefer the advertised agent URL (agents hosted on a shared server live under a path prefix)
+        backend_urls = [s.get('url') or f"http://{s['host']}:{s['port']}" for s in servers if 'host' in s and 'port' in s]
         for s in servers:
             print(f"[PYTHON SERVER] Agent {s.get('agent_name', s.get('host'))}:{s.get('port')} status: {s.get('status')} | detail: {s.get('status_detail')}")
         print(f"[PYTHON SERVER] Found {len(backend_urls)} backend URLs: {backend_urls}")
@@ -176,6 +178,8 @@ class AgentCreateRequest(BaseModel):
     agent_prompt: str
     mcp_address: str
     mcp_transport_type: str
+    history_max_length: Optional[int] = None
+    max_concurrent_tasks: Optional[int] = None
 
 @app.post("/agent")
 def create_agent(agent: AgentCreateRequest = Body(...)):
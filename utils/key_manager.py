@@ -0,0 +1,276 @@
+"""Signing-key management for push notifications.
+
+Keys are pre-generated in a background thread pool so agents don't wait on key
+generation at startup, can be persisted per owner (agent) in an encrypted local
+keystore and reloaded on restart, and are rotated with an overlap window: a
+retired key stays published in the JWKS until receivers have stopped needing it.
+
+Supported algorithms: RS256 (RSA 2048), ES256 (P-256) and EdDSA (Ed25519).
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional
+
+from jwcrypto import jwk, jwe
+from jwt import PyJWK
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+PUSH_SIGNING_ALG = os.getenv("PUSH_SIGNING_ALG", "RS256")
+PUSH_KEY_POOL_SIZE = int(os.getenv("PUSH_KEY_POOL_SIZE", "4"))
+PUSH_KEYGEN_WORKERS = int(os.getenv("PUSH_KEYGEN_WORKERS", "2"))
+PUSH_KEYSTORE_DIR = os.getenv("PUSH_KEYSTORE_DIR") or None
+KEYSTORE_SECRET = os.getenv("AGENTWEAVE_KEYSTORE_SECRET") or None
+# Rotate signing keys every N seconds (0 disables rotation)
+PUSH_KEY_ROTATION_INTERVAL = float(os.getenv("PUSH_KEY_ROTATION_INTERVAL", "0"))
+# How long a retired key is still published in the JWKS
+PUSH_KEY_OVERLAP = float(os.getenv("PUSH_KEY_OVERLAP", "600"))
+
+SUPPORTED_ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+
+def generate_signing_key(alg: str = PUSH_SIGNING_ALG) -> jwk.JWK:
+    """Generate a private signing JWK for alg (CPU-bound for RS256)."""
+    kid = str(uuid.uuid4())
+    if alg == "RS256":
+        return jwk.JWK.generate(kty="RSA", size=2048, kid=kid, use="sig", alg=alg)
+    if alg == "ES256":
+        return jwk.JWK.generate(kty="EC", crv="P-256", kid=kid, use="sig", alg=alg)
+    if alg == "EdDSA":
+        return jwk.JWK.generate(kty="OKP", crv="Ed25519", kid=kid, use="sig", alg=alg)
+    raise ValueError(f"Unsupported signing algorithm: {alg} (expected one of {', '.join(SUPPORTED_ALGORITHMS)})")
+
+
+class SigningKey:
+    def __init__(self, key: jwk.JWK, created_at: Optional[float] = None, retired_at: Optional[float] = None):
+        self.jwk = key
+        self.alg = key.get("alg") or "RS256"
+        self.kid = key.key_id
+        self.pyjwk = PyJWK.from_json(key.export_private(), algorithm=self.alg)
+        self.created_at = created_at if created_at is not None else time.time()
+        self.retired_at = retired_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"jwk": self.jwk.export_private(as_dict=True), "created_at": self.created_at, "retired_at": self.retired_at}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SigningKey":
+        return cls(jwk.JWK(**data["jwk"]), data.get("created_at"), data.get("retired_at"))
+
+
+class SigningKeySet:
+    """The current signing key of one owner plus retired keys still inside the overlap window."""
+
+    def __init__(self, owner: str, keys: Optional[List[SigningKey]] = None, overlap: float = PUSH_KEY_OVERLAP):
+        self.owner = owner
+        self.overlap = overlap
+        self.keys: List[SigningKey] = keys or []
+
+    @property
+    def current(self) -> Optional[SigningKey]:
+        return self.keys[-1] if self.keys else None
+
+    def rotate(self, key: SigningKey):
+        now = time.time()
+        if self.current is not None:
+            self.current.retired_at = now
+        self.keys.append(key)
+        self.prune(now)
+
+    def prune(self, now: Optional[float] = None):
+        now = now if now is not None else time.time()
+        self.keys = [
+            k for k in self.keys
+            if k is self.current or k.retired_at is None or now - k.retired_at < self.overlap
+        ]
+
+    def public_jwks(self) -> List[Dict[str, Any]]:
+        self.prune()
+        return [k.jwk.export_public(as_dict=True) for k in self.keys]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"owner": self.owner, "keys": [k.to_dict() for k in self.keys]}
+
+
+class EncryptedKeystore:
+    """One JWE file per owner, encrypted with a key derived from AGENTWEAVE_KEYSTORE_SECRET (PBES2)."""
+
+    def __init__(self, directory: str, secret: str):
+        self.directory = directory
+        self._key = jwk.JWK.from_password(secret)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, owner: str) -> str:
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in owner)
+        return os.path.join(self.directory, f"{safe}.jwe")
+
+    def load(self, owner: str) -> Optional[SigningKeySet]:
+        path = self._path(owner)
+        if not os.path.exists(path):
+            return None
+        token = jwe.JWE()
+        with open(path) as f:
+            token.deserialize(f.read(), key=self._key)
+        data = json.loads(token.payload)
+        return SigningKeySet(owner, [SigningKey.from_dict(k) for k in data["keys"]])
+
+    def save(self, key_set: SigningKeySet):
+        token = jwe.JWE(
+            json.dumps(key_set.to_dict()).encode(),
+            protected={"alg": "PBES2-HS256+A128KW", "enc": "A256GCM"},
+        )
+        token.add_recipient(self._key)
+        path = self._path(key_set.owner)
+        tmp = f"{path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(token.serialize(compact=True))
+        os.replace(tmp, path)
+
+    def delete(self, owner: str):
+        try:
+            os.remove(self._path(owner))
+        except FileNotFoundError:
+            pass
+
+
+class KeyManager:
+    def __init__(
+        self,
+        alg: str = PUSH_SIGNING_ALG,
+        pool_size: int = PUSH_KEY_POOL_SIZE,
+        workers: int = PUSH_KEYGEN_WORKERS,
+        keystore_dir: Optional[str] = PUSH_KEYSTORE_DIR,
+        secret: Optional[str] = KEYSTORE_SECRET,
+        rotation_interval: float = PUSH_KEY_ROTATION_INTERVAL,
+    ):
+        if alg not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"Unsupported signing algorithm: {alg}")
+        self.alg = alg
+        self.pool_size = pool_size
+        self.rotation_interval = rotation_interval
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="keygen")
+        self._pool: Deque[jwk.JWK] = deque()
+        self._pool_lock = threading.Lock()
+        self._refilling = 0
+        self._key_sets: Dict[str, SigningKeySet] = {}
+        self._rotation_task: Optional[asyncio.Task] = None
+        self.keystore: Optional[EncryptedKeystore] = None
+        if keystore_dir:
+            if secret:
+                self.keystore = EncryptedKeystore(keystore_dir, secret)
+            else:
+                logger.warning("PUSH_KEYSTORE_DIR is set but AGENTWEAVE_KEYSTORE_SECRET is not; keys will not be persisted")
+
+    # --- pre-generated key pool ---
+
+    def _generate_into_pool(self):
+        try:
+            key = generate_signing_key(self.alg)
+            with self._pool_lock:
+                self._pool.append(key)
+        finally:
+            with self._pool_lock:
+                self._refilling -= 1
+
+    def prefill(self, count: Optional[int] = None):
+        """Start generating keys in the background until `count` (default pool_size) are pooled."""
+        target = count if count is not None else self.pool_size
+        with self._pool_lock:
+            missing = target - len(self._pool) - self._refilling
+            self._refilling += max(0, missing)
+        for _ in range(max(0, missing)):
+            self._executor.submit(self._generate_into_pool)
+
+    async def _take_key(self) -> jwk.JWK:
+        with self._pool_lock:
+            key = self._pool.popleft() if self._pool else None
+        self.prefill()
+        if key is None:
+            key = await asyncio.get_running_loop().run_in_executor(self._executor, generate_signing_key, self.alg)
+        return key
+
+    # --- per-owner key sets ---
+
+    async def get_key_set(self, owner: str) -> SigningKeySet:
+        """Key set for owner: in memory, else from the keystore, else a fresh (pooled) key."""
+        key_set = self._key_sets.get(owner)
+        if key_set is not None:
+            return key_set
+        if self.keystore is not None:
+            try:
+                key_set = await asyncio.to_thread(self.keystore.load, owner)
+            except Exception as e:
+                logger.warning(f"Could not load keys for {owner} from keystore: {e}")
+            if key_set is not None and key_set.current is not None:
+                key_set.prune()
+                logger.info(f"Loaded signing key {key_set.current.kid} for {owner} from keystore")
+        if key_set is None or key_set.current is None:
+            key_set = SigningKeySet(owner, [SigningKey(await self._take_key())])
+            await self._persist(key_set)
+        self._key_sets[owner] = key_set
+        return key_set
+
+    async def rotate(self, owner: str) -> SigningKey:
+        """Make a new key current for owner; the old one stays in the JWKS for the overlap window."""
+        key_set = await self.get_key_set(owner)
+        key = SigningKey(await self._take_key())
+        key_set.rotate(key)
+        await self._persist(key_set)
+        logger.info(f"Rotated signing key for {owner}: {key.kid}")
+        return key
+
+    async def forget(self, owner: str):
+        self._key_sets.pop(owner, None)
+        if self.keystore is not None:
+            await asyncio.to_thread(self.keystore.delete, owner)
+
+    async def _persist(self, key_set: SigningKeySet):
+        if self.keystore is not None:
+            try:
+                await asyncio.to_thread(self.keystore.save, key_set)
+            except Exception as e:
+                logger.warning(f"Could not persist keys for {key_set.owner}: {e}")
+
+    # --- rotation ---
+
+    def start(self):
+        self.prefill()
+        if self.rotation_interval > 0 and (self._rotation_task is None or self._rotation_task.done()):
+            self._rotation_task = asyncio.create_task(self._rotate_periodically())
+
+    async def _rotate_periodically(self):
+        while True:
+            await asyncio.sleep(self.rotation_interval)
+            now = time.time()
+            for owner, key_set in list(self._key_sets.items()):
+                if now - key_set.current.created_at >= self.rotation_interval:
+                    try:
+                        await self.rotate(owner)
+                    except Exception as e:
+                        logger.error(f"Key rotation failed for {owner}: {e}")
+
+    async def stop(self):
+        if self._rotation_task is not None:
+            self._rotation_task.cancel()
+            await asyncio.gather(self._rotation_task, return_exceptions=True)
+            self._rotation_task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_key_manager: Optional[KeyManager] = None
+
+
+def get_key_manager() -> KeyManager:
+    global _key_manager
+    if _key_manager is None:
+        _key_manager = KeyManager()
+    return _key_manager
@@ -0,0 +1,149 @@
+"""Coalescing of push notifications per task.
+
+Intermediate updates (WORKING steps) for a task are held for a short window and
+only the latest state is sent when it closes; states that end a turn
+(input-required, completed, canceled, failed) flush immediately, replacing
+anything pending. The task is serialized once per send rather than once per
+update.
+
+In delta mode, after the first full snapshot only what changed is sent: the
+status, the history/artifact items appended since the last notification and
+the metadata if it changed, plus a "delta" object carrying a sequence number
+and the list offsets the new items start at. History offsets count every
+message the task ever had, as agents keep only the most recent ones. What the
+receiver has seen only moves forward once a notification is accepted for
+delivery; if one is dropped later, the next notification is a full snapshot.
+"""
+
+import os
+import asyncio
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.types import Task, TaskState
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+# Seconds to hold intermediate updates per task (0 sends every update)
+PUSH_COALESCE_WINDOW = float(os.getenv("PUSH_COALESCE_WINDOW", "0"))
+PUSH_SEND_DELTAS = os.getenv("PUSH_SEND_DELTAS", "false").lower() in ("1", "true", "yes")
+
+IMMEDIATE_STATES = {TaskState.INPUT_REQUIRED, TaskState.COMPLETED, TaskState.CANCELED, TaskState.FAILED}
+FINAL_STATES = {TaskState.COMPLETED, TaskState.CANCELED, TaskState.FAILED}
+
+
+class PushNotificationCoalescer:
+    def __init__(
+        self,
+        # send(url, payload, on_failed) returns False if the notification was not accepted;
+        # on_failed is called if an accepted one is dropped later
+        send: Callable[[str, dict[str, Any], Callable[[], None]], Any],
+        window: float = PUSH_COALESCE_WINDOW,
+        deltas: bool = PUSH_SEND_DELTAS,
+    ):
+        self._send = send
+        self.window = window
+        self.deltas = deltas
+        self._pending: Dict[str, Tuple[str, Task]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._sent: Dict[str, dict] = {}  # task_id -> what the receiver has seen (delta mode)
+        self.coalesced = 0
+
+    def notify(self, task: Task, url: str):
+        """Record the task's latest state; send it now or when the task's window closes."""
+        if task.status.state in IMMEDIATE_STATES or self.window <= 0:
+            self._cancel_timer(task.id)
+            self._pending.pop(task.id, None)
+            self._deliver(task.id, url, task)
+            if task.status.state in FINAL_STATES:
+                self.forget(task.id)
+            elif task.status.state in IMMEDIATE_STATES:
+                # The next turn (if any) starts again from a full snapshot
+                self._sent.pop(task.id, None)
+            return
+        if task.id in self._pending:
+            self.coalesced += 1
+        self._pending[task.id] = (url, task)
+        if task.id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[task.id] = loop.call_later(self.window, self._flush, task.id)
+
+    def _cancel_timer(self, task_id: str):
+        timer = self._timers.pop(task_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _flush(self, task_id: str):
+        self._timers.pop(task_id, None)
+        pending = self._pending.pop(task_id, None)
+        if pending is not None:
+            url, task = pending
+            self._deliver(task_id, url, task)
+
+    def _deliver(self, task_id: str, url: str, task: Task):
+        try:
+            payload, state = self._payload(task_id, task)
+            accepted = self._send(url, payload, lambda: self._resync(task_id))
+        except Exception as e:
+            logger.warning(f"Could not send push notification for task {task_id}: {e}")
+            return
+        if accepted is False:
+            # Not sent: the next notification repeats what this one carried
+            return
+        if state is not None:
+            self._sent[task_id] = state
+
+    def _resync(self, task_id: str):
+        """An accepted notification was not delivered: start over from a full snapshot."""
+        self._sent.pop(task_id, None)
+
+    def _payload(self, task_id: str, task: Task) -> Tuple[dict[str, Any], Optional[dict]]:
+        """The notification body, and in delta mode what the receiver has seen once it is sent."""
+        data = task.model_dump(mode="json", exclude_none=True)
+        if not self.deltas:
+            return data, None
+        sent = self._sent.get(task_id)
+        history, artifacts = data.get("history") or [], data.get("artifacts") or []
+        state = {
+            "seq": 0,
+            "history": len(history),
+            "history_last": task.history[-1] if task.history else None,
+            "artifacts": len(artifacts),
+            "metadata": data.get("metadata"),
+        }
+        if sent is None:
+            return data, state
+        state["seq"] = sent["seq"] + 1
+        # The history is a ring buffer: find what was appended after the last sent message
+        new_history = _count_after(task.history or (), sent["history_last"])
+        history = history[len(history) - new_history:]
+        state["history"] = sent["history"] + new_history
+        payload = {"id": data["id"], "status": data["status"]}
+        if "sessionId" in data:
+            payload["sessionId"] = data["sessionId"]
+        delta = {"seq": state["seq"]}
+        if history:
+            payload["history"] = history
+            delta["historyOffset"] = sent["history"]
+        offset = sent["artifacts"] if sent["artifacts"] <= len(artifacts) else 0
+        if artifacts[offset:]:
+            payload["artifacts"] = artifacts[offset:]
+            delta["artifactsOffset"] = offset
+        if state["metadata"] != sent["metadata"] and state["metadata"] is not None:
+            payload["metadata"] = state["metadata"]
+        payload["delta"] = delta
+        return payload, state
+
+    def forget(self, task_id: str):
+        self._cancel_timer(task_id)
+        self._pending.pop(task_id, None)
+        self._sent.pop(task_id, None)
+
+
+def _count_after(items, last) -> int:
+    """Number of items after `last` (by identity); all of them if it is gone."""
+    if last is None:
+        return len(items)
+    for count, item in enumerate(reversed(items)):
+        if item is last:
+            return count
+    return len(items)
@@ -0,0 +1,292 @@
+"""Background delivery of push notifications.
+
+Notifications are put on bounded queues and delivered by a fixed set of worker
+tasks, so a slow webhook never holds up the agent that produced the update.
+Each worker has its own queue and every notification of a task goes to the same
+worker, which delivers them one at a time (retries included), so a receiver
+sees a task's updates in order. Each destination (scheme://host:port) gets its
+own keep-alive httpx client and an in-flight limit; clients of destinations
+idle for PUSH_DESTINATION_IDLE_TTL seconds are closed. Failed deliveries are
+retried with exponential backoff; notifications that are dropped or exhaust
+their retries are kept in a bounded dead-letter record. Counters and latency
+figures are available from metrics().
+"""
+
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "1000"))
+PUSH_DISPATCH_WORKERS = int(os.getenv("PUSH_DISPATCH_WORKERS", "8"))
+PUSH_PER_HOST_CONCURRENCY = int(os.getenv("PUSH_PER_HOST_CONCURRENCY", "4"))
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+PUSH_RETRY_BASE_DELAY = float(os.getenv("PUSH_RETRY_BASE_DELAY", "0.5"))
+PUSH_RETRY_MAX_DELAY = float(os.getenv("PUSH_RETRY_MAX_DELAY", "10"))
+PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", "10"))
+PUSH_DEAD_LETTER_SIZE = int(os.getenv("PUSH_DEAD_LETTER_SIZE", "100"))
+PUSH_DESTINATION_IDLE_TTL = float(os.getenv("PUSH_DESTINATION_IDLE_TTL", "300"))
+
+_LATENCY_SAMPLES = 1000
+
+
+@dataclass
+class PushJob:
+    url: str
+    # Canonical JSON, serialized once; the receiver can hash these exact bytes
+    body: bytes
+    # Called per attempt so every retry carries a fresh token (iat)
+    sign: Callable[[], str]
+    source: Optional[str] = None
+    task_id: Optional[str] = None
+    # Called when the notification is dropped or given up on (not when submit returns False)
+    on_failed: Optional[Callable[[], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class _Destination:
+    def __init__(self, base_url: str, concurrency: int):
+        self.client = httpx.AsyncClient(
+            timeout=PUSH_TIMEOUT,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.in_flight = 0
+        # Jobs using this destination, including ones waiting to retry
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.base_url = base_url
+
+
+class PushNotificationDispatcher:
+    def __init__(
+        self,
+        queue_size: int = PUSH_QUEUE_SIZE,
+        workers: int = PUSH_DISPATCH_WORKERS,
+        per_host_concurrency: int = PUSH_PER_HOST_CONCURRENCY,
+        max_retries: int = PUSH_MAX_RETRIES,
+        dead_letter_size: int = PUSH_DEAD_LETTER_SIZE,
+    ):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.per_host_concurrency = per_host_concurrency
+        self.max_retries = max_retries
+        # One queue per worker; queue_size is split between them
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._destinations: Dict[str, _Destination] = {}
+        self._last_evicted = time.monotonic()
+        self._closing: set[asyncio.Task] = set()
+        self.dead_letters: Deque[dict] = deque(maxlen=dead_letter_size)
+        self._latencies: Deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._counters = {"enqueued": 0, "delivered": 0, "retried": 0, "failed": 0, "dropped": 0}
+        self._by_source: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self.running:
+            return
+        workers = max(1, self.workers)
+        per_worker = max(1, -(-self.queue_size // workers))
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def stop(self, drain_timeout: float = 5):
+        """Deliver what is queued (up to drain_timeout), then stop workers and close clients."""
+        if self.queue_depth:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"[PushDispatcher] {self.queue_depth} notification(s) undelivered at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+        destinations = list(self._destinations.values())
+        self._destinations.clear()
+        await asyncio.gather(*(d.client.aclose() for d in destinations), *self._closing, return_exceptions=True)
+
+    def submit(
+        self,
+        url: str,
+        body: bytes,
+        sign: Callable[[], str],
+        source: Optional[str] = None,
+        task_id: Optional[str] = None,
+        on_failed: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """Queue a notification without waiting for delivery. Returns False if it was dropped."""
+        if not self.running:
+            self.start()
+        job = PushJob(url=url, body=body, sign=sign, source=source, task_id=task_id, on_failed=on_failed)
+        # A task's notifications always go to the same worker, which keeps them in order
+        queue = self._queues[hash(task_id or url) % len(self._queues)]
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._count("dropped", source)
+            self._dead_letter(job, "queue full")
+            logger.warning(f"[PushDispatcher] Queue full, dropped notification for {url}")
+            return False
+        self._count("enqueued", source)
+        return True
+
+    def _count(self, name: str, source: Optional[str]):
+        self._counters[name] += 1
+        if source is not None:
+            counters = self._by_source.setdefault(source, {})
+            counters[name] = counters.get(name, 0) + 1
+
+    def _dead_letter(self, job: PushJob, error: str):
+        self.dead_letters.append({
+            "url": job.url,
+            "source": job.source,
+            "task_id": job.task_id,
+            "attempts": job.attempts,
+            "error": error,
+            "at": int(time.time()),
+        })
+
+    def _destination(self, url: str) -> _Destination:
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        self._evict_idle()
+        destination = self._destinations.get(base_url)
+        if destination is None:
+            destination = _Destination(base_url, self.per_host_concurrency)
+            self._destinations[base_url] = destination
+        destination.last_used = time.monotonic()
+        return destination
+
+    def _evict_idle(self):
+        """Close the clients of destinations nobody has used for PUSH_DESTINATION_IDLE_TTL."""
+        now = time.monotonic()
+        if now - self._last_evicted < PUSH_DESTINATION_IDLE_TTL / 2:
+            return
+        self._last_evicted = now
+        idle = [
+            base for base, d in self._destinations.items()
+            if d.users == 0 and now - d.last_used >= PUSH_DESTINATION_IDLE_TTL
+        ]
+        for base in idle:
+            task = asyncio.create_task(self._destinations.pop(base).client.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(PUSH_RETRY_BASE_DELAY * (2 ** (attempt - 1)), PUSH_RETRY_MAX_DELAY)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                logger.error(f"[PushDispatcher] Unexpected delivery error for {job.url}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, job: PushJob):
+        # Retries are awaited here, so later notifications of the task wait behind them
+        destination = self._destination(job.url)
+        destination.users += 1
+        try:
+            await self._attempt(job, destination)
+        finally:
+            destination.users -= 1
+            destination.last_used = time.monotonic()
+
+    async def _attempt(self, job: PushJob, destination: _Destination):
+        while True:
+            job.attempts += 1
+            error, retryable = None, False
+            async with destination.semaphore:
+                destination.in_flight += 1
+                try:
+                    response = await destination.client.post(
+                        job.url,
+                        content=job.body,
+                        headers={"Content-Type": "application/json", "Authorization": f"Bearer {job.sign()}"},
+                    )
+                    if response.status_code >= 400:
+                        error = f"HTTP {response.status_code}"
+                        retryable = response.status_code >= 500 or response.status_code == 429
+                except httpx.HTTPError as e:
+                    error, retryable = f"{type(e).__name__}: {e}", True
+                finally:
+                    destination.in_flight -= 1
+            if error is None:
+                self._latencies.append(time.monotonic() - job.enqueued_at)
+                self._count("delivered", job.source)
+                logger.info(f"Push notification sent to {job.url} (attempt {job.attempts})")
+                return
+            if not retryable or job.attempts > self.max_retries:
+                self._count("failed", job.source)
+                self._dead_letter(job, error)
+                if job.on_failed is not None:
+                    job.on_failed()
+                logger.warning(f"[PushDispatcher] Giving up on {job.url} after {job.attempts} attempt(s): {error}")
+                return
+            self._count("retried", job.source)
+            await asyncio.sleep(self._backoff(job.attempts))
+
+    def metrics(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def _pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_size": self.queue_size,
+            **self._counters,
+            "latency_seconds": {
+                "samples": len(latencies),
+                "p50": _pct(0.5),
+                "p95": _pct(0.95),
+                "max": round(latencies[-1], 4) if latencies else None,
+            },
+            "in_flight": {base: d.in_flight for base, d in self._destinations.items() if d.in_flight},
+            "by_source": {source: dict(c) for source, c in self._by_source.items()},
+            "dead_letters": len(self.dead_letters),
+        }
+
+    def source_metrics(self, source: str) -> dict:
+        """Counters for one source (agent), plus the shared queue depth."""
+        return {
+            "queue_depth": self.queue_depth,
+            **{name: 0 for name in self._counters},
+            **self._by_source.get(source, {}),
+            "dead_letters": [d for d in self.dead_letters if d["source"] == source],
+        }
+
+
+_dispatcher: Optional[PushNotificationDispatcher] = None
+
+
+def get_push_dispatcher() -> PushNotificationDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = PushNotificationDispatcher()
+    return _dispatcher
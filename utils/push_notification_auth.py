@@ -2,46 +2,84 @@ from jwcrypto import jwk
 import uuid
 from starlette.responses import JSONResponse
 from starlette.requests import Request
-from typing import Any
+from typing import Any, Callable, Optional
 from .logger import get_logger
 
 
 import jwt
+import os
 import time
 import json
+import asyncio
 import hashlib
 import httpx
 import logging
+from collections import OrderedDict
 
-from jwt import PyJWK, PyJWKClient
+from jwt import PyJWK
 
+from utils.key_manager import (
+    PUSH_SIGNING_ALG,
+    SUPPORTED_ALGORITHMS,
+    SigningKey,
+    SigningKeySet,
+    generate_signing_key,
+    get_key_manager,
+)
+from utils.push_dispatcher import get_push_dispatcher
+from utils.verified_url_cache import VERIFIED_URLS
 from utils.logger import get_logger
 logger = get_logger(__name__)
 AUTH_HEADER_PREFIX = 'Bearer '
 
+# How often receivers re-fetch the sender's JWKS in the background
+PUSH_JWKS_REFRESH_INTERVAL = float(os.getenv("PUSH_JWKS_REFRESH_INTERVAL", "300"))
+# Minimum gap between on-demand JWKS fetches triggered by an unknown kid
+PUSH_JWKS_MIN_REFETCH_INTERVAL = float(os.getenv("PUSH_JWKS_MIN_REFETCH_INTERVAL", "10"))
+PUSH_REPLAY_CACHE_SIZE = int(os.getenv("PUSH_REPLAY_CACHE_SIZE", "10000"))
+PUSH_MAX_TOKEN_AGE = 60 * 5
+
+
+def canonical_json_bytes(data: dict[str, Any]) -> bytes:
+    """The canonical JSON encoding that is hashed into the token and posted as the body."""
+    return json.dumps(
+        data,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode()
+
+
 class PushNotificationAuth:
     def _calculate_request_body_sha256(self, data: dict[str, Any]):
         """Calculates the SHA256 hash of a request body.
 
         This logic needs to be same for both the agent who signs the payload and the client verifier.
         """
-        body_str = json.dumps(
-            data,
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-        )
-        return hashlib.sha256(body_str.encode()).hexdigest()
+        return hashlib.sha256(canonical_json_bytes(data)).hexdigest()
 
 class PushNotificationSenderAuth(PushNotificationAuth):
-    def __init__(self):
+    def __init__(self, alg: str = PUSH_SIGNING_ALG):
         logger.debug("PushNotificationSenderAuth initialized")
-        self.public_keys = []
-        self.private_key_jwk: PyJWK = None
+        self.alg = alg
+        self.key_set: SigningKeySet | None = None
+
+    @property
+    def public_keys(self) -> list[dict[str, Any]]:
+        return self.key_set.public_jwks() if self.key_set else []
+
+    @property
+    def private_key_jwk(self) -> PyJWK | None:
+        return self.key_set.current.pyjwk if self.key_set and self.key_set.current else None
 
     @staticmethod
     async def verify_push_notification_url(url: str) -> bool:
+        """Challenge the URL, unless it was verified recently (see utils.verified_url_cache)."""
+        return await VERIFIED_URLS.verify(url, PushNotificationSenderAuth._challenge_push_notification_url)
+
+    @staticmethod
+    async def _challenge_push_notification_url(url: str) -> bool:
         async with httpx.AsyncClient(timeout=10) as client:
             try:
                 validation_token = str(uuid.uuid4())
@@ -60,11 +98,19 @@ class PushNotificationSenderAuth(PushNotificationAuth):
         return False
 
     def generate_jwk(self):
+        """Generate a fresh, unmanaged key inline. Prefer load_signing_key, which reuses
+        pre-generated or persisted keys from the key manager."""
         logger.info("Generating JWK")
-        key = jwk.JWK.generate(kty='RSA', size=2048, kid=str(uuid.uuid4()), use="sig")
-        self.public_keys.append(key.export_public(as_dict=True))
-        self.private_key_jwk = PyJWK.from_json(key.export_private())
-        logger.debug(f"Generated JWK: {self.private_key_jwk}")
+        key = SigningKey(generate_signing_key(self.alg))
+        if self.key_set is None:
+            self.key_set = SigningKeySet("local")
+        self.key_set.rotate(key)
+        logger.debug(f"Generated JWK: {key.kid}")
+
+    async def load_signing_key(self, owner: str):
+        """Attach the key set the key manager holds for owner (e.g. the agent name)."""
+        self.key_set = await get_key_manager().get_key_set(owner)
+        logger.info(f"Using {self.key_set.current.alg} signing key {self.key_set.current.kid} for {owner}")
     
     def handle_jwks_endpoint(self, _request: Request):
         """Allow clients to fetch public keys.
@@ -73,7 +119,7 @@ class PushNotificationSenderAuth(PushNotificationAuth):
             "keys": self.public_keys
         })
     
-    def _generate_jwt(self, data: dict[str, Any]):
+    def _generate_jwt(self, data: dict[str, Any], body_sha256: str | None = None):
         """JWT is generated by signing both the request payload SHA digest and time of token generation.
 
         Payload is signed with private key and it ensures the integrity of payload for client.
@@ -81,12 +127,29 @@ class PushNotificationSenderAuth(PushNotificationAuth):
         """
         
         iat = int(time.time())
+        signing_key = self.key_set.current
+        if body_sha256 is None:
+            body_sha256 = self._calculate_request_body_sha256(data)
 
         return jwt.encode(
-            {"iat": iat, "request_body_sha256": self._calculate_request_body_sha256(data)},
-            key=self.private_key_jwk,
-            headers={"kid": self.private_key_jwk.key_id},
-            algorithm="RS256"
+            {"iat": iat, "request_body_sha256": body_sha256},
+            key=signing_key.pyjwk,
+            headers={"kid": signing_key.kid},
+            algorithm=signing_key.alg
+        )
+
+    def enqueue_push_notification(
+        self, url: str, data: dict[str, Any], on_failed: Optional[Callable[[], None]] = None
+    ) -> bool:
+        """Hand the notification to the background dispatcher and return immediately.
+        The JWT is generated per delivery attempt, so retries are not rejected as stale.
+        on_failed is called if the dispatcher gives up on it after accepting it."""
+        owner = self.key_set.owner if self.key_set else None
+        body = canonical_json_bytes(data)
+        body_sha256 = hashlib.sha256(body).hexdigest()
+        return get_push_dispatcher().submit(
+            url, body, lambda: self._generate_jwt(data, body_sha256), source=owner, task_id=data.get("id"),
+            on_failed=on_failed,
         )
 
     async def send_push_notification(self, url: str, data: dict[str, Any]):
@@ -98,8 +161,8 @@ class PushNotificationSenderAuth(PushNotificationAuth):
             try:
                 response = await client.post(
                     url,
-                    json=data,
-                    headers=headers
+                    content=canonical_json_bytes(data),
+                    headers={**headers, "Content-Type": "application/json"}
                 )
                 response.raise_for_status()
                 logger.info(f"Push-notification sent for URL: {url}")       
@@ -108,37 +171,139 @@ class PushNotificationSenderAuth(PushNotificationAuth):
                 logger.warning(f"Error during sending push-notification for URL {url}: {e}")
 
 class PushNotificationReceiverAuth(PushNotificationAuth):
-    def __init__(self):
-        self.public_keys_jwks = []
-        self.jwks_client = None
+    """Verifies signed push notifications without blocking the event loop.
+
+    Public keys are fetched asynchronously, cached by kid and refreshed in the
+    background; an unknown kid (e.g. after the sender rotated keys) triggers a
+    rate-limited re-fetch. The raw body is hashed as received, falling back to
+    re-serializing the parsed body for senders that don't post canonical JSON.
+    Recently seen (kid, iat, body digest) triples are rejected as replays.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = PUSH_JWKS_REFRESH_INTERVAL,
+        replay_cache_size: int = PUSH_REPLAY_CACHE_SIZE,
+        max_token_age: float = PUSH_MAX_TOKEN_AGE,
+    ):
+        self.refresh_interval = refresh_interval
+        self.replay_cache_size = replay_cache_size
+        self.max_token_age = max_token_age
+        self.jwks_urls: list[str] = []
+        self.public_keys_jwks: dict[str, PyJWK] = {}
+        self._http: httpx.AsyncClient | None = None
+        self._refresh_task: asyncio.Task | None = None
+        self._fetch: asyncio.Task | None = None
+        self._last_fetch = 0.0
+        self._seen: "OrderedDict[tuple[str, int, str], None]" = OrderedDict()
 
     async def load_jwks(self, jwks_url: str):
-        self.jwks_client = PyJWKClient(jwks_url)
-    
-    async def verify_push_notification(self, request: Request) -> bool:
+        """Register a sender's JWKS URL, fetch its keys now and keep them refreshed."""
+        if jwks_url not in self.jwks_urls:
+            self.jwks_urls.append(jwks_url)
+        await self._refresh_keys(force=True)
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self._refresh_keys(force=True)
+            except Exception as e:
+                logger.warning(f"JWKS refresh failed: {e}")
+
+    async def _refresh_keys(self, force: bool = False):
+        """Fetch all registered JWKS; concurrent callers share one fetch."""
+        if not force and time.monotonic() - self._last_fetch < PUSH_JWKS_MIN_REFETCH_INTERVAL:
+            return
+        if self._fetch is None or self._fetch.done():
+            self._fetch = asyncio.create_task(self._fetch_keys())
+        await asyncio.shield(self._fetch)
+
+    async def _fetch_keys(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=10)
+        self._last_fetch = time.monotonic()
+        keys: dict[str, PyJWK] = {}
+        for url in self.jwks_urls:
+            response = await self._http.get(url)
+            response.raise_for_status()
+            for key_data in response.json().get("keys", []):
+                try:
+                    key = PyJWK(key_data)
+                except Exception as e:
+                    logger.debug(f"Skipping unusable JWK from {url}: {e}")
+                    continue
+                if key.key_id:
+                    keys[key.key_id] = key
+        # Keep keys from a URL that failed this round rather than dropping them
+        self.public_keys_jwks = {**self.public_keys_jwks, **keys}
+
+    async def _get_signing_key(self, kid: str) -> PyJWK:
+        key = self.public_keys_jwks.get(kid)
+        if key is None:
+            await self._refresh_keys()
+            key = self.public_keys_jwks.get(kid)
+        if key is None:
+            raise ValueError(f"Unknown signing key: {kid}")
+        return key
+
+    def _check_replay(self, kid: str, iat: int, body_sha256: str):
+        entry = (kid, iat, body_sha256)
+        if entry in self._seen:
+            raise ValueError("Notification was already received (replay)")
+        self._seen[entry] = None
+        # Drop entries too old to pass the iat check anyway, then enforce the size bound
+        cutoff = time.time() - self.max_token_age
+        while self._seen and (next(iter(self._seen))[1] < cutoff or len(self._seen) > self.replay_cache_size):
+            self._seen.popitem(last=False)
+
+    async def verify_push_notification(
+        self, request: Request, body: bytes | None = None, data: dict[str, Any] | None = None
+    ) -> bool:
+        """Verify the request's token against its body. Pass the raw body (and the parsed
+        data, if already parsed) to avoid reading and parsing the request again."""
         auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith(AUTH_HEADER_PREFIX):
             print("Invalid authorization header")
             return False
         
         token = auth_header[len(AUTH_HEADER_PREFIX):]
-        signing_key = self.jwks_client.get_signing_key_from_jwt(token)
+        kid = jwt.get_unverified_header(token).get("kid")
+        signing_key = await self._get_signing_key(kid)
 
         decode_token = jwt.decode(
             token,
             signing_key,
             options={"require": ["iat", "request_body_sha256"]},
-            algorithms=["RS256"],
+            algorithms=list(SUPPORTED_ALGORITHMS),
         )
 
-        actual_body_sha256 = self._calculate_request_body_sha256(await request.json())
-        if actual_body_sha256 != decode_token["request_body_sha256"]:
+        if body is None:
+            body = await request.body()
+        expected_sha256 = decode_token["request_body_sha256"]
+        actual_body_sha256 = hashlib.sha256(body).hexdigest()
+        if actual_body_sha256 != expected_sha256:
+            # Not posted as canonical JSON: hash the canonical form of the parsed body
+            actual_body_sha256 = self._calculate_request_body_sha256(data if data is not None else json.loads(body))
+        if actual_body_sha256 != expected_sha256:
             # Payload signature does not match the digest in signed token.
             raise ValueError("Invalid request body")
         
-        if time.time() - decode_token["iat"] > 60 * 5:
+        if time.time() - decode_token["iat"] > self.max_token_age:
             # Do not allow push-notifications older than 5 minutes.
             # This is to prevent replay attack.
             raise ValueError("Token is expired")
-        
+
+        self._check_replay(kid, decode_token["iat"], expected_sha256)
         return True
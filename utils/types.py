@@ -302,6 +302,13 @@ class ContentTypeNotSupportedError(JSONRPCError):
     data: None = None
 
 
+class AgentBusyError(JSONRPCError):
+    code: int = -32006
+    message: str = "Agent is busy, retry later"
+    # {"retryAfter": seconds}
+    data: dict[str, Any] | None = None
+
+
 class AgentProvider(BaseModel):
     organization: str
     url: str | None = None
@@ -0,0 +1,87 @@
+"""Process-wide cache of verified push-notification URLs.
+
+A URL that answered the validation challenge is trusted for PUSH_URL_VERIFY_TTL
+seconds by every agent in the engine, so clients reusing one callback URL for
+many tasks aren't challenged on every tasks/send. Entries are evicted least
+recently used once PUSH_URL_CACHE_SIZE is reached, and concurrent verifications
+of the same URL share a single challenge. Failed verifications are only cached
+if PUSH_URL_NEGATIVE_TTL is set.
+"""
+
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from utils.logger import get_logger
+logger = get_logger(__name__)
+
+PUSH_URL_VERIFY_TTL = float(os.getenv("PUSH_URL_VERIFY_TTL", "3600"))
+PUSH_URL_NEGATIVE_TTL = float(os.getenv("PUSH_URL_NEGATIVE_TTL", "0"))
+PUSH_URL_CACHE_SIZE = int(os.getenv("PUSH_URL_CACHE_SIZE", "10000"))
+
+
+class VerifiedURLCache:
+    def __init__(self, ttl: float = PUSH_URL_VERIFY_TTL, negative_ttl: float = PUSH_URL_NEGATIVE_TTL, max_size: int = PUSH_URL_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[bool, float]]" = OrderedDict()  # url -> (verified, expires_at)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[bool]:
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        verified, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[url]
+            return None
+        self._entries.move_to_end(url)
+        return verified
+
+    def set(self, url: str, verified: bool):
+        ttl = self.ttl if verified else self.negative_ttl
+        if ttl <= 0:
+            self._entries.pop(url, None)
+            return
+        self._entries[url] = (verified, time.monotonic() + ttl)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def verify(self, url: str, challenge: Callable[[str], Awaitable[bool]]) -> bool:
+        """Return the cached result for url, or run `challenge` once for all concurrent callers."""
+        cached = self.get(url)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.create_task(self._challenge(url, challenge))
+            self._inflight[url] = task
+        return await asyncio.shield(task)
+
+    async def _challenge(self, url: str, challenge) -> bool:
+        try:
+            verified = await challenge(url)
+            self.set(url, verified)
+            return verified
+        finally:
+            self._inflight.pop(url, None)
+
+    def metrics(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def invalidate(self, url: Optional[str] = None):
+        if url is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(url, None)
+
+
+VERIFIED_URLS = VerifiedURLCache()